@@ -222,7 +222,8 @@ with tab5:
                 "player_not_moment",
                 "player_moment"
                 # "Pack Type",
-            ]
+            ],
+            observed=True,
         )
         .agg(
             Price=("Price", "mean"),
@@ -303,7 +304,8 @@ with tab5:
                 "player_not_moment",
                 "player_moment"
                 # "Pack Type",
-            ]
+            ],
+            observed=True,
         )
         .agg(
             Price=("Price", "mean"),
@@ -421,12 +423,17 @@ with tab5:
     try:
         x = (
             player_mint.groupby(
-                ["Player", "marketplace_id", "minted_moment", "Moment_Tier"]
+                ["Player", "marketplace_id", "minted_moment", "Moment_Tier"],
+                observed=True,
             )["Price"]
             .mean()
             .reset_index()
         )
-        y = x.groupby(["Player", "Moment_Tier"]).nunique().reset_index()
+        y = (
+            x.groupby(["Player", "Moment_Tier"], observed=True)
+            .nunique()
+            .reset_index()
+        )
         y = y[y.minted_moment > 1]
         x = x[x.Player.isin(y.Player)]
         z = []
@@ -547,20 +554,23 @@ with tab5:
     c2.altair_chart(chart)
 
     st.subheader("Try your luck at minting a pack!")
-    simulation = load_simulation()
-    info = simulation.groupby('Pack Type').agg(mean=('Price', 'mean'), median=('Price', 'median')).reset_index()
-    
+    simulation, simulation_summary = load_simulation()
+    info = simulation_summary.set_index("Pack Type")
+    # Describe the draws the values actually came from, as the cache may predate
+    # circulation weighting
+    weight_note = get_pack_weight_note(simulation_summary.weight.iloc[0])
+
     c1, c2 = st.columns(2)
     c1.write(
         f"""
         We used actual sales data to see the value of Moments available in the Series 2, Week 1-2 Packs.
         Choose your pack type, and click the button to simulate a mint!
 
-        Note: the process used here does not capture the rarity of certain moments (such as some Rare Moments having lower total numbers than other Rare Moments), however it does capture the frequency at which each Moment is traded. More liquid Moments (with higher numbers of sales) will be more likely to appear. Pack mints were precomputed (10,000 times for Standard packs and 5,000 times for Premium packs) due to computational resources.
+        Note: {weight_note} The packs you mint are drawn from {n_sample_packs['Standard']:,} Standard and {n_sample_packs['Premium']:,} Premium simulated packs.
 
-        We ran a simulation 1000 times, and found the following:
-        - For Standard packs, the mean value is \${info[info['Pack Type']=='Standard']['mean'].values[0]:.2f} (median value is \${info[info['Pack Type']=='Standard']['median'].values[0]:.2f}). {info[info['Pack Type']=='Standard']['mean'].values[0]:.2f}). {simulation[simulation['Pack Type']=='Standard'][simulation.Price > 59].Price.count() / len(simulation[simulation['Pack Type']=='Standard']):.2%} of the time, the value is more than the $59 price.
-        - For Premium packs, the mean value is \${info[info['Pack Type']=='Premium']['mean'].values[0]:.2f} (median value is \${info[info['Pack Type']=='Premium']['median'].values[0]:.2f}). {simulation[simulation['Pack Type']=='Premium'][simulation.Price > 219].Price.count() / len(simulation[simulation['Pack Type']=='Premium']):.2%} of the time, the value is more than the $219 price.
+        We simulated {info.loc['Standard', 'packs']:,} Standard and {info.loc['Premium', 'packs']:,} Premium packs, and found the following:
+        - For Standard packs, the mean value is \${info.loc['Standard', 'mean']:.2f} (median value is \${info.loc['Standard', 'median']:.2f}). {info.loc['Standard', 'above_cost']:.2%} of the time, the value is more than the ${pack_costs['Standard']} price.
+        - For Premium packs, the mean value is \${info.loc['Premium', 'mean']:.2f} (median value is \${info.loc['Premium', 'median']:.2f}). {info.loc['Premium', 'above_cost']:.2%} of the time, the value is more than the ${pack_costs['Premium']} price.
         """
     )
     
@@ -865,7 +875,8 @@ with tab4:
                     "site",
                     "Display",
                     "during_game",
-                ]
+                ],
+                observed=True,
             )
             .agg(
                 Price=("Price", "mean"),
@@ -885,7 +896,8 @@ with tab4:
                     "site",
                     "Display",
                     "during_challenge",
-                ]
+                ],
+                observed=True,
             )
             .agg(
                 Price=("Price", "mean"),
@@ -1143,7 +1155,7 @@ with tab4:
                 "core",
             ] = True
             grouped_price_df = (
-                price_df.groupby(["Moment_Tier", "Rarity", "core"])
+                price_df.groupby(["Moment_Tier", "Rarity", "core"], observed=True)
                 .Price.mean()
                 .reset_index()
                 .sort_values(by=["Rarity", "core"])[["Moment_Tier", "core", "Price"]]
@@ -1599,12 +1611,12 @@ with tab2:
         )
 
         grouped = (
-            df.groupby(["Date", "Player", "Position", "Team"])
+            df.groupby(["Date", "Player", "Position", "Team"], observed=True)
             .Price.agg(agg_metric)
             .reset_index()
         )
         video_url = (
-            df.groupby(["Date", "Player", "Position", "Team"])
+            df.groupby(["Date", "Player", "Position", "Team"], observed=True)
             .NFLALLDAY_ASSETS_URL.first()
             .reset_index()
         )
@@ -1709,8 +1721,8 @@ with tab2:
                 f"{others.Price.agg(agg_metric):,.2f}",
             )
         else:
-            top_count = top_price.groupby("Player").Price.count()
-            others_count = others.groupby("Player").Price.count()
+            top_count = top_price.groupby("Player", observed=True).Price.count()
+            others_count = others.groupby("Player", observed=True).Price.count()
             c1.metric(
                 f"Average Sales Count, Top Players (for selected positions)",
                 f"{top_count.mean():,.2f}",
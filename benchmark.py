@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Benchmark the Flipside ingestion (the packs and sales stages of
+gather_data.py) offline, against a `FixtureBackend` at multiples of the
+recorded data volume.
+
+Record the fixtures once, with the Flipside API key in the Streamlit secrets:
+
+    python benchmark.py data/fixtures --record
+
+then compare runs without network access, e.g. with half a second of latency
+per query:
+
+    python benchmark.py data/fixtures --scales 1 10 100 --latency 0.5
+
+Every run starts from an empty data directory, so it measures a full
+refresh: the queries, writing their results and combining them.
+"""
+
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+import gather_data
+from flipside import FixtureBackend, build_fixtures
+
+stages = {"packs": gather_data.gather_packs, "sales": gather_data.gather_sales}
+
+
+@contextlib.contextmanager
+def scratch_dir():
+    """Run in an empty temporary data directory next to the repo's `sql/`."""
+    cwd = Path.cwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        (Path(tmp) / "sql").symlink_to(cwd / "sql")
+        (Path(tmp) / "data").mkdir()
+        os.chdir(tmp)
+        try:
+            yield Path(tmp)
+        finally:
+            os.chdir(cwd)
+
+
+def record_fixtures(fixture_dir, args):
+    with tempfile.TemporaryDirectory() as recording_dir:
+        gather_args = gather_data.get_parser().parse_args(
+            ["--full-refresh", "--record", recording_dir]
+        )
+        backend = gather_data.get_backend(gather_args)
+        with scratch_dir():
+            for x in args.stages:
+                stages[x](gather_args, backend)
+        build_fixtures(recording_dir, fixture_dir)
+
+
+def run_benchmark(fixture_dir, scale, stage, args):
+    backend = FixtureBackend(fixture_dir, args.latency, args.rows_per_second, scale)
+    gather_args = gather_data.get_parser().parse_args(
+        ["--full-refresh", "--concurrency", str(args.concurrency)]
+    )
+    with scratch_dir():
+        start = time.perf_counter()
+        stages[stage](gather_args, backend)
+        seconds = time.perf_counter() - start
+    fetch_seconds = (backend.last_result or start) - (backend.first_query or start)
+    return {
+        "scale": scale,
+        "stage": stage,
+        "queries": backend.queries,
+        "rows": backend.rows,
+        "fetch_s": fetch_seconds,
+        "queries_per_s": backend.queries / fetch_seconds if fetch_seconds else None,
+        "rows_per_s": backend.rows / fetch_seconds if fetch_seconds else None,
+        "total_s": seconds,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fixture_dir", type=Path)
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="fetch the fixtures from Flipside first (needs the API key)",
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+        help="multiples of the recorded data volume to run at",
+    )
+    parser.add_argument(
+        "--stages", nargs="+", choices=list(stages), default=list(stages)
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per query")
+    parser.add_argument(
+        "--rows-per-second",
+        type=float,
+        default=None,
+        help="simulated transfer rate of query results (default: instant)",
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    fixture_dir = args.fixture_dir.resolve()
+    if args.record:
+        record_fixtures(fixture_dir, args)
+    results = []
+    for scale in args.scales:
+        for stage in args.stages:
+            results.append(run_benchmark(fixture_dir, scale, stage, args))
+            print(f"#@# {results[-1]}")
+    print(pd.DataFrame(results).round(2).to_string(index=False))
@@ -1,35 +1,32 @@
 #!/usr/bin/env python3
+import argparse
 import datetime
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
 
+from store import (
+    BackgroundWriter,
+    SharedFrame,
+    combine_aggregates,
+    legacy_ttest_file,
+    update_daily_aggregates,
+    write_ttests,
+)
 from utils import *
 
+save_full = False
+# Input frames of the current stage by name, see run_stage
+frames = {}
+# Frames this worker process has read, by the path they are shared at
+worker_frames = {}
 
-def get_score_data(score_data, date_range):
-    # #TODO: clean up date ranges
-    if date_range == "All Time":
-        df = score_data
-    elif date_range == "2022 Full Season":
-        start = week_timings[1][0]
-        df = score_data[score_data.Date >= start]
-    elif date_range == "2022 Week 1":
-        start, end = week_timings[1]
-        df = score_data[(score_data.Date >= start) & (score_data.Date < end)]
-    elif date_range == "2022 Week 2":
-        start, end = week_timings[2]
-        df = score_data[(score_data.Date >= start) & (score_data.Date < end)]
-    elif date_range == "2022 Week 3":
-        start, end = week_timings[3]
-        df = score_data[(score_data.Date >= start) & (score_data.Date < end)]
-    elif date_range == "2022 Week 4":
-        start, end = week_timings[4]
-        df = score_data[(score_data.Date >= start) & (score_data.Date < end)]
-    elif date_range == "2022 Week 5":
-        start, end = week_timings[5]
-        df = score_data[(score_data.Date >= start) & (score_data.Date < end)]
+
+def get_score_data(score_dates, date_range):
+    df = score_dates[date_range]
 
     grouped = df.groupby(["marketplace_id"]).agg(agg_dict).reset_index()
     grouped["Week"] = grouped.Week.astype(str)
@@ -46,36 +43,16 @@ def get_score_data(score_data, date_range):
     return df, grouped
 
 
-def get_player_data(main_data, date_range, agg_metric):
-    # #TODO: clean up date ranges
-    if date_range == "All Time":
-        df = main_data
-    elif date_range == "2022 Full Season":
-        start = week_timings[1][0]
-        df = score_data[score_data.Date >= start]
-    elif date_range == "2022 Week 1":
-        start, end = week_timings[1]
-        df = score_data[(score_data.Date >= start) & (score_data.Date < end)]
-    elif date_range == "2022 Week 2":
-        start, end = week_timings[2]
-        df = score_data[(score_data.Date >= start) & (score_data.Date < end)]
-    elif date_range == "2022 Week 3":
-        start, end = week_timings[3]
-        df = score_data[(score_data.Date >= start) & (score_data.Date < end)]
-    elif date_range == "2022 Week 4":
-        start, end = week_timings[4]
-        df = score_data[(score_data.Date >= start) & (score_data.Date < end)]
-    elif date_range == "2022 Week 5":
-        start, end = week_timings[5]
-        df = score_data[(score_data.Date >= start) & (score_data.Date < end)]
+def get_player_data(main_dates, date_range, agg_metric):
+    df = main_dates[date_range]
 
     grouped = (
-        df.groupby(["Date", "Player", "Position", "Team"])
+        df.groupby(["Date", "Player", "Position", "Team"], observed=True)
         .Price.agg(agg_metric)
         .reset_index()
     )
     video_url = (
-        df.groupby(["Date", "Player", "Position", "Team"])
+        df.groupby(["Date", "Player", "Position", "Team"], observed=True)
         .NFLALLDAY_ASSETS_URL.first()
         .reset_index()
     )
@@ -85,58 +62,25 @@ def get_player_data(main_data, date_range, agg_metric):
     return grouped
 
 
-def get_play_v_player_data(main_data, date_range):
-    # #TODO: clean up date ranges
-    if date_range == "Since 2022 preseason":
-        df = main_data[main_data.Date >= "2022-08-04"]
-    elif date_range == "Since 2022 Week 1":
-        start = week_timings[1][0]
-        df = main_data[main_data.Date >= start]
-    elif date_range == "Since 2022 Week 2":
-        start = week_timings[2][0]
-        df = main_data[main_data.Date >= start]
-    elif date_range == "Since 2022 Week 3":
-        start = week_timings[3][0]
-        df = main_data[main_data.Date >= start]
-    elif date_range == "Since 2022 Week 4":
-        start = week_timings[4][0]
-        df = main_data[main_data.Date >= start]
-    elif date_range == "Since 2022 Week 5":
-        start = week_timings[5][0]
-        df = main_data[main_data.Date >= start]
-    else:
-        df = main_data
-
-    play_type_price_data = (
-        df.groupby(
-            [
-                "Play_Type",
-            ]
-        )["Price"]
-        .agg(["mean", "count"])
-        .reset_index()
-    )
+def get_play_v_player_data(daily_dates, date_range):
+    # Summed from the per day partials rather than grouping the sales again
+    daily = daily_dates[date_range]
+
+    play_type_price_data = combine_aggregates(daily, ["Play_Type"])[
+        ["Play_Type", "mean", "count"]
+    ]
     play_type_price_data["Position"] = "N/A"
-    play_type_tier_price_data = (
-        df.groupby(
-            [
-                "Play_Type",
-                "Moment_Tier",
-            ]
-        )["Price"]
-        .agg(["mean", "count"])
-        .reset_index()
-    )
+    play_type_tier_price_data = combine_aggregates(
+        daily, ["Play_Type", "Moment_Tier"]
+    )[["Play_Type", "Moment_Tier", "mean", "count"]]
     play_type_tier_price_data["Position"] = "N/A"
 
-    player_price_data = (
-        df.groupby(["Player", "Position"])["Price"].agg(["mean", "count"]).reset_index()
-    )
-    player_tier_price_data = (
-        df.groupby(["Player", "Moment_Tier", "Position"])["Price"]
-        .agg(["mean", "count"])
-        .reset_index()
-    )
+    player_price_data = combine_aggregates(daily, ["Player", "Position"])[
+        ["Player", "Position", "mean", "count"]
+    ]
+    player_tier_price_data = combine_aggregates(
+        daily, ["Player", "Moment_Tier", "Position"]
+    )[["Player", "Moment_Tier", "Position", "mean", "count"]]
     topN_player_data = (
         player_price_data.sort_values("mean", ascending=False)
         .reset_index(drop=True)
@@ -151,188 +95,344 @@ def get_play_v_player_data(main_data, date_range):
     )
 
 
-def get_pack_data(grouped_pack, date_range_choice, date_range):
-    if date_range_choice == "By Date Range":
-        if date_range == "Since 2022 preseason":
-            df = grouped_pack[grouped_pack["Datetime_Pack"] >= "2022-08-04"]
-        elif date_range == "Since 2022 Week 1":
-            start = week_timings[1][0]
-            df = grouped_pack[grouped_pack["Datetime_Pack"] >= start]
-        elif date_range == "Since 2022 Week 2":
-            start = week_timings[2][0]
-            df = grouped_pack[grouped_pack["Datetime_Pack"] >= start]
-        elif date_range == "Since 2022 Week 3":
-            start = week_timings[3][0]
-            df = grouped_pack[grouped_pack["Datetime_Pack"] >= start]
-        elif date_range == "Since 2022 Week 4":
-            start = week_timings[4][0]
-            df = grouped_pack[grouped_pack["Datetime_Pack"] >= start]
-        elif date_range == "Since 2022 Week 5":
-            start = week_timings[5][0]
-            df = grouped_pack[grouped_pack["Datetime_Pack"] >= start]
-        else:
-            df = grouped_pack
-    elif date_range_choice == "By Selected Drop":
-        start, end = date_range
-        df = grouped_pack[
-            (grouped_pack["Datetime_Pack"] >= start)
-            & (grouped_pack["Datetime_Pack"] <= end)
-        ]
-    return df
-
+def get_pack_data(pack_dates, date_range):
+    return pack_dates[date_range]
 
-if __name__ == "__main__":
-    save_full = False
-    main_data = load_allday_data(cols_to_keep)
-    main_data["Position Group"] = main_data.Position.apply(get_position_group)
 
-    score_data = main_data[main_data.Play_Type.isin(score_columns)].reset_index(
-        drop=True
-    )
-    score_data = score_data.rename(columns=td_mapping)
-    score_ttest_results = {}
-    for date_range in main_date_ranges:
-        date_str = date_range.replace(" ", "_")
-        df, grouped = get_score_data(score_data, date_range)
-        if save_full:
-            df.to_csv(
-                f"data/cache/score-{date_str}--df.csv.gz",
-                compression="gzip",
-                index=False,
-            )
-        grouped.to_csv(
-            f"data/cache/{date_str}--grouped.csv",
+def score_job(writer, date_range):
+    """Write the score data for `date_range` and return its t-test results,
+    as rows for `write_ttests`."""
+    date_str = date_range.replace(" ", "_")
+    df, grouped = get_score_data(frames["score"], date_range)
+    if save_full:
+        writer.to_csv(
+            df,
+            f"data/cache/score-{date_str}--df.csv.gz",
+            compression="gzip",
             index=False,
         )
-        for play_type in ["All"] + score_columns:
-            for how_scores in td_mapping.values():
-                # substr = (
-                #     f"{date_range}--{play_type}--{how_scores}".replace(" ", "_")
-                #     .replace(")", "")
-                #     .replace("(", "")
-                # )
-                # print(f"#@# Working on: {substr}")
-
-                df["Scored Touchdown?"] = df[how_scores]
-                if play_type != "All":
-                    df = df[df.Play_Type == play_type]
-                for agg_metric in ["Average Sales Price ($)", "Sales Count"]:
-                    for position_type in position_type_dict.keys():
-                        if position_type == "By Position":
-                            pos_subset = [
-                                x
-                                for x in positions
-                                if x in ["All"] + df.Position.unique().tolist()
-                            ]
-                            pos_column = position_type_dict[position_type][0]
+    writer.to_cache(grouped, "score", date_str)
+    ttest_rows = []
+    for play_type in ["All"] + score_columns:
+        if play_type != "All":
+            df = df[df.Play_Type == play_type]
+        # Every test for this play type, run as one batch per DataFrame
+        tests = {}
+        for how_scores in td_mapping.values():
+            for agg_metric in ["Average Sales Price ($)", "Sales Count"]:
+                for position_type in position_type_dict.keys():
+                    if position_type == "By Position":
+                        pos_subset = [
+                            x
+                            for x in positions
+                            if x in ["All"] + df.Position.unique().tolist()
+                        ]
+                        pos_column = position_type_dict[position_type][0]
+                    else:
+                        pos_subset = position_type_dict[position_type][1]
+                        pos_column = position_type_dict[position_type][0]
+                    for metric, short_form in [
+                        (
+                            how_scores,
+                            "TDs",
+                        ),
+                        (
+                            "won_game",
+                            "Winners",
+                        ),
+                        (
+                            [
+                                "Best Guess (Moment TD)",
+                                "Description only (Moment TD)",
+                            ],
+                            "Best Guess Moment",
+                        ),
+                        (
+                            [
+                                "Best Guess: (In-game TD)",
+                                "Description only (Moment TD)",
+                            ],
+                            "Best Guess Game",
+                        ),
+                    ]:
+                        if agg_metric == "Sales Count" and type(metric) == str:
+                            ttest_df = "grouped"
+                            agg_column = "tx_id"
                         else:
-                            pos_subset = position_type_dict[position_type][1]
-                            pos_column = position_type_dict[position_type][0]
-                        for metric, short_form in [
-                            (
-                                how_scores,
-                                "TDs",
-                            ),
+                            ttest_df = "df"
+                            agg_column = "Price"
+                        key = (
+                            date_range,
+                            play_type,
+                            how_scores,
+                            agg_metric,
+                            position_type,
+                            json.dumps(metric),
+                            short_form,
+                        )
+                        tests[key] = (
+                            ttest_df,
                             (
-                                "won_game",
-                                "Winners",
-                            ),
-                            (
-                                [
-                                    "Best Guess (Moment TD)",
-                                    "Description only (Moment TD)",
-                                ],
-                                "Best Guess Moment",
-                            ),
-                            (
-                                [
-                                    "Best Guess: (In-game TD)",
-                                    "Description only (Moment TD)",
-                                ],
-                                "Best Guess Game",
-                            ),
-                        ]:
-                            if agg_metric == "Sales Count" and type(metric) == str:
-                                ttest_df = grouped
-                                agg_column = "tx_id"
-                            else:
-                                ttest_df = df
-                                agg_column = "Price"
-                            ttest_res = get_ttests(
-                                ttest_df,
                                 metric,
                                 pos_subset,
                                 short_form,
                                 pos_column,
                                 agg_column,
-                            )
-                            substr = (
-                                f"{date_range}--{play_type}--{how_scores}--{agg_metric}--{position_type}--{metric}--{short_form}".replace(
-                                    " ", "_"
-                                )
-                                .replace(")", "")
-                                .replace("(", "")
-                            )
-                            print(f"#@# Working on: {substr}")
-                            score_ttest_results[substr] = ttest_res
-
-    with open("data/cache/score_ttest_results.json", "w") as f:
-        json.dump(score_ttest_results, f)
-
-    for date_range in main_date_ranges:
-        date_str = date_range.replace(" ", "_")
-        for agg_metric in ["median", "mean", "count"]:
-            grouped = get_player_data(main_data, date_range, agg_metric)
-            grouped.to_csv(
-                f"data/cache/player-{date_str}-{agg_metric}--grouped.csv",
-                index=False,
-            )
+                            ),
+                        )
+        for ttest_df, data in [("df", df), ("grouped", grouped)]:
+            keys = [k for k, v in tests.items() if v[0] == ttest_df]
+            values = get_ttest_values(data, [tests[k][1] for k in keys])
+            for key, x in zip(keys, values):
+                tests[key] = (tests[key][1][-1], x)
+        for key, (agg_column, values) in tests.items():
+            print(f"#@# Working on: {'--'.join(key)}")
+            for i, x in enumerate(values):
+                ttest_rows.append((*key, agg_column, i, *x))
+    return ttest_rows
 
-    del score_data
-    _, grouped_pack = load_pack()
-    for date_range in play_v_player_date_ranges:
-        date_str = date_range.replace(" ", "_")
-        (
-            play_type_price_data,
-            play_type_tier_price_data,
-            player_tier_price_data,
-            topN_player_data,
-        ) = get_play_v_player_data(main_data, date_range)
-        play_type_price_data.to_csv(
-            f"data/cache/play_v_player-play_type-{date_str}--grouped.csv",
-            index=False,
-        )
-        play_type_tier_price_data.to_csv(
-            f"data/cache/play_v_player-play_type_tier-{date_str}--grouped.csv",
-            index=False,
+
+def player_job(writer, date_range, agg_metric):
+    date_str = date_range.replace(" ", "_")
+    grouped = get_player_data(frames["main"], date_range, agg_metric)
+    writer.to_cache(grouped, "player", date_str, agg_metric)
+
+
+def play_v_player_job(writer, date_range):
+    date_str = date_range.replace(" ", "_")
+    (
+        play_type_price_data,
+        play_type_tier_price_data,
+        player_tier_price_data,
+        topN_player_data,
+    ) = get_play_v_player_data(frames["daily"], date_range)
+    writer.to_cache(play_type_price_data, "play_v_player_play_type", date_str)
+    writer.to_cache(
+        play_type_tier_price_data, "play_v_player_play_type_tier", date_str
+    )
+    writer.to_cache(player_tier_price_data, "play_v_player_player_tier", date_str)
+    writer.to_cache(topN_player_data, "play_v_player_topN_player", date_str)
+
+
+def pack_job(writer, date_range, date_str):
+    pack_df = get_pack_data(frames["pack"], date_range)
+    writer.to_cache(pack_df, "pack_data", date_str)
+
+
+def player_mint_job(writer, i):
+    """Sales during drop `i` of `pack_date_ranges`, flagging the players and
+    moments minted before the next drop."""
+    player_pack_data = frames["player_pack"]
+    x = pack_date_ranges[i]
+    start = pd.to_datetime(x[0]).tz_localize("US/Eastern")
+    end = pd.to_datetime(x[1]).tz_localize("US/Eastern")
+    try:
+        next_start = pd.to_datetime(pack_date_ranges[i + 1][0]).tz_localize(
+            "US/Eastern"
         )
-        player_tier_price_data.to_csv(
-            f"data/cache/play_v_player-player_tier-{date_str}--grouped.csv",
-            index=False,
+        next_end = pd.to_datetime(pack_date_ranges[i + 1][1]).tz_localize(
+            "US/Eastern"
         )
-        topN_player_data.to_csv(
-            f"data/cache/play_v_player-topN_player-{date_str}--grouped.csv",
-            index=False,
+    except IndexError:
+        next_start = pd.to_datetime(datetime.datetime.now()).tz_localize(
+            "US/Eastern"
         )
+        next_end = pd.to_datetime(datetime.datetime.now()).tz_localize("US/Eastern")
+    df = player_pack_data[
+        (player_pack_data.Datetime >= start)
+        & (player_pack_data.Datetime < end + pd.Timedelta("1d"))
+    ]
+    df = df[
+        [
+            "Datetime",
+            "Date",
+            "Price",
+            "Player",
+            "Team",
+            "Position",
+            "Play_Type",
+            "Moment_Date",
+            "Moment_Tier",
+            "Series",
+            "Set_Name",
+            "marketplace_id",
+            "site",
+            "Datetime_Reveal",
+            "Moments_In_Pack",
+            "Datetime_Pack",
+            "Pack_Price",
+            "Pack_Buyer",
+            "Pack Type",
+            "Mint_Date",
+        ]
+    ]
+    minted = df[(df.Mint_Date.dt.date >= start.date()) & (df.Mint_Date.dt.date < next_start.date())]
+    df["minted_moment"] = False
+    df["minted_player"] = False
+    df['player_not_moment'] = False
+    df['player_moment'] = False
+    df.loc[df.Player.isin(minted.Player.unique()), "minted_player"] = True
+    df.loc[df.marketplace_id.isin(minted.marketplace_id.unique()), "minted_moment"] = True
+    df.loc[(df.minted_player) & ~(df.minted_moment), "player_not_moment"] = True
+    df.loc[(df.minted_player) & (df.minted_moment), "player_moment"] = True
+    print(f"#@# {x}: {len(df)}")
 
-        pack_df = get_pack_data(grouped_pack, "By Date Range", date_range)
-        pack_df.to_csv(
-            f"data/cache/pack_data-{date_str}--grouped.csv.gz",
-            index=False,
-            compression="gzip",
-        )
-    del main_data
-    for date_range in pack_date_ranges:
-        date_str = date_range[0].split(" ")[0]
-        pack_df = get_pack_data(grouped_pack, "By Selected Drop", date_range)
-        pack_df.to_csv(
-            f"data/cache/pack_data-{date_str}--grouped.csv.gz",
-            index=False,
-            compression="gzip",
+    writer.to_cache(df, "player_mint", str(start.date()))
+
+
+def read_shared_frame(frame, date_col):
+    df = frame.read()
+    return df if date_col is None else DateIndex(df, date_col)
+
+
+def run_shared_job(shared, job, *args):
+    """Run `job` in a worker process, on the frames of `share_frames`. Each
+    worker reads a frame once and drops it when a later stage no longer
+    shares it."""
+    paths = {frame.path for frame, _ in shared.values()}
+    frames.clear()
+    for x in set(worker_frames) - paths:
+        del worker_frames[x]
+    for name, (frame, date_col) in shared.items():
+        if frame.path not in worker_frames:
+            worker_frames[frame.path] = read_shared_frame(frame, date_col)
+        frames[name] = worker_frames[frame.path]
+    with BackgroundWriter() as writer:
+        return job(writer, *args)
+
+
+def share_frames(stage_frames):
+    """`(SharedFrame, date column)` of each frame, with the column of a
+    DateIndex so that workers can rebuild it (without sorting again)."""
+    shared = {}
+    try:
+        for name, x in stage_frames.items():
+            if isinstance(x, DateIndex):
+                shared[name] = (SharedFrame(x.df), x.col)
+            else:
+                shared[name] = (SharedFrame(x), None)
+    except BaseException:
+        for frame, _ in shared.values():
+            frame.unlink()
+        raise
+    return shared
+
+
+def run_stage(stage_frames, jobs, writer, executor=None):
+    """Run `jobs`, `(function, *args)` tuples, on `stage_frames` and return
+    their results in the order of `jobs`.
+
+    Without an `executor` the jobs run here one after the other, writing
+    through `writer`. Otherwise they run in its worker processes, which read
+    the frames from shared memory and write their own files.
+    """
+    if executor is None:
+        frames.clear()
+        frames.update(stage_frames)
+        try:
+            return [job(writer, *args) for job, *args in jobs]
+        finally:
+            frames.clear()
+
+    shared = share_frames(stage_frames)
+    futures = []
+    try:
+        futures = [executor.submit(run_shared_job, shared, *job) for job in jobs]
+        return [x.result() for x in futures]
+    finally:
+        for x in futures:
+            x.cancel()
+        # Running jobs keep the frames they have mapped
+        for frame, _ in shared.values():
+            frame.unlink()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="worker processes for the date range and drop jobs (1: run here)",
+    )
+    parser.add_argument(
+        "--packs",
+        type=int,
+        default=1_000_000,
+        help="packs of each type simulated for the pack values",
+    )
+    parser.add_argument(
+        "--pack-weight",
+        default="Total_Circulation",
+        help="column moments are drawn in proportion to in the pack simulation "
+        "(empty: as often as they sell)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=None, help="seed of the pack simulation"
+    )
+    args = parser.parse_args()
+    executor = None
+    if args.jobs > 1:
+        # Not forked, as the background writer's threads may hold locks
+        executor = ProcessPoolExecutor(
+            args.jobs, mp_context=multiprocessing.get_context("spawn")
         )
+    # Files are written in the background while the next one is computed
+    writer = BackgroundWriter()
+    main_data = load_allday_data(cols_to_keep)
+    compare_categories(main_data, ["Player", "Position", "Team"])
+    main_data["Position Group"] = main_data.Position.apply(get_position_group)
 
+    score_data = main_data[main_data.Play_Type.isin(score_columns)].reset_index(
+        drop=True
+    )
+    score_data = score_data.rename(columns=td_mapping)
+    # Sorted by Date once, then sliced for every date range below
+    main_dates = DateIndex(main_data)
+    score_dates = DateIndex(score_data)
+    main_data = main_dates.df
+    del score_data
+    results = run_stage(
+        {"main": main_dates, "score": score_dates},
+        [(score_job, x) for x in main_date_ranges]
+        + [
+            (player_job, x, agg_metric)
+            for x in main_date_ranges
+            for agg_metric in ["median", "mean", "count"]
+        ],
+        writer,
+        executor,
+    )
+    write_ttests([y for x in results[: len(main_date_ranges)] for y in x])
+    legacy_ttest_file.unlink(missing_ok=True)
+
+    del score_dates
+    daily_dates = DateIndex(set_categories(update_daily_aggregates(main_data)))
+    del main_data, main_dates
+    _, grouped_pack = load_pack()
+    pack_dates = DateIndex(grouped_pack, "Datetime_Pack")
     del grouped_pack
+    run_stage(
+        {"daily": daily_dates, "pack": pack_dates},
+        [
+            job
+            for x in play_v_player_date_ranges
+            for job in [(play_v_player_job, x), (pack_job, x, x.replace(" ", "_"))]
+        ]
+        + [(pack_job, x, x[0].split(" ")[0]) for x in pack_date_ranges],
+        writer,
+        executor,
+    )
+
+    del daily_dates, pack_dates
     player_pack_data = load_player_pack()
+    run_stage(
+        {"player_pack": player_pack_data},
+        [(player_mint_job, i) for i in range(len(pack_date_ranges))],
+        writer,
+        executor,
+    )
+
     series2_mint1 = player_pack_data[
         (player_pack_data.Mint_Date >= "2022-09-27 00:00:00-04:00")
         & (player_pack_data.Mint_Date < "2022-10-08 00:00:00-04:00")
@@ -349,7 +449,8 @@ if __name__ == "__main__":
                 "Total_Circulation",
                 "site",
                 # "Pack Type",  # not doing for now
-            ]
+            ],
+            observed=True,
         )
         .agg(
             Price=("Price", "mean"),
@@ -359,95 +460,56 @@ if __name__ == "__main__":
         )
         .reset_index()
     )
-    series2_mint1_grouped.to_csv(
-        f"data/cache/series2_mint1_grouped.csv",
-        index=False,
-    )
+    writer.to_cache(series2_mint1_grouped, "series2_mint1_grouped")
 
+    # Pack values come from whole arrays of simulated packs; only the packs
+    # mint_pack can show are kept moment by moment
+    rng = np.random.default_rng(args.seed)
+    pool = get_pack_pool(series2_mint1, args.pack_weight or None)
+    prices = series2_mint1.Price.to_numpy(dtype=float)
     samples = []
-    for i in range(10000):
-        samp = get_pack_value(
-            series2_mint1, series2_mint1_standard_proportions, "Standard", i
+    simulations = []
+    for pack_type, proportions in [
+        ("Standard", series2_mint1_standard_proportions),
+        ("Premium", series2_mint1_premium_proportions),
+    ]:
+        pack_tiers, moments = simulate_packs(
+            pool, proportions, pack_type, args.packs, rng
         )
-        samples.append(samp)
-    for i in range(5000):
-        samp = get_pack_value(
-            series2_mint1, series2_mint1_premium_proportions, "Premium", i
+        n = n_sample_packs[pack_type]
+        samples.append(
+            get_pack_rows(series2_mint1, pack_tiers[:n], moments[:n], pack_type)
+        )
+        simulations.append(
+            pd.DataFrame(
+                {"Price": get_pack_values(moments, prices), "Pack Type": pack_type}
+            )
         )
-        samples.append(samp)
+        print(f"#@# Simulated {args.packs:,} {pack_type} packs")
+        del pack_tiers, moments
+    simulation = pd.concat(simulations, ignore_index=True)
+    del simulations
+    writer.to_cache(
+        summarize_pack_values(simulation, args.pack_weight or None),
+        "pack_simulation_summary",
+    )
+    # The app's box plot only needs a sample of the values
+    writer.to_cache(
+        simulation.groupby("Pack Type").head(1000).reset_index(drop=True),
+        "pack_simulation",
+    )
+    del simulation
 
     roster_df = pd.read_csv("data/roster_data.csv")
     roster_df = roster_df[roster_df.season == 2022]
     sample_df = pd.concat(samples)
     sample_df = sample_df.merge(
-        roster_df[["player_name", "headshot_url"]],
-        left_on="Player",
-        right_on="player_name",
+        roster_df[["player_id", "headshot_url"]],
+        left_on="nfl_player_id",
+        right_on="player_id",
         how="left",
-    ).drop(columns="player_name")
-    sample_df.to_csv(
-        f"data/cache/sample_packs.csv.gz",
-        index=False,
-        compression="gzip",
-    )
-
-    for i, x in enumerate(pack_date_ranges):
-        start = pd.to_datetime(x[0]).tz_localize("US/Eastern")
-        end = pd.to_datetime(x[1]).tz_localize("US/Eastern")
-        try:
-            next_start = pd.to_datetime(pack_date_ranges[i + 1][0]).tz_localize(
-                "US/Eastern"
-            )
-            next_end = pd.to_datetime(pack_date_ranges[i + 1][1]).tz_localize(
-                "US/Eastern"
-            )
-        except IndexError:
-            next_start = pd.to_datetime(datetime.datetime.now()).tz_localize(
-                "US/Eastern"
-            )
-            next_end = pd.to_datetime(datetime.datetime.now()).tz_localize("US/Eastern")
-        df = player_pack_data[
-            (player_pack_data.Datetime >= start)
-            & (player_pack_data.Datetime < end + pd.Timedelta("1d"))
-        ]
-        df = df[
-            [
-                "Datetime",
-                "Date",
-                "Price",
-                "Player",
-                "Team",
-                "Position",
-                "Play_Type",
-                "Moment_Date",
-                "Moment_Tier",
-                "Series",
-                "Set_Name",
-                "marketplace_id",
-                "site",
-                "Datetime_Reveal",
-                "Moments_In_Pack",
-                "Datetime_Pack",
-                "Pack_Price",
-                "Pack_Buyer",
-                "Pack Type",
-                "Mint_Date",
-            ]
-        ]
-        minted = df[(df.Mint_Date.dt.date >= start.date()) & (df.Mint_Date.dt.date < next_start.date())]
-        df["minted_moment"] = False
-        df["minted_player"] = False
-        df['player_not_moment'] = False
-        df['player_moment'] = False
-        df.loc[df.Player.isin(minted.Player.unique()), "minted_player"] = True
-        df.loc[df.marketplace_id.isin(minted.marketplace_id.unique()), "minted_moment"] = True
-        df.loc[(df.minted_player) & ~(df.minted_moment), "player_not_moment"] = True
-        df.loc[(df.minted_player) & (df.minted_moment), "player_moment"] = True
-        print(f"#@# {x}: {len(df)}")
-
-        date_str = start.date()
-        df.to_csv(
-            f"data/cache/player_mint-{date_str}--grouped.csv.gz",
-            index=False,
-            compression="gzip",
-        )
+    ).drop(columns=["nfl_player_id", "player_id"])
+    writer.to_cache(sample_df, "sample_packs")
+    writer.close()
+    if executor is not None:
+        executor.shutdown()
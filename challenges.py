@@ -4,15 +4,15 @@ from collections import defaultdict
 import pandas as pd
 import json
 
+from store import BackgroundWriter, allday_path, read_pbp, read_table
 from utils import *
 
 from warnings import simplefilter
 
 simplefilter(action="ignore", category=pd.errors.SettingWithCopyWarning)
 
-df = pd.read_csv("data/current_allday_data.csv.gz")
-datecols = ["Datetime", "Date", "Moment_Date"]
-df[datecols] = df[datecols].apply(pd.to_datetime)
+df = read_table(allday_path)
+df["Moment_Date"] = pd.to_datetime(df.Moment_Date)
 
 challenges = pd.read_csv("data/NFLALLDAY_Challenges-Challenges.csv")
 datecols = ["Start Time (EDT)", "End Time (EDT)"]
@@ -27,7 +27,7 @@ weekly_df["total_yards"] = weekly_df.apply(
     lambda x: x.passing_yards + x.receiving_yards + x.rushing_yards, axis=1
 )
 
-pbp = pd.read_csv("data/pbp_2022.csv.gz")
+pbp = read_pbp(seasons=2022)
 
 roster_df = pd.read_csv("data/roster_data.csv")
 roster_df = roster_df[roster_df.season == 2022].reset_index(drop=True)
@@ -45,7 +45,7 @@ def get_top_n_players(
     if by_total:
         players = (
             df[df.position.isin(positions)][
-                ["player_display_name", "position", "total_yards"]
+                ["player_id", "player_display_name", "position", "total_yards"]
             ]
             .sort_values(by="total_yards", ascending=False)
             .groupby("position")
@@ -57,7 +57,7 @@ def get_top_n_players(
     elif by_recieving:
         players = (
             df[df.position.isin(positions)][
-                ["player_display_name", "position", "receiving_yards"]
+                ["player_id", "player_display_name", "position", "receiving_yards"]
             ]
             .sort_values(by="receiving_yards", ascending=False)
             .groupby("position")
@@ -69,7 +69,7 @@ def get_top_n_players(
         if qb_passing:
             qb = (
                 df[df.position == "QB"][
-                    ["player_display_name", "position", "passing_yards"]
+                    ["player_id", "player_display_name", "position", "passing_yards"]
                 ]
                 .sort_values(by="passing_yards", ascending=False)
                 .groupby("position")
@@ -83,7 +83,7 @@ def get_top_n_players(
 
     if return_df:
         return players
-    return players.player_display_name.values
+    return players.player_id.values
 
 
 def get_def_df(df, roster_df):
@@ -172,7 +172,7 @@ def get_top_n_players(
     if by_total:
         players = (
             df[df.position.isin(positions)][
-                ["player_display_name", "position", "total_yards"]
+                ["player_id", "player_display_name", "position", "total_yards"]
             ]
             .sort_values(by="total_yards", ascending=False)
             .groupby("position")
@@ -184,7 +184,7 @@ def get_top_n_players(
     elif by_recieving:
         players = (
             df[df.position.isin(positions)][
-                ["player_display_name", "position", "receiving_yards"]
+                ["player_id", "player_display_name", "position", "receiving_yards"]
             ]
             .sort_values(by="receiving_yards", ascending=False)
             .groupby("position")
@@ -196,7 +196,7 @@ def get_top_n_players(
         if qb_passing:
             qb = (
                 df[df.position == "QB"][
-                    ["player_display_name", "position", "passing_yards"]
+                    ["player_id", "player_display_name", "position", "passing_yards"]
                 ]
                 .sort_values(by="passing_yards", ascending=False)
                 .groupby("position")
@@ -210,7 +210,7 @@ def get_top_n_players(
 
     if return_df:
         return players
-    return players.player_display_name.values
+    return players.player_id.values
 
 
 def get_player_display(df, n=19):
@@ -288,12 +288,12 @@ w01_slate["Wildcard"] = w01_slate["all_day_debut"]
 w01_sunday_night = df[
     df.Player.isin(["Julio Jones"])
     | (
-        df.Player.isin(
+        df.nfl_player_id.isin(
             weekly_df[
                 (weekly_df.week == 1)
                 & (weekly_df.team.isin(["TB", "DAL"]))
                 & (weekly_df.receptions >= 1)
-            ].player_display_name.values
+            ].player_id.values
         )
     )
 ]
@@ -327,7 +327,7 @@ w01_weekly = df[
         ]
     )
     | (df.Set_Name == "Opening Acts")
-    | df.Player.isin(w01_def[w01_def.sack >= 1].player_name.values)
+    | df.nfl_player_id.isin(w01_def[w01_def.sack >= 1].player_id.values)
 ]
 w01_weekly["Display"] = get_player_display(w01_weekly)
 w01_weekly["Challenge Type"] = "w01_weekly"
@@ -432,8 +432,8 @@ w02_slate = df[
             ]
         )
     )
-    | ((df.Player.isin(get_top_n_players(week2_slate_df, 3))) & (df.Rarity > 0))
-    | ((df.Player.isin(get_top_n_players(week2_slate_df, 5))) & (df.Rarity > 1))
+    | ((df.nfl_player_id.isin(get_top_n_players(week2_slate_df, 3))) & (df.Rarity > 0))
+    | ((df.nfl_player_id.isin(get_top_n_players(week2_slate_df, 5))) & (df.Rarity > 1))
 ]
 w02_slate["Display"] = get_player_display(w02_slate)
 w02_slate["Challenge Type"] = "w02_slate"
@@ -511,7 +511,7 @@ w02_weekly = df[
     )
     | (
         (
-            df.Player.isin(
+            df.nfl_player_id.isin(
                 get_top_n_players(week2_df, 2, by_recieving=True, by_total=False)
             )
         )
@@ -519,14 +519,14 @@ w02_weekly = df[
     )
     | (
         (
-            df.Player.isin(
+            df.nfl_player_id.isin(
                 get_top_n_players(week2_df, 5, by_recieving=True, by_total=False)
             )
         )
         & (df.Rarity > 1)
     )
     | (
-        (df.Player.isin(w02_def[w02_def.tackle >= 3].player_name.values))
+        (df.nfl_player_id.isin(w02_def[w02_def.tackle >= 3].player_id.values))
         & (df.rookie_mint)
     )
 ]
@@ -539,7 +539,7 @@ w02_weekly["Wildcard"] = ~w02_weekly.Player.isin(
         "Jaylen Waddle",
         "Brock Wright",
     ]
-) & ~w02_weekly.Player.isin(w02_def[w02_def.tackle >= 3].player_name.values)
+) & ~w02_weekly.nfl_player_id.isin(w02_def[w02_def.tackle >= 3].player_id.values)
 # (w02_thursday.Player.isin(["Patrick Mahomes II"])) & (
 #     w02_thursday.Rarity > 0
 # )
@@ -629,7 +629,7 @@ w03_slate = df[
         ]
     )
     | (
-        df.Player.isin(w03_def[w03_def.fumble >= 1].player_name.values)
+        df.nfl_player_id.isin(w03_def[w03_def.fumble >= 1].player_id.values)
         & (df.Position.isin(["DB", "DL", "LB"]))
         & (
             ~df.Team.isin(
@@ -693,11 +693,11 @@ w03_monday = df[
     )
     | (
         (df.Team.isin(["Dallas Cowboys", "New York Giants"]))
-        & (df.Player.isin(w03_def[w03_def.sack >= 1].player_name.values))
+        & (df.nfl_player_id.isin(w03_def[w03_def.sack >= 1].player_id.values))
     )
     | (
         (df.Team.isin(["Dallas Cowboys", "New York Giants"]))
-        & (df.Player.isin(week3_df[week3_df.carries > 0].player_display_name.values))
+        & (df.nfl_player_id.isin(week3_df[week3_df.carries > 0].player_id.values))
     )
     | ((df.Team.isin(["Dallas Cowboys", "New York Giants"])) & (df.Rarity > 1))
 ]
@@ -708,10 +708,10 @@ w03_monday["Wildcard"] = w03_monday.Rarity > 1
 w03_weekly = df[
     (
         (df["all_day_debut"] == 1) & (df.Team == "Jacksonville Jaguars")
-        | (df.Player.isin(w03_sorted_carries.iloc[:5].player_display_name.values))
-        | (df.Player.isin(w03_sorted_targets.iloc[:5].player_display_name.values))
-        | (df.Player.isin(w03_sorted_completions.iloc[:5].player_display_name.values))
-        | (df.Player.isin(w03_def[w03_def.tackle >= 10].player_name.values))
+        | (df.nfl_player_id.isin(w03_sorted_carries.iloc[:5].player_id.values))
+        | (df.nfl_player_id.isin(w03_sorted_targets.iloc[:5].player_id.values))
+        | (df.nfl_player_id.isin(w03_sorted_completions.iloc[:5].player_id.values))
+        | (df.nfl_player_id.isin(w03_def[w03_def.tackle >= 10].player_id.values))
     )
 ]
 w03_weekly["Display"] = get_player_display(w03_weekly)
@@ -792,31 +792,31 @@ w04_thursday = df[
     )
     | (
         (
-            df.Player.isin(
+            df.nfl_player_id.isin(
                 w04_sorted_completions[
                     (w04_sorted_completions.team.isin(["MIA", "CIN"]))
                     & (w04_sorted_completions.position == "QB")
-                ].player_display_name.values
+                ].player_id.values
             )
         )
         & (df.Rarity > 0)
     )
     | (
         (
-            df.Player.isin(
+            df.nfl_player_id.isin(
                 w04_sorted_receptions[
                     w04_sorted_receptions.team.isin(["MIA", "CIN"])
-                ].player_display_name.values
+                ].player_id.values
             )
         )
         & (df.Rarity > 0)
     )
     | (
         (
-            df.Player.isin(
+            df.nfl_player_id.isin(
                 w04_sorted_attempts[
                     w04_sorted_attempts.team.isin(["MIA", "CIN"])
-                ].player_display_name.values
+                ].player_id.values
             )
         )
         & (df.Rarity > 0)
@@ -867,10 +867,10 @@ w04_sunday_night = df[
     ((df.Series == "Historical") & (df.Team == "Kansas City Chiefs"))
     | ((df.Rarity > 0) & (df.Team == "Tampa Bay Buccaneers"))
     | (
-        df.Player.isin(
+        df.nfl_player_id.isin(
             w04_sorted_attempts[
                 w04_sorted_attempts.team.isin(["TB", "KC"])
-            ].player_display_name.values
+            ].player_id.values
         )
         & (df.all_day_debut == 1)
     )
@@ -895,13 +895,13 @@ w04_monday = df[
             "Cooper Kupp",
         ]
     )
-    | df.Player.isin(
+    | df.nfl_player_id.isin(
         w04_sorted_td_nopass[
             (
                 w04_sorted_td_nopass.team.isin(["SF", "LA"])
                 & w04_sorted_td_nopass.position.isin(["RB", "WR", "TE"])
             )
-        ].player_display_name.values
+        ].player_id.values
     )
     | ((df.Team == "San Francisco 49ers") & (df.all_day_debut == 1))
     | (
@@ -933,8 +933,8 @@ w04_weekly = df[
             "Mo Alie-Cox",
         ]
     )
-    | df.Player.isin(
-        w04_def[(w04_def.sack >= 2) | (w04_def.interception >= 1)].player_name.values
+    | df.nfl_player_id.isin(
+        w04_def[(w04_def.sack >= 2) | (w04_def.interception >= 1)].player_id.values
     )
     | (df.Team.isin(["Seattle Seahawks", "Detroit Lions"]) & (df.Rarity > 0))
 ]
@@ -1010,6 +1010,7 @@ dfs = [
 ]
 
 if __name__ == "__main__":
+    writer = BackgroundWriter()
     for i, x in enumerate(dfs):
         x["Datetime"] = x["Datetime"].apply(lambda x: x.tz_localize("US/Eastern"))
         x["Index"] = x.index
@@ -1054,8 +1055,10 @@ if __name__ == "__main__":
         x = x[x.during_week]
         print(f"#@# {short_form} during week: {len(x)}")
         print("-----")
-        x.to_csv(
+        writer.to_csv(
+            x,
             f"data/challenges/{short_form}.csv.gz",
             index=False,
             compression="gzip",
         )
+    writer.close()
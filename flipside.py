@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+"""Running Flipside (ShroomDK) queries concurrently.
+
+`run_queries` executes a list of `QueryTask`s with asyncio: at most
+`concurrency` queries are in flight, rate limits and server errors are retried
+with exponential backoff, every attempt has a timeout, and each result is
+written to disk as soon as it arrives. A failed task is reported in its
+`QueryOutcome` instead of aborting the rest of the run. Tasks with a page
+writer are fetched one result page at a time, each page appended to disk
+before the next is requested.
+
+A backend is anything with ShroomDK's `query(sql, **kwargs)` method returning an
+object with `columns` and `rows`. Besides `ShroomDK` itself, `RecordingBackend`
+saves every result it sees and `ReplayBackend` serves those recordings back
+without network access or an API key. `FixtureBackend` answers the queries of
+`sql/` from whole tables built out of recordings, with simulated latency and
+any multiple of the recorded data volume, for benchmarking (see benchmark.py).
+
+`ResultCache` keeps a manifest of what has been fetched, keyed by a hash of
+the rendered SQL, and decides which results are still fresh.
+"""
+
+import asyncio
+import fcntl
+import functools
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import numpy as np
+import pandas as pd
+from jinja2 import Environment, FileSystemLoader
+from shroomdk.errors import QueryRunRateLimitError, QueryRunTimeoutError, ServerError
+
+sql_env = Environment(loader=FileSystemLoader("./sql"))
+
+retryable_errors = (
+    QueryRunRateLimitError,
+    QueryRunTimeoutError,
+    ServerError,
+    asyncio.TimeoutError,
+)
+# ShroomDK returns only the first page of this many rows when no page_size is
+# given, so a larger result is silently cut short
+default_page_size = 100_000
+
+
+def render_query(sql_file, **params):
+    """Render a template from `sql/`, tagged with its file name and
+    parameters."""
+    template = sql_env.get_template(sql_file)
+    tag = json.dumps(
+        {k: v for k, v in params.items() if v is not None}, sort_keys=True
+    )
+    return f"-- {sql_file} {tag}\n{template.render(params)}"
+
+
+def parse_query_tag(sql):
+    """Template file name and parameters of a query from `render_query`, with
+    the quotes taken off the parameter values."""
+    tag = sql.split("\n", 1)[0].removeprefix("-- ").split(" ", 1)
+    params = json.loads(tag[1]) if len(tag) > 1 else {}
+    return tag[0], {k: v.strip("'") for k, v in params.items()}
+
+
+def get_query_hash(sql):
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+def save_query_result(df, output_file):
+    print(f"Saving {output_file}...")
+    df.to_csv(
+        output_file,
+        index=False,
+        compression="gzip",
+    )
+
+
+@dataclass
+class QueryResult:
+    columns: list
+    rows: list
+
+
+class CsvPageWriter:
+    """Append result pages to a gzipped CSV, with the column types of the
+    first page."""
+
+    def __init__(self, output_file):
+        self.output_file = Path(output_file)
+        self.f = None
+        self.dtypes = None
+        self.rows = 0
+
+    def type_page(self, df):
+        df = df.convert_dtypes()
+        if self.dtypes is None:
+            self.dtypes = df.dtypes
+            return df
+        for col, dtype in self.dtypes.items():
+            try:
+                df[col] = df[col].astype(dtype)
+            except (TypeError, ValueError):
+                pass
+        return df
+
+    def write(self, df):
+        df = self.type_page(df)
+        if self.f is None:
+            print(f"Saving {self.output_file}...")
+            self.f = gzip.open(self.output_file, "wt")
+            df.to_csv(self.f, index=False)
+        else:
+            df.to_csv(self.f, index=False, header=False)
+        self.rows += len(df)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+        return self.rows
+
+
+@dataclass
+class QueryTask:
+    name: str
+    sql: str
+    output_file: Path
+    write: Callable[[pd.DataFrame, Path], Any] = save_query_result
+    # If set, the result is fetched in pages of `page_size` rows, which are
+    # passed to `open_writer(output_file).write` and then `.close()`
+    open_writer: Optional[Callable[[Path], Any]] = None
+    page_size: int = default_page_size
+
+
+@dataclass
+class QueryOutcome:
+    task: QueryTask
+    rows: int = 0
+    attempts: int = 0
+    seconds: float = 0.0
+    value: Any = None
+    error: Optional[BaseException] = field(default=None, repr=False)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def get_backoff(attempt, base=2.0, cap=120.0):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def fetch_query(backend, sql, **kwargs):
+    query_result_set = backend.query(sql, **kwargs)
+    return pd.DataFrame(query_result_set.rows, columns=query_result_set.columns)
+
+
+async def fetch_with_retries(outcome, backend, max_retries, timeout, backoff, **kwargs):
+    """Fetch `outcome.task`, retrying rate limits, server errors and timeouts."""
+    retries = 0
+    while True:
+        outcome.attempts += 1
+        try:
+            return await asyncio.wait_for(
+                asyncio.to_thread(fetch_query, backend, outcome.task.sql, **kwargs),
+                timeout,
+            )
+        except retryable_errors as e:
+            retries += 1
+            if retries > max_retries:
+                raise
+            delay = get_backoff(retries - 1, base=backoff)
+            print(
+                f"{outcome.task.name}: {type(e).__name__}, retrying in {delay:.1f}s "
+                f"({retries}/{max_retries})..."
+            )
+            await asyncio.sleep(delay)
+
+
+async def stream_task(outcome, backend, max_retries, timeout, backoff):
+    """Fetch and write `outcome.task` page by page, so that only one page is
+    ever held in memory."""
+    task = outcome.task
+    writer = await asyncio.to_thread(task.open_writer, task.output_file)
+    try:
+        page_number = 1
+        while True:
+            df = await fetch_with_retries(
+                outcome,
+                backend,
+                max_retries,
+                timeout,
+                backoff,
+                page_size=task.page_size,
+                page_number=page_number,
+            )
+            await asyncio.to_thread(writer.write, df)
+            outcome.rows += len(df)
+            if len(df) < task.page_size:
+                break
+            page_number += 1
+    finally:
+        outcome.value = await asyncio.to_thread(writer.close)
+
+
+async def run_task(task, backend, semaphore, max_retries, timeout, backoff):
+    outcome = QueryOutcome(task)
+    start = time.perf_counter()
+    if task.open_writer is not None:
+        async with semaphore:
+            try:
+                await stream_task(outcome, backend, max_retries, timeout, backoff)
+            except Exception as e:
+                outcome.error = e
+        outcome.seconds = time.perf_counter() - start
+        return outcome
+
+    async with semaphore:
+        try:
+            df = await fetch_with_retries(
+                outcome, backend, max_retries, timeout, backoff
+            )
+        except Exception as e:
+            outcome.error = e
+            outcome.seconds = time.perf_counter() - start
+            return outcome
+
+    # The result is written outside the semaphore so the next query can start.
+    try:
+        outcome.value = await asyncio.to_thread(task.write, df, task.output_file)
+        outcome.rows = len(df)
+    except Exception as e:
+        outcome.error = e
+    outcome.seconds = time.perf_counter() - start
+    return outcome
+
+
+async def run_queries_async(
+    tasks, backend, concurrency=8, max_retries=4, timeout=900, backoff=2.0
+):
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(
+        *(
+            run_task(x, backend, semaphore, max_retries, timeout, backoff)
+            for x in tasks
+        )
+    )
+
+
+def run_queries(tasks, backend, concurrency=8, max_retries=4, timeout=900, backoff=2.0):
+    """Run `tasks` against `backend`, returning one `QueryOutcome` per task in
+    the order given.
+
+    Note that `timeout` only stops waiting on an attempt: the blocking query
+    call keeps its worker thread until it returns.
+    """
+    start = time.perf_counter()
+    outcomes = asyncio.run(
+        run_queries_async(tasks, backend, concurrency, max_retries, timeout, backoff)
+    )
+    elapsed = time.perf_counter() - start
+    failed = [x for x in outcomes if not x.ok]
+    rows = sum(x.rows for x in outcomes)
+    print(
+        f"#@# {len(outcomes)} queries ({len(failed)} failed), {rows:,} rows "
+        f"in {elapsed:.1f}s"
+    )
+    for x in failed:
+        print(f"#@# FAILED {x.task.name}: {type(x.error).__name__}: {x.error}")
+    return outcomes
+
+
+def get_fixture_name(sql, page_number=1, page_size=None, **kwargs):
+    if page_size is None:
+        return f"{get_query_hash(sql)}.json.gz"
+    return f"{get_query_hash(sql)}-{page_size}-{page_number}.json.gz"
+
+
+class RecordingBackend:
+    """Pass queries through to `backend`, saving each result under `fixture_dir`
+    for `ReplayBackend`."""
+
+    def __init__(self, backend, fixture_dir):
+        self.backend = backend
+        self.fixture_dir = Path(fixture_dir)
+        self.fixture_dir.mkdir(parents=True, exist_ok=True)
+
+    def query(self, sql, **kwargs):
+        query_result_set = self.backend.query(sql, **kwargs)
+        fixture = self.fixture_dir / get_fixture_name(sql, **kwargs)
+        with gzip.open(fixture, "wt") as f:
+            json.dump(
+                {
+                    "sql": sql,
+                    "columns": query_result_set.columns,
+                    "rows": query_result_set.rows,
+                },
+                f,
+                default=str,
+            )
+        return query_result_set
+
+
+class ReplayBackend:
+    """Local stand-in for ShroomDK that serves results recorded by
+    `RecordingBackend`, optionally with a fixed per-query latency. Like
+    ShroomDK, a query without a `page_size` gets the first
+    `default_page_size` rows."""
+
+    def __init__(self, fixture_dir, latency=0.0):
+        self.fixture_dir = Path(fixture_dir)
+        self.latency = latency
+
+    def query(self, sql, page_number=1, page_size=None, **kwargs):
+        rows = slice(None)
+        fixture = self.fixture_dir / get_fixture_name(sql, page_number, page_size)
+        if page_size is None or not fixture.exists():
+            # Serve a page out of the whole recorded result
+            fixture = self.fixture_dir / get_fixture_name(sql)
+            page_size = default_page_size if page_size is None else page_size
+            rows = slice((page_number - 1) * page_size, page_number * page_size)
+        if not fixture.exists():
+            raise KeyError(f"No recorded result for query {get_query_hash(sql)}")
+        with gzip.open(fixture, "rt") as f:
+            recorded = json.load(f)
+        if self.latency:
+            time.sleep(self.latency)
+        return QueryResult(recorded["columns"], recorded["rows"][rows])
+
+
+def select_team_sales(df, team, since=None, start_date=None, end_date=None):
+    df = df[df.Team == team]
+    if since is not None:
+        df = df[pd.to_datetime(df.Datetime) >= pd.Timestamp(since)]
+    if start_date is not None:
+        df = df[df.Date.astype(str).str[:10] >= start_date]
+    if end_date is not None:
+        df = df[df.Date.astype(str).str[:10] <= end_date]
+    return df.sort_values(by=["Date", "Player", "Datetime", "tx_id"], kind="stable")
+
+
+def select_days(df, date=None, start_date=None, end_date=None):
+    days = df.Block_Date.astype(str).str[:10]
+    if start_date is None:
+        return df[days == date].drop(columns="Block_Date")
+    return df[(days >= start_date) & (days <= end_date)]
+
+
+# How FixtureBackend answers each template: its WHERE and ORDER BY on the
+# whole table. Fixture tables for the date templates keep "Block_Date".
+fixture_queries = {
+    "sdk_allday.sql": select_team_sales,
+    "sdk_packs.sql": select_days,
+    "sdk_reveals.sql": select_days,
+}
+# Ids renumbered in the copies of each row when scaling up the data volume
+scaled_id_columns = ["NFT_ID", "PACK_ID"]
+
+
+def get_fixture_table_name(sql_file):
+    return f"{Path(sql_file).stem}.json.gz"
+
+
+def build_fixtures(recording_dir, fixture_dir):
+    """Combine the results recorded by `RecordingBackend` into one table per
+    template in `fixture_queries`, for `FixtureBackend`."""
+    tables = {x: [] for x in fixture_queries}
+    for x in sorted(Path(recording_dir).glob("*.json.gz")):
+        with gzip.open(x, "rt") as f:
+            recorded = json.load(f)
+        sql_file, params = parse_query_tag(recorded["sql"])
+        if sql_file not in tables:
+            continue
+        df = pd.DataFrame(recorded["rows"], columns=recorded["columns"])
+        if "date" in params:
+            df["Block_Date"] = params["date"]
+        tables[sql_file].append(df)
+
+    fixture_dir = Path(fixture_dir)
+    fixture_dir.mkdir(parents=True, exist_ok=True)
+    for sql_file, dfs in tables.items():
+        df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+        # Overlapping recordings (pages, reruns) hold some rows more than once
+        keys = df.apply(lambda x: json.dumps(list(x), default=str), axis=1)
+        df = df[~keys.duplicated()] if len(df) > 0 else df
+        print(f"Saving {get_fixture_table_name(sql_file)}: {len(df):,} rows...")
+        with gzip.open(fixture_dir / get_fixture_table_name(sql_file), "wt") as f:
+            json.dump(
+                {"columns": list(df.columns), "rows": df.values.tolist()},
+                f,
+                default=str,
+            )
+
+
+class FixtureBackend:
+    """Local stand-in for ShroomDK that answers the queries of `sql/` from the
+    tables saved by `build_fixtures`, taking `latency` seconds per query plus
+    the time to transfer its rows at `rows_per_second`.
+
+    With `scale` > 1 every row is served `scale` times, the copies told apart
+    by suffixed `tx_id`s and renumbered ids, so that a benchmark can run at a
+    multiple of the real data volume. Scaled pages are built one at a time.
+
+    Like ShroomDK, a query without a `page_size` gets the first
+    `default_page_size` rows.
+    """
+
+    def __init__(self, fixture_dir, latency=0.0, rows_per_second=None, scale=1):
+        self.fixture_dir = Path(fixture_dir)
+        self.latency = latency
+        self.rows_per_second = rows_per_second
+        self.scale = scale
+        self.tables = {}
+        for sql_file in fixture_queries:
+            with gzip.open(self.fixture_dir / get_fixture_table_name(sql_file)) as f:
+                recorded = json.load(f)
+            self.tables[sql_file] = pd.DataFrame(
+                recorded["rows"], columns=recorded["columns"]
+            )
+        self.select = functools.lru_cache(maxsize=64)(self.select)
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.rows = 0
+        self.first_query = None
+        self.last_result = None
+
+    def select(self, sql):
+        sql_file, params = parse_query_tag(sql)
+        if sql_file not in fixture_queries:
+            raise KeyError(f"No fixture table for {sql_file}")
+        return fixture_queries[sql_file](self.tables[sql_file], **params)
+
+    def scale_rows(self, df, start, stop):
+        """Rows `start` to `stop` of `df` with every row repeated `scale`
+        times."""
+        positions = np.arange(start, min(stop, len(df) * self.scale))
+        copy = positions % self.scale
+        df = df.iloc[positions // self.scale].reset_index(drop=True)
+        if self.scale == 1:
+            return df
+        if "tx_id" in df:
+            df["tx_id"] = df.tx_id.astype(str).where(
+                copy == 0, df.tx_id.astype(str) + "-" + copy.astype(str)
+            )
+        for col in scaled_id_columns:
+            if col in df:
+                df[col] = pd.to_numeric(df[col]) * self.scale + copy
+        return df
+
+    def query(self, sql, page_number=1, page_size=None, **kwargs):
+        start = time.perf_counter()
+        df = self.select(sql)
+        page_size = default_page_size if page_size is None else page_size
+        df = self.scale_rows(df, (page_number - 1) * page_size, page_number * page_size)
+        rows = df.astype(object).where(df.notna(), None).values.tolist()
+        delay = self.latency
+        if self.rows_per_second:
+            delay += len(rows) / self.rows_per_second
+        time.sleep(max(0.0, delay - (time.perf_counter() - start)))
+        with self.lock:
+            self.queries += 1
+            self.rows += len(rows)
+            if self.first_query is None:
+                self.first_query = start
+            self.last_result = time.perf_counter()
+        return QueryResult(list(df.columns), rows)
+
+
+class ResultCache:
+    """Manifest of query results keyed by the SHA-256 of their rendered SQL,
+    recording where each result was saved, when it was fetched, and its size.
+
+    A result for a `partition` (a day of data) is immutable once it was
+    fetched at least `settle_days` after that day ended; before that, and for
+    results without a partition, it is reused for `ttl_hours`.
+    """
+
+    def __init__(self, manifest_file, settle_days=2, ttl_hours=12):
+        self.manifest_file = Path(manifest_file)
+        self.settle = pd.Timedelta(days=settle_days)
+        self.ttl = pd.Timedelta(hours=ttl_hours)
+        self.lock = threading.Lock()
+        self.entries = self.load()
+        self.recorded = {}
+
+    def load(self):
+        if not self.manifest_file.exists():
+            return {}
+        with open(self.manifest_file) as f:
+            return json.load(f)
+
+    def get(self, sql, output_file=None):
+        entry = self.entries.get(get_query_hash(sql))
+        if entry is None and output_file is not None and Path(output_file).exists():
+            # Saved before the manifest existed: the file time is the fetch time,
+            # in local time like `record` and `is_fresh`
+            output_file = Path(output_file)
+            entry = {
+                "output_file": str(output_file),
+                "fetched_at": pd.Timestamp.fromtimestamp(
+                    output_file.stat().st_mtime
+                ).isoformat(),
+                "rows": None,
+                "bytes": output_file.stat().st_size,
+            }
+        return entry
+
+    def is_fresh(self, sql, output_file=None, partition=None, now=None):
+        entry = self.get(sql, output_file)
+        if entry is None or not Path(entry["output_file"]).exists():
+            return False
+        now = pd.Timestamp.now() if now is None else now
+        fetched_at = pd.Timestamp(entry["fetched_at"])
+        if partition is not None:
+            partition_end = pd.Timestamp(partition) + pd.Timedelta(days=1)
+            if fetched_at >= partition_end + self.settle:
+                return True
+        return now - fetched_at < self.ttl
+
+    def record(self, sql, output_file, rows, partition=None):
+        output_file = Path(output_file)
+        entry = {
+            "output_file": str(output_file),
+            "partition": partition,
+            "fetched_at": pd.Timestamp.now().isoformat(),
+            "rows": rows,
+            "bytes": output_file.stat().st_size if output_file.exists() else 0,
+        }
+        with self.lock:
+            self.entries[get_query_hash(sql)] = entry
+            self.recorded[get_query_hash(sql)] = entry
+
+    def save(self):
+        """Add the entries recorded here to the manifest on disk, which another
+        process may have updated in the meantime."""
+        self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = self.manifest_file.with_suffix(".lock")
+        # The file lock keeps processes saving at once from dropping each
+        # other's entries, and is released if the process dies
+        with self.lock, open(lock_file, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self.load()
+            entries.update(self.recorded)
+            tmp_file = self.manifest_file.with_suffix(".tmp")
+            with open(tmp_file, "w") as f:
+                json.dump(entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_file, self.manifest_file)
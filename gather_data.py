@@ -1,17 +1,45 @@
 #!/usr/bin/env python3
 
+import argparse
 import datetime
+import gzip
+import json
+import os
+import shutil
+import time
 from functools import partial
-from multiprocessing import Pool
 from pathlib import Path
 
 import nfl_data_py as nfl
 import numpy as np
 import pandas as pd
 import streamlit as st
-from jinja2 import Environment, FileSystemLoader
 from shroomdk import ShroomDK
 
+from flipside import (
+    CsvPageWriter,
+    FixtureBackend,
+    QueryTask,
+    RecordingBackend,
+    ReplayBackend,
+    ResultCache,
+    render_query,
+    run_queries,
+    save_query_result,
+)
+from store import (
+    allday_path,
+    get_pbp_file,
+    pack_path,
+    player_pack_path,
+    read_pbp,
+    read_table,
+    sales_file,
+    write_categories,
+    write_pbp_season,
+    write_table,
+)
+
 teams = [
     "Arizona Cardinals",
     "Atlanta Falcons",
@@ -123,6 +151,23 @@ pbp_fields = [
     "safety_player_name",
 ]
 
+# Used by get_def_df in challenges.py
+pbp_tackle_fields = [
+    "solo_tackle",
+    "assist_tackle",
+    "tackle_with_assist",
+    "tackle_for_loss_1_player_id",
+    "tackle_for_loss_2_player_id",
+    "solo_tackle_1_player_id",
+    "solo_tackle_2_player_id",
+    "assist_tackle_1_player_id",
+    "assist_tackle_2_player_id",
+    "assist_tackle_3_player_id",
+    "assist_tackle_4_player_id",
+    "tackle_with_assist_1_player_id",
+    "tackle_with_assist_2_player_id",
+]
+
 rarity_dict = {"COMMON": 0, "RARE": 1, "LEGENDARY": 2, "ULTIMATE": 3}
 
 all_dates = [
@@ -132,22 +177,36 @@ all_dates = [
     )
 ]
 
-API_KEY = st.secrets["flipside"]["api_key"]
-sdk = ShroomDK(API_KEY)
+pack_dir = Path("data/packs")
+team_dir = Path("data/teams")
+watermark_file = team_dir / "watermarks.json"
+# Per NFT_ID sales counts, per Player debut marketplace_id, and the team files
+# already counted in them
+sales_state_dir = team_dir / "state"
+manifest_file = Path("data/flipside_manifest.json")
+# All Day Player_ID -> nflverse player_id, see build_player_index
+player_index_file = Path("data/player_index.csv")
+
+# Every stored file is sorted by these, so they can be merged without resorting
+team_sort_by = ["Date", "Player"]
+pack_queries = [
+    ("sdk_packs.sql", "pack_sales", ["Datetime", "Price"], "data/pack_data.csv.gz"),
+    ("sdk_reveals.sql", "pack_reveals", ["Datetime"], "data/pack_reveals.csv.gz"),
+]
 
 
-def get_team_query(team):
-    env = Environment(loader=FileSystemLoader("./sql"))
-    template = env.get_template("sdk_allday.sql")
-    query = template.render({"team": f"'{team}'"})
-    return query
+def get_team_query(team, since=None, start_date=None, end_date=None):
+    return render_query(
+        "sdk_allday.sql",
+        team=f"'{team}'",
+        since=f"'{since}'" if since is not None else None,
+        start_date=f"'{start_date}'" if start_date is not None else None,
+        end_date=f"'{end_date}'" if end_date is not None else None,
+    )
 
 
 def get_date_query(date, sql_file):
-    env = Environment(loader=FileSystemLoader("./sql"))
-    template = env.get_template(sql_file)
-    query = template.render({"date": f"'{date}'"})
-    return query
+    return render_query(sql_file, date=f"'{date}'")
 
 
 def get_datetime_string():
@@ -156,176 +215,899 @@ def get_datetime_string():
     return dt_string
 
 
-def get_flipside_team_data(team, save=True):
-    print(f"Getting data for {team}...")
-    dt_string = get_datetime_string()
-    output_dir = Path(f"data/{dt_string}")
-    output_dir.mkdir(exist_ok=True)
-    output_file = output_dir/ f"{dt_string}_team--{team.replace(' ', '_')}.csv.gz"
-    if not output_file.exists():
-        query = get_team_query(team)
-        query_result_set = sdk.query(query)
-        df = pd.DataFrame(query_result_set.rows, columns=query_result_set.columns)
-        if save:
-            print(f"Saving {output_file}...")
-            df.to_csv(
-                output_file,
-                index=False,
-                compression="gzip",
-            )
-    else:
-        return output_file
-    return df
+def load_watermarks():
+    if not watermark_file.exists():
+        return {}
+    with open(watermark_file) as f:
+        return json.load(f)
+
+
+def save_watermarks(watermarks):
+    team_dir.mkdir(parents=True, exist_ok=True)
+    with open(watermark_file, "w") as f:
+        json.dump(watermarks, f, indent=2, sort_keys=True)
+
+
+def get_watermark(df, previous=None):
+    """High-water mark of a team's sales: the latest `Datetime` seen, plus the
+    `tx_id`s at exactly that time, so that the next (inclusive) fetch can drop
+    the sales it has already stored."""
+    if len(df) == 0:
+        return previous
+    datetimes = pd.to_datetime(df.Datetime)
+    latest = datetimes.max()
+    tx_ids = df.loc[datetimes == latest, "tx_id"].unique().tolist()
+    if previous is not None and pd.Timestamp(previous["Datetime"]) > latest:
+        return previous
+    if previous is not None and pd.Timestamp(previous["Datetime"]) == latest:
+        tx_ids = sorted(set(tx_ids) | set(previous["tx_ids"]))
+    return {"Datetime": f"{latest:%Y-%m-%d %H:%M:%S.%f}", "tx_ids": tx_ids}
+
+
+class TeamWriter(CsvPageWriter):
+    """Write pages of a team's sales to a new file in the team store, dropping
+    the sales already stored at the `watermark` boundary. Closing returns the
+    team's new watermark."""
+
+    def __init__(self, output_file, watermark=None):
+        super().__init__(output_file)
+        self.previous = watermark
+        self.watermark = watermark
+
+    def write(self, df):
+        if self.previous is not None:
+            df = df[~df.tx_id.isin(self.previous["tx_ids"])]
+        if len(df) == 0:
+            return
+        team_dir.mkdir(parents=True, exist_ok=True)
+        # Pages arrive in `team_sort_by` order (see sdk_allday.sql)
+        super().write(df.sort_values(by=team_sort_by, kind="stable"))
+        self.watermark = get_watermark(df, self.watermark)
+
+    def close(self):
+        print(f"{self.output_file.name}: {super().close()} new sales")
+        return self.watermark
+
+
+def load_sales_state():
+    if not (sales_state_dir / "applied.json").exists():
+        return pd.Series(dtype=int), pd.Series(dtype=float), set()
+    sales_counts = pd.read_csv(sales_state_dir / "sales_counts.csv.gz")
+    debuts = pd.read_csv(sales_state_dir / "debuts.csv.gz")
+    with open(sales_state_dir / "applied.json") as f:
+        applied = set(json.load(f))
+    return (
+        sales_counts.set_index("NFT_ID").Sales_Count,
+        debuts.set_index("Player").marketplace_id,
+        applied,
+    )
 
 
-def get_flipside_pack_data(date, sql_file, output_str, save=True):
-    # dt_string = get_datetime_string()  # No longer using date
-    output_dir = Path(f"data/packs")
-    output_file = output_dir / f"{output_str}--{date.replace(' ', '_')}.csv.gz"
-    if not output_file.exists():
-        print(f"Getting data for {date}...")
-        query = get_date_query(date, sql_file)
-        query_result_set = sdk.query(query)
-        df = pd.DataFrame(query_result_set.rows, columns=query_result_set.columns)
-        if save:
-            output_dir.mkdir(exist_ok=True)
-            print(f"Saving {output_file}...")
-            df.to_csv(
-                output_file,
-                index=False,
-                compression="gzip",
-            )
-    else:
-        print(f"#@# Using cached file: {output_file} ...")
-    return output_file
+def save_sales_state(sales_counts, debuts, applied):
+    sales_state_dir.mkdir(parents=True, exist_ok=True)
+    sales_counts.rename_axis("NFT_ID").rename("Sales_Count").reset_index().to_csv(
+        sales_state_dir / "sales_counts.csv.gz", index=False, compression="gzip"
+    )
+    debuts.rename_axis("Player").rename("marketplace_id").reset_index().to_csv(
+        sales_state_dir / "debuts.csv.gz", index=False, compression="gzip"
+    )
+    with open(sales_state_dir / "applied.json", "w") as f:
+        json.dump(sorted(applied), f, indent=2)
+
+
+def update_sales_state(chunksize=100_000):
+    """Count the team files not counted yet into the sales state, adding their
+    `Resell_Number`s to them, and return the updated state.
+
+    Files are taken in the order they were fetched, and each is read and
+    rewritten `chunksize` rows at a time, so each sale's `Resell_Number` is
+    the number of earlier sales of its NFT.
+    """
+    sales_counts, debuts, applied = load_sales_state()
+    new_files = sorted(
+        (x for x in team_dir.glob("*_team--*csv.gz") if x.name not in applied),
+        key=lambda x: x.name,
+    )
+    for x in new_files:
+        print(f"Saving {x}...")
+        tmp_file = x.with_name(f"{x.name}.tmp")
+        with pd.read_csv(x, chunksize=chunksize) as reader, gzip.open(
+            tmp_file, "wt"
+        ) as f:
+            for i, df in enumerate(reader):
+                df = df[df.NFT_ID.notna()].copy()
+                previous = df.NFT_ID.map(sales_counts).fillna(0).astype(int)
+                df["Resell_Number"] = previous + df.groupby("NFT_ID").cumcount()
+                sales_counts = sales_counts.add(
+                    df.groupby("NFT_ID").size(), fill_value=0
+                ).astype(int)
+                first_ids = (
+                    df[df.Position != "Team"].groupby("Player").marketplace_id.min()
+                )
+                debuts = pd.concat([debuts, first_ids]).groupby(level=0).min()
+                df.to_csv(f, index=False, header=i == 0)
+        os.replace(tmp_file, x)
+        applied.add(x.name)
+    save_sales_state(sales_counts, debuts, applied)
+    print(f"#@# sales state: {len(new_files)} new team files")
+    return sales_counts, debuts
+
+
+def get_flipside_team_task(
+    team, watermark=None, page_size=100_000, dates=None, shard=None, stamp=None
+):
+    """Query task for the sales of `team` newer than `watermark`, streamed to
+    disk `page_size` rows at a time. A `shard` number and `(start, end)`
+    `dates` restrict it to those days, either end open if None."""
+    since = watermark["Datetime"] if watermark is not None else None
+    start_date, end_date = dates if dates is not None else (None, None)
+    if stamp is None:
+        stamp = f"{datetime.datetime.now():%Y-%m-%dT%H%M%S}"
+    # Shards of a team sort by name in date order, for update_sales_state
+    suffix = f"--{shard:03d}" if shard is not None else ""
+    return QueryTask(
+        name=team if shard is None else f"{team} #{shard}",
+        sql=get_team_query(team, since, start_date, end_date),
+        output_file=team_dir
+        / f"{stamp}_team--{team.replace(' ', '_')}{suffix}.csv.gz",
+        open_writer=partial(TeamWriter, watermark=watermark),
+        page_size=page_size,
+    )
+
 
+def load_team_daily_rows():
+    """Sales per day of each team in the last combined sales file, from which
+    the size of the next team queries is estimated."""
+    if not sales_file.exists():
+        return {}
+    df = pd.read_csv(sales_file, usecols=["Team", "Date"])
+    daily_rows = df.groupby(["Team", "Date"]).size()
+    return {team: x.droplevel(0) for team, x in daily_rows.groupby(level=0)}
+
+
+def estimate_team_rows(daily_rows, since=None, window=7):
+    """Expected sales per day from the day of `since` (or the first day of
+    sales) through today: the stored counts, and the average of the last
+    `window` stored days for the days after them."""
+    first_day = since[:10] if since is not None else all_dates[0]
+    days = [f"{x:%Y-%m-%d}" for x in pd.date_range(first_day, datetime.date.today())]
+    if daily_rows is None or len(daily_rows) == 0:
+        return dict.fromkeys(days, 0.0)
+    last_day = daily_rows.index.max()
+    recent = pd.date_range(end=last_day, periods=window).strftime("%Y-%m-%d")
+    recent_rows = daily_rows.reindex(recent, fill_value=0).mean()
+    return {
+        x: float(daily_rows.get(x, 0)) if x <= last_day else recent_rows for x in days
+    }
+
+
+def is_known_empty(team, watermark, daily_rows, cache, recheck_days=7):
+    """Whether `team` has never had a sale, as of a fetch within the last
+    `recheck_days` (e.g. the defunct franchises in `teams`)."""
+    entry = cache.get(get_team_query(team))
+    if watermark is not None or daily_rows is not None or entry is None:
+        return False
+    age = pd.Timestamp.now() - pd.Timestamp(entry["fetched_at"])
+    return entry["rows"] == 0 and age < pd.Timedelta(days=recheck_days)
+
+
+def plan_team_tasks(
+    teams, watermarks, daily_rows, shard_rows=None, concurrency=16, page_size=100_000
+):
+    """Query tasks for the sales of `teams`, longest first, with the teams
+    expected to return more than `shard_rows` split into date ranges of about
+    that many rows. By default `shard_rows` is an even share of the expected
+    total per query slot, so that the slots finish together.
+
+    Returns the tasks and their teams.
+    """
+    expected = {
+        x: estimate_team_rows(daily_rows.get(x), watermarks.get(x, {}).get("Datetime"))
+        for x in teams
+    }
+    if shard_rows is None:
+        total = sum(sum(x.values()) for x in expected.values())
+        shard_rows = max(page_size, total / concurrency)
+    stamp = f"{datetime.datetime.now():%Y-%m-%dT%H%M%S}"
+    planned = []
+    for team in teams:
+        days = expected[team]
+        batches = plan_date_batches(list(days), days, shard_rows, max_days=len(days))
+        if len(batches) <= 1:
+            task = get_flipside_team_task(
+                team, watermarks.get(team), page_size, stamp=stamp
+            )
+            planned.append((sum(days.values()), team, task))
+            continue
+        for i, batch in enumerate(batches):
+            # Only the first shard starts at the watermark, and the last one
+            # stays open to pick up sales after today's
+            task = get_flipside_team_task(
+                team,
+                watermarks.get(team) if i == 0 else None,
+                page_size,
+                dates=(
+                    batch[0] if i > 0 else None,
+                    batch[-1] if i < len(batches) - 1 else None,
+                ),
+                shard=i,
+                stamp=stamp,
+            )
+            planned.append((sum(days[x] for x in batch), team, task))
+    planned.sort(key=lambda x: x[0], reverse=True)
+    print(
+        f"#@# teams: {len(planned)} queries for {len(teams)} teams, "
+        f"~{sum(x[0] for x in planned):,.0f} expected rows"
+    )
+    return [x[2] for x in planned], [x[1] for x in planned]
+
+
+def merge_team_outcomes(outcomes, task_teams, watermarks, cache):
+    """Record each team whose queries all succeeded, and update its
+    watermark from its last shard with sales. The files of teams with a
+    failed query are removed, to be fetched again from the old watermark."""
+    by_team = {}
+    for x, team in zip(outcomes, task_teams):
+        by_team.setdefault(team, []).append(x)
+    for team, team_outcomes in by_team.items():
+        if not all(x.ok for x in team_outcomes):
+            for x in team_outcomes:
+                x.task.output_file.unlink(missing_ok=True)
+            continue
+        # The team store as a whole is the cached result of the unbounded query
+        cache.record(
+            get_team_query(team), team_dir, sum(x.rows for x in team_outcomes)
+        )
+        team_outcomes.sort(key=lambda x: x.task.output_file.name)
+        values = [x.value for x in team_outcomes if x.value is not None]
+        if values:
+            watermarks[team] = values[-1]
+    return watermarks
+
+
+def get_pack_file(date, output_str):
+    return pack_dir / f"{output_str}--{date.replace(' ', '_')}.csv.gz"
+
+
+def estimate_pack_rows(dates, sql_file, cache, default_rows=5_000, window=7):
+    """Expected rows per day, from the row counts `cache` recorded for the days
+    within `window` days (or `default_rows` when there are none, e.g. on a cold
+    backfill)."""
+    entries = {x: cache.get(get_date_query(x, sql_file)) for x in all_dates}
+    cached = {
+        x: entry["rows"]
+        for x, entry in entries.items()
+        if entry is not None and entry["rows"] is not None
+    }
+    cached = pd.Series(
+        list(cached.values()), index=pd.to_datetime(list(cached)), dtype=float
+    )
+    estimates = {}
+    for x in dates:
+        day = pd.Timestamp(x)
+        near = cached[(cached.index - day).map(abs) <= pd.Timedelta(days=window)]
+        estimates[x] = near.mean() if len(near) > 0 else default_rows
+    return estimates
+
+
+def plan_date_batches(dates, expected_rows, max_rows=100_000, max_days=31):
+    """Group consecutive `dates` into ranges of at most `max_days` days and
+    about `max_rows` expected rows each."""
+    batches = []
+    batch, batch_rows = [], 0
+    for x in sorted(dates):
+        consecutive = len(batch) == 0 or pd.Timestamp(x) - pd.Timestamp(
+            batch[-1]
+        ) == pd.Timedelta("1d")
+        if batch and (
+            not consecutive
+            or len(batch) >= max_days
+            or batch_rows + expected_rows[x] > max_rows
+        ):
+            batches.append(batch)
+            batch, batch_rows = [], 0
+        batch.append(x)
+        batch_rows += expected_rows[x]
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def save_pack_batch(df, output_file, dates, sql_file, output_str, sort_by, cache):
+    """Split a date range result into the per-day cache files, including
+    empty ones for days without activity, and record each day in `cache`
+    under its single-day query."""
+    block_dates = df.Block_Date.astype(str).str[:10]
+    df = df.drop(columns="Block_Date")
+    for x in dates:
+        day_df = df[block_dates == x].sort_values(by=sort_by, kind="stable")
+        day_file = get_pack_file(x, output_str)
+        save_query_result(day_df, day_file)
+        cache.record(get_date_query(x, sql_file), day_file, len(day_df), partition=x)
+
+
+class PackBatchWriter:
+    """Collect the pages of a date range result, and save them with
+    save_pack_batch once the last (short) page has come in, so that a range
+    that failed part way saves nothing."""
+
+    def __init__(self, output_file, page_size, **kwargs):
+        self.output_file = output_file
+        self.page_size = page_size
+        self.kwargs = kwargs
+        self.pages = []
+        self.rows = 0
+
+    def write(self, df):
+        self.pages.append(df)
+        self.rows += len(df)
+        if len(df) < self.page_size:
+            save_pack_batch(
+                pd.concat(self.pages, ignore_index=True),
+                self.output_file,
+                **self.kwargs,
+            )
+            self.pages = []
+
+    def close(self):
+        return self.rows
+
+
+def get_flipside_pack_tasks(
+    sql_file,
+    output_str,
+    sort_by,
+    cache,
+    max_rows=100_000,
+    max_days=31,
+    page_size=100_000,
+):
+    """Query tasks for the days of pack data without a fresh cached result,
+    batched into date ranges and fetched `page_size` rows at a time."""
+    missing = [
+        x
+        for x in all_dates
+        if not cache.is_fresh(
+            get_date_query(x, sql_file), get_pack_file(x, output_str), partition=x
+        )
+    ]
+    print(f"#@# {output_str}: {len(all_dates) - len(missing)} days cached")
+    expected_rows = estimate_pack_rows(missing, sql_file, cache)
+    tasks = []
+    for dates in plan_date_batches(missing, expected_rows, max_rows, max_days):
+        tasks.append(
+            QueryTask(
+                name=f"{output_str} {dates[0]}--{dates[-1]}",
+                sql=render_query(
+                    sql_file, start_date=f"'{dates[0]}'", end_date=f"'{dates[-1]}'"
+                ),
+                output_file=pack_dir,
+                open_writer=partial(
+                    PackBatchWriter,
+                    page_size=page_size,
+                    dates=dates,
+                    sql_file=sql_file,
+                    output_str=output_str,
+                    sort_by=sort_by,
+                    cache=cache,
+                ),
+                page_size=page_size,
+            )
+        )
+    return tasks
+
+
+def get_backend(args):
+    if args.fixtures is not None:
+        return FixtureBackend(args.fixtures)
+    if args.replay is not None:
+        return ReplayBackend(args.replay)
+    backend = ShroomDK(st.secrets["flipside"]["api_key"])
+    if args.record is not None:
+        backend = RecordingBackend(backend, args.record)
+    return backend
+
+
+def get_sort_key(key):
+    """Comparable form of a `sort_by` tuple, with missing values last."""
+    return tuple((pd.isna(x), 0 if pd.isna(x) else x) for x in key)
+
+
+def count_through(df, sort_by, bound):
+    """Number of leading rows of `df` (sorted by `sort_by`) at or before the
+    sort key `bound`."""
+    before = pd.Series(False, index=df.index)
+    equal = pd.Series(True, index=df.index)
+    for col, (missing, value) in zip(sort_by, bound):
+        if missing:
+            before |= equal & df[col].notna()
+            equal &= df[col].isna()
+        else:
+            before |= equal & (df[col] < value)
+            equal &= df[col] == value
+    return int((before | equal).sum())
+
+
+def read_sorted_chunks(path, sort_by, chunksize, lower=None):
+    """Chunks of a pre-sorted CSV, without the rows at or before the sort key
+    `lower`. Each chunk is sorted again, so a file that fits in one chunk
+    needn't be sorted on disk."""
+    last = None
+    with pd.read_csv(path, chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk = chunk.sort_values(by=sort_by, kind="stable")
+            if lower is not None:
+                chunk = chunk.iloc[count_through(chunk, sort_by, lower) :]
+            if len(chunk) == 0:
+                continue
+            first = get_sort_key(chunk[sort_by].iloc[0])
+            if last is not None and first < last:
+                raise ValueError(f"{path} is not sorted by {sort_by}")
+            last = get_sort_key(chunk[sort_by].iloc[-1])
+            yield chunk
+
+
+def get_key_range(path, sort_by, chunksize):
+    """First and last sort keys of a CSV, reading only the `sort_by` columns,
+    or None if its rows aren't in that order. (None, None) if it's empty."""
+    first, last = None, None
+    with pd.read_csv(path, usecols=sort_by, chunksize=chunksize) as reader:
+        for chunk in reader:
+            if len(chunk) == 0:
+                continue
+            chunk = chunk[sort_by]
+            ordered = chunk.sort_values(by=sort_by, kind="stable")
+            if not chunk.index.equals(ordered.index):
+                return None
+            if last is not None and get_sort_key(chunk.iloc[0]) < last:
+                return None
+            if first is None:
+                first = get_sort_key(chunk.iloc[0])
+            last = get_sort_key(chunk.iloc[-1])
+    return first, last
+
+
+def is_sorted_file(path, sort_by, chunksize):
+    """Whether a CSV's rows are in `sort_by` order, reading only those columns."""
+    return get_key_range(path, sort_by, chunksize) is not None
+
+
+def sort_file(path, sort_by):
+    """Rewrite a CSV sorted by `sort_by`, keeping its modification time (the
+    fetch time of results saved before the ResultCache manifest)."""
+    path = Path(path)
+    stat = path.stat()
+    df = pd.read_csv(path).sort_values(by=sort_by, kind="stable")
+    tmp_file = path.with_name(f"{path.name}.tmp")
+    save_query_result(df, tmp_file)
+    os.replace(tmp_file, path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def merge_sorted_files(paths, sort_by, chunksize, lower=None):
+    """k-way merge of pre-sorted CSVs, yielding sorted blocks of their rows after
+    the sort key `lower`.
+
+    Files are opened in order of their first key, so files that don't overlap
+    (e.g. one per day) are never held in memory together.
+    """
+    pending = []
+    for x in paths:
+        chunk = next(read_sorted_chunks(x, sort_by, chunksize, lower), None)
+        if chunk is not None:
+            pending.append((get_sort_key(chunk[sort_by].iloc[0]), str(x)))
+    pending = sorted(pending, reverse=True)
+
+    sources = []  # [buffered chunk, remaining chunks]
+    while sources or pending:
+        while True:
+            # Rows up to the smallest buffered maximum can't be preceded by
+            # anything still unread in the open files...
+            bound = min(
+                (get_sort_key(x[0][sort_by].iloc[-1]) for x in sources), default=None
+            )
+            # ...but may be by a file that hasn't been opened yet
+            if not pending or (bound is not None and pending[-1][0] > bound):
+                break
+            chunks = read_sorted_chunks(pending.pop()[1], sort_by, chunksize, lower)
+            sources.append([next(chunks), chunks])
+
+        blocks = []
+        for source in sources:
+            buffer = source[0]
+            n = count_through(buffer, sort_by, bound)
+            blocks.append(buffer.iloc[:n])
+            source[0] = buffer.iloc[n:]
+            if len(source[0]) == 0:
+                source[0] = next(source[1], None)
+        sources = [x for x in sources if x[0] is not None]
+        yield pd.concat(blocks).sort_values(by=sort_by, kind="stable")
+
+
+def get_file_stamp(path):
+    stat = Path(path).stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def key_to_json(key):
+    if key is None:
+        return None
+    return [[bool(m), x.item() if hasattr(x, "item") else x] for m, x in key]
 
-def combine_flipside_data(data_dir, glob_str, sort_by):
-    d = Path(data_dir)
-    data_files = d.glob(glob_str)
-    dfs = []
 
+def key_from_json(key):
+    if key is None:
+        return None
+    return tuple((m, x) for m, x in key)
+
+
+def load_merge_state(state_file, sort_by, output_file):
+    """What combine_flipside_data last merged into `output_file`. The files it
+    sorted are still known to be, but no blocks if the output isn't as it left
+    it."""
+    state = {"sort_by": sort_by, "columns": None, "files": {}, "blocks": []}
+    if state_file is None or not Path(state_file).exists():
+        return state
+    with open(state_file) as f:
+        previous = json.load(f)
+    if previous["sort_by"] != sort_by:
+        return state
+    if not Path(output_file).exists() or previous["output"] != get_file_stamp(
+        output_file
+    ):
+        previous.update(columns=None, blocks=[])
+    return previous
+
+
+def save_merge_state(state_file, state):
+    Path(state_file).parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = Path(f"{state_file}.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+
+def get_merge_start(state, files):
+    """How much of the merged output still holds: the number of its blocks
+    before the first one with rows of a new, changed or removed file, or None
+    if none was."""
+    starts = []
+    for name in set(files) | set(state["files"]):
+        new, old = files.get(name), state["files"].get(name)
+        if new == old:
+            continue
+        starts += [x["first"] for x in [new, old] if x is not None and x["first"]]
+    if state["columns"] is None:
+        return 0
+    if not starts:
+        return None
+    start = min(key_from_json(x) for x in starts)
+    blocks = state["blocks"]
+    n = 0
+    while n < len(blocks) and key_from_json(blocks[n][2]) < start:
+        n += 1
+    # Rows of a key can run on from one block into the next
+    while 0 < n < len(blocks) and blocks[n - 1][2] == blocks[n][1]:
+        n -= 1
+    return n
+
+
+def combine_flipside_data(
+    data_dir,
+    glob_str,
+    sort_by,
+    output_file=None,
+    transform=None,
+    max_memory=256 * 2**20,
+    state_file=None,
+):
+    """Merge the pre-sorted files matching `glob_str`, holding about
+    `max_memory` bytes of rows at a time.
+
+    Merged blocks go through `transform` and are appended to the gzipped CSV
+    `output_file` as they are produced, or concatenated and returned if it is
+    None.
+
+    Each block of `output_file` is a gzip member of its own. With a
+    `state_file`, the files merged and where each block starts are recorded
+    there, so that the next run only checks the files that are new or changed
+    since, and rewrites the output from the first block they touch.
+    """
+    data_files = sorted(Path(data_dir).glob(glob_str))
+    sample = pd.read_csv(data_files[0], nrows=1_000)
+    row_bytes = max(sample.memory_usage(deep=True).sum() / max(len(sample), 1), 1)
+    # Each open file holds one chunk, and a merged block can be as big again
+    chunksize = max(1_000, int(max_memory / (2 * row_bytes * len(data_files))))
+
+    state = load_merge_state(state_file, sort_by, output_file)
+    files = {}
     for x in data_files:
-        df = pd.read_csv(x)
-        dfs.append(df)
+        stamp = get_file_stamp(x)
+        known = state["files"].get(x.name)
+        if known is not None and known["stamp"] == stamp:
+            files[x.name] = known
+            continue
+        key_range = get_key_range(x, sort_by, chunksize)
+        if key_range is None:
+            # Saved before files were kept sorted; a day fits in memory
+            print(f"#@# Sorting {x} by {sort_by}")
+            sort_file(x, sort_by)
+            stamp = get_file_stamp(x)
+            key_range = get_key_range(x, sort_by, chunksize)
+        files[x.name] = {
+            "stamp": stamp,
+            "first": key_to_json(key_range[0]),
+            "last": key_to_json(key_range[1]),
+        }
 
-    combined_df = pd.concat(dfs).sort_values(by=sort_by).reset_index(drop=True)
+    if output_file is None:
+        dfs = []
+        for block in merge_sorted_files(data_files, sort_by, chunksize):
+            if transform is not None:
+                transform(block)
+            dfs.append(block)
+        return pd.concat(dfs).reset_index(drop=True)
+
+    n = get_merge_start(state, files)
+    if n is None:
+        print(f"#@# {output_file}: up to date with {len(files)} files")
+        return output_file
+    kept = state["blocks"][:n]
+    offset = state["blocks"][n][0] if n < len(state["blocks"]) else None
+    lower = key_from_json(kept[-1][2]) if kept else None
+    # Files with rows after the kept blocks
+    paths = [
+        x
+        for x in data_files
+        if files[x.name]["last"] is not None
+        and (lower is None or key_from_json(files[x.name]["last"]) > lower)
+    ]
+    print(
+        f"#@# {output_file}: merging {len(paths)} of {len(files)} files after "
+        f"{len(kept)} kept blocks"
+    )
 
-    return combined_df
+    columns = state["columns"]
+    with open(output_file, "r+b" if kept else "wb") as f:
+        if offset is not None:
+            f.truncate(offset)
+        f.seek(0, os.SEEK_END)
+        for block in merge_sorted_files(paths, sort_by, chunksize, lower):
+            if transform is not None:
+                transform(block)
+            if columns is None:
+                columns = list(block.columns)
+            kept.append(
+                [
+                    f.tell(),
+                    key_to_json(get_sort_key(block[sort_by].iloc[0])),
+                    key_to_json(get_sort_key(block[sort_by].iloc[-1])),
+                ]
+            )
+            text = block.to_csv(index=False, header=f.tell() == 0, columns=columns)
+            with gzip.GzipFile(fileobj=f, mode="wb") as member:
+                member.write(text.encode())
+
+    if state_file is not None:
+        state.update(
+            columns=columns,
+            files=files,
+            blocks=kept,
+            output=get_file_stamp(output_file),
+        )
+        save_merge_state(state_file, state)
+    return output_file
+
+
+def update_pbp_store(years):
+    """Download the play-by-play data of the latest of `years`, and of any
+    earlier season not stored yet; finished seasons never change."""
+    current = max(years)
+    for season in sorted(years):
+        if season < current and get_pbp_file(season).exists():
+            continue
+        pbp_data = nfl.import_pbp_data(
+            [season], columns=pbp_fields + pbp_tackle_fields, downcast=True
+        )
+        write_pbp_season(pbp_data, season)
 
 
 def get_years_after_date(years, cutoff):
     return [x for x in years if x >= cutoff]
 
 
-def scored_td(row, df, data_type, team_lookup=None):
-    if row.Set_Name == "Move the Chains":
-        return False
-    if row.Play_Type not in [
-        "Pass",
-        "Reception",
-        "Rush",
-        "Strip Sack",
-        "Interception",
-        "Fumble Recovery",  # ~50% TD
-        "Blocked Kick",  # 1/4 not td
-        "Punt Return",  # all TD
-        "Kick Return",  # 1/6 not td
-    ]:
-        return False
-    if int(row.Season) < 1999:
-        return None
+td_play_types = [
+    "Pass",
+    "Reception",
+    "Rush",
+    "Strip Sack",
+    "Interception",
+    "Fumble Recovery",  # ~50% TD
+    "Blocked Kick",  # 1/4 not td
+    "Punt Return",  # all TD
+    "Kick Return",  # 1/6 not td
+]
 
-    szn = row.Season
-    wk = row.Week
-    pt = row.Play_Type
-    player = row.Player
-
-    try:
-        wk = int(wk)
-    except ValueError:
-        if wk == "Divisional":
-            wk = 20
-        elif wk == "Super Bowl LVI":
-            wk = 22
-        else:
-            wk = np.nan
-
-    if data_type == "stats":
-        player_stats = df[
-            (df.season == szn) & (df.player_display_name == player) & (df.week == wk)
-        ]
-        if row.Set_Name == "Move the Chains":
-            return False
-        elif pt == "Reception":
-            td_type = "receiving_tds"
-        elif pt == "Rush":
-            td_type = "rushing_tds"
-        elif pt == "Pass":
-            td_type = "passing_tds"
-        else:
-            return None
-        try:
-            return (player_stats[td_type] >= 1).values[0]
-        except IndexError:
-            return None
-
-    elif data_type == "pbp":
-        # manual checks while debugging:
-        if row.unique_id in [
-            "2399701d-d4a9-4a5c-9449-a5df10712c2b",  # Mac Jones TD with wrong time
-            "3039dc31-e09a-4e53-90c7-4b8e928ae947",  # LF TD
-            "383c3543-35dc-4945-b164-77a9a0f9a8f7",  # INT returned for TD
-            "577e4e69-a24d-478a-b44b-da6b8e56cb93",
-            "bae9227d-37f6-4e80-b967-dbb0a79af207",
-            "b753616b-ad92-4474-81da-55137a9bb2f9",
-            "f24046e7-787c-4512-8e69-718b8168de90",
-            "8efdacdc-d39f-4cbe-987c-d14257324e3c",
-            "ee5a2e00-4371-42b4-ac0b-eda0a9d8ff49",
-            "f24046e7-787c-4512-8e69-718b8168de90",
-        ]:
-            return True
-        elif row.unique_id in [
-            "773ac906-ef38-499a-9f19-d77bd69c50f3",
-            "db2a1785-4062-4e80-9f6f-a7d701714378",
-            "8a84c558-3a7e-4365-b38a-eac93187a1b7",
-            "be88ed33-7001-4e90-af2d-a9a2a386411c",
-        ]:
-            return False
-        else:
-            try:
-                home_team = team_lookup[row.Home_Team_Name]
-            except KeyError:
-                return None
-            qtr = row.Quarter
-            time_left = convert_timestr(row.Time)
-
-            # try:
-            play = df[
-                (df["home_team"] == home_team)
-                & (df["Season"] == szn)
-                & (df["week"] == wk)
-                & (df["qtr"] == qtr)
-                & (df["quarter_seconds_remaining"] == time_left)
-            ]
+stats_td_columns = {
+    "Reception": "receiving_tds",
+    "Rush": "rushing_tds",
+    "Pass": "passing_tds",
+}
 
-            if len(play) == 0:
-                return None
-            elif len(play) == 1:
-                td = play.touchdown.values[0]
-            else:
-                td = play.iloc[-1].touchdown
-            return bool(td)
+week_numbers = {"Divisional": 20, "Super Bowl LVI": 22}
 
 
-def convert_timestr(time):
-    try:
-        m, s = time.split(":")
-    except (AttributeError, ValueError):
-        return None
+def load_pbp_td_overrides(path="data/pbp_td_overrides.csv"):
+    """Moments checked by hand whose play-by-play match is wrong or missing."""
+    overrides = pd.read_csv(path, usecols=["unique_id", "pbp_td"])
+    return dict(overrides.values.tolist())
+
+
+def load_player_name_overrides(path="data/player_name_overrides.csv"):
+    """All Day player names checked by hand whose nflverse name differs by more
+    than `normalize_name` removes."""
+    overrides = pd.read_csv(path, usecols=["Player", "nfl_player_name"])
+    return dict(
+        zip(normalize_name(overrides.Player), normalize_name(overrides.nfl_player_name))
+    )
+
+
+def normalize_name(names):
+    """Lowercase ASCII names without punctuation, extra whitespace or
+    generational suffixes, so that "Patrick Mahomes II" and "Patrick Mahomes"
+    or "D.J. Moore" and "DJ Moore" get the same key."""
+    return (
+        names.astype(str)
+        .str.normalize("NFKD")
+        .str.encode("ascii", errors="ignore")
+        .str.decode("ascii")
+        .str.lower()
+        .str.replace(r"[.',]", "", regex=True)
+        .str.replace("-", " ")
+        .str.split()
+        .str.join(" ")
+        .str.replace(r" (jr|sr|ii|iii|iv|v)$", "", regex=True)
+    )
+
+
+def build_player_index(df, roster_df, team_abbr, overrides):
+    """Map each All Day `Player_ID` to an nflverse `player_id`, matching
+    normalized names (or their `overrides`) against the rosters. When several
+    nflverse players share a name, one who played for a team the All Day player
+    has moments with is preferred, then the most recent."""
+    players = df.loc[df.Position != "Team", ["Player_ID", "Player", "Team"]]
+    players = players.drop_duplicates().dropna(subset=["Player_ID"])
+    players["key"] = normalize_name(players.Player)
+    overridden = players.key.isin(overrides.keys())
+    players["key"] = players.key.replace(overrides)
+
+    roster = roster_df[["player_id", "player_name", "team", "season"]].dropna(
+        subset=["player_id", "player_name"]
+    )
+    roster = roster.sort_values(by="season").drop_duplicates(
+        ["player_id", "team"], keep="last"
+    )
+    roster["key"] = normalize_name(roster.player_name)
+
+    candidates = players.merge(roster[["key", "player_id", "team", "season"]], on="key")
+    candidates["same_team"] = candidates.team == candidates.Team.map(team_abbr)
+    n_candidates = candidates.groupby("Player_ID").player_id.nunique()
+    best = candidates.sort_values(
+        by=["same_team", "season"], ascending=False
+    ).drop_duplicates("Player_ID")
+
+    index = players.drop_duplicates("Player_ID")[["Player_ID", "Player"]]
+    index = index.merge(best[["Player_ID", "player_id"]], on="Player_ID", how="left")
+    index["match"] = np.select(
+        [
+            index.player_id.isna(),
+            index.Player_ID.isin(players.loc[overridden, "Player_ID"]),
+            index.Player_ID.map(n_candidates) > 1,
+        ],
+        [None, "override", "team"],
+        default="name",
+    )
+    print(
+        f"#@# player index: {index.player_id.notna().sum()} of {len(index)} "
+        f"players matched, {(index.match == 'team').sum()} by team"
+    )
+    return index.sort_values(by="Player").reset_index(drop=True)
 
-    min2sec = int(m) * 60 if len(m) > 0 else 0
-    return min2sec + int(s)
+
+def get_week_number(week):
+    wk = pd.to_numeric(week, errors="coerce")
+    return wk.fillna(week.map(week_numbers)).astype(float)
+
+
+def get_seconds_remaining(time):
+    """'M:SS' game clock strings to seconds, NaN if unparseable."""
+    m_s = time.astype(str).str.extract(r"^(\d*):(\d+)$")
+    minutes = pd.to_numeric(m_s[0], errors="coerce").fillna(0)
+    return (minutes * 60 + pd.to_numeric(m_s[1], errors="coerce")).astype(float)
+
+
+def get_td_candidates(plays):
+    """Split plays into those that can't be a TD (False), those too old for
+    nflverse data (None) and the rest, which need to be looked up."""
+    candidate = (plays.Set_Name != "Move the Chains") & plays.Play_Type.isin(
+        td_play_types
+    )
+    too_old = candidate & (pd.to_numeric(plays.Season) < 1999)
+    result = pd.Series(None, index=plays.index, dtype=object)
+    result[~candidate] = False
+    return result, candidate & ~too_old
+
+
+def to_td_values(values, scalar=bool):
+    """Object array of `values` as `scalar`s: the weekly stats lookup gave
+    np.bool_ and the play-by-play one bool(), and scored_td_in_moment's
+    `is False` check only matches the latter."""
+    result = np.empty(len(values), dtype=object)
+    result[:] = [scalar(x) for x in values]
+    return result
+
+
+def resolve_game_td(plays, weekly_df):
+    """Whether the player scored a TD of the moment's type (passing, rushing,
+    receiving) in that game, from weekly stats."""
+    result, lookup = get_td_candidates(plays)
+    lookup &= plays.Play_Type.isin(stats_td_columns.keys())
+
+    keys = pd.DataFrame(
+        {
+            "season": pd.to_numeric(plays.Season).astype(float),
+            "player_id": plays.nfl_player_id,
+            "week": plays.Week_Number,
+        }
+    )[lookup & plays.Week_Number.notna() & plays.nfl_player_id.notna()]
+    stats = (
+        weekly_df[["season", "player_id", "week", *stats_td_columns.values()]]
+        .astype({"season": float, "week": float})
+        .drop_duplicates(["season", "player_id", "week"], keep="first")
+    )
+    matched = keys.rename_axis("row").reset_index().merge(
+        stats, on=["season", "player_id", "week"]
+    )
+    td_column = plays.loc[matched.row, "Play_Type"].map(stats_td_columns).values
+    tds = matched[list(stats_td_columns.values())].values[
+        np.arange(len(matched)),
+        [list(stats_td_columns.values()).index(x) for x in td_column],
+    ]
+    result[matched.row.values] = to_td_values(tds >= 1, np.bool_)
+    return result
+
+
+def resolve_pbp_td(plays, pbp_df, team_lookup, overrides):
+    """Whether the moment's play was a TD, matching it to play-by-play data on
+    home team, season, week, quarter and game clock. If several plays match,
+    the last one wins."""
+    result, lookup = get_td_candidates(plays)
+
+    overridden = lookup & plays.unique_id.isin(overrides.keys())
+    result[overridden] = to_td_values(plays.loc[overridden, "unique_id"].map(overrides))
+    lookup &= ~overridden
+
+    keys = pd.DataFrame(
+        {
+            "home_team": plays.Home_Team_Name.map(team_lookup),
+            "Season": pd.to_numeric(plays.Season).astype(float),
+            "week": plays.Week_Number,
+            "qtr": pd.to_numeric(plays.Quarter, errors="coerce").astype(float),
+            "quarter_seconds_remaining": plays.Seconds_Remaining,
+        }
+    )[lookup]
+    keys = keys.dropna()
+    key_cols = keys.columns.tolist()
+    pbp = (
+        pbp_df[key_cols + ["touchdown"]]
+        .astype({x: float for x in key_cols if x != "home_team"})
+        .drop_duplicates(key_cols, keep="last")
+    )
+    matched = keys.rename_axis("row").reset_index().merge(pbp, on=key_cols)
+    # bool(NaN) is True, kept for parity with the row-wise matcher
+    tds = matched.touchdown.isna() | (matched.touchdown.fillna(0) != 0)
+    result[matched.row.values] = to_td_values(tds.values)
+    return result
 
 
 def scored_td_in_game(row):
@@ -350,22 +1132,18 @@ def get_td_data(df, weekly_df, pbp_df, team_abbr):
     ) & (df.Set_Name != "Move the Chains")
 
     unique_plays = df.groupby("unique_id").first().reset_index()
+    unique_plays["Week_Number"] = get_week_number(unique_plays.Week)
+    unique_plays["Seconds_Remaining"] = get_seconds_remaining(unique_plays.Time)
 
-    game_td_func = partial(scored_td, df=weekly_df, data_type="stats")
-    pbp_td_func = partial(scored_td, df=pbp_df, data_type="pbp", team_lookup=team_abbr)
-    unique_plays["game_td"] = unique_plays.apply(
-        game_td_func,
-        axis=1,
+    unique_plays["game_td"] = resolve_game_td(unique_plays, weekly_df)
+    unique_plays["pbp_td"] = resolve_pbp_td(
+        unique_plays, pbp_df, team_abbr, load_pbp_td_overrides()
     )
-    unique_plays["pbp_td"] = unique_plays.apply(pbp_td_func, axis=1)
 
     df = df.merge(
         unique_plays[["unique_id", "game_td", "pbp_td"]], on="unique_id"
     ).reset_index(drop=True)
 
-    df["scored_td_in_game"] = df.apply(scored_td_in_game, axis=1)
-    df["scored_td_in_moment"] = df.apply(scored_td_in_moment, axis=1)
-
     return df
 
 
@@ -398,38 +1176,170 @@ def get_game_outcome(row):
         return "Loss"
 
 
-if __name__ == "__main__":
-    # #TODO: turn on when updating
-    pack_dir = Path("data/packs")
-    with Pool(16) as p:
-        pack_data_func = partial(
-            get_flipside_pack_data, sql_file="sdk_packs.sql", output_str="pack_sales"
-        )
-        p.map(pack_data_func, all_dates)
+def rookie_mint(row):
+    return (row.Series == "Series 1" and row.Rookie_Year == 2021) or (
+        row.Series == "Series 2" and row.Rookie_Year == 2022
+    )
 
-        reveals_func = partial(
-            get_flipside_pack_data,
-            sql_file="sdk_reveals.sql",
-            output_str="pack_reveals",
-        )
-        p.map(reveals_func, all_dates)
 
-    pack_df = combine_flipside_data(
-        pack_dir, f"*pack_sales--*csv.gz", ["Datetime", "Price"]
-    )
+def pack_type(row):
     # #HACK: empirically found prices for Standard v Premium, PLAYOFFS grouped in with Standard
-    pack_df['Pack Type'] = pack_df.Price.apply(lambda x: 'Standard' if x < 79 or x == 84 else 'Premium')
-    pack_df.to_csv(
-        "data/pack_data.csv.gz",
-        index=False,
-        compression="gzip",
+    return "Standard" if row.Price < 79 or row.Price == 84 else "Premium"
+
+
+def derive_scored_td_in_game(df):
+    return df.game_td.where(df.game_td.notna(), df.description_td)
+
+
+def derive_scored_td_in_moment(df):
+    # scored_td_in_moment's `game_td is False` only matches the Python False of
+    # plays that can't be a TD, and those have pbp_td False as well
+    return df.pbp_td.where(df.pbp_td.notna(), df.description_td).astype(object)
+
+
+def derive_won_game(df):
+    home_team_won = df.Home_Team_Score.astype(int) > df.Away_Team_Score.astype(int)
+    return home_team_won.where(df.Team == df.Home_Team_Name, ~home_team_won)
+
+
+def derive_tie_game(df):
+    return df.Home_Team_Score.astype(int) == df.Away_Team_Score.astype(int)
+
+
+def derive_game_outcome(df):
+    return pd.Series(
+        np.select([df.tie_game, df.won_game], ["Tie", "Win"], default="Loss"),
+        index=df.index,
+    )
+
+
+def derive_rookie_mint(df):
+    return ((df.Series == "Series 1") & (df.Rookie_Year == 2021)) | (
+        (df.Series == "Series 2") & (df.Rookie_Year == 2022)
+    )
+
+
+def derive_pack_type(df):
+    return pd.Series(
+        np.where((df.Price < 79) | (df.Price == 84), "Standard", "Premium"),
+        index=df.index,
     )
-    reveal_df = combine_flipside_data(pack_dir, f"*pack_reveals--*csv.gz", ["Datetime"])
-    reveal_df.to_csv(
-        "data/pack_reveals.csv.gz",
-        index=False,
-        compression="gzip",
+
+
+# column: (vectorized derivation, row-wise reference). Later columns may use
+# earlier ones.
+sales_derived_columns = {
+    "Rarity": (
+        lambda df: df.Moment_Tier.map(rarity_dict),
+        lambda row: rarity_dict[row.Moment_Tier],
+    ),
+    "rookie_year": (
+        lambda df: df.Season == df.Rookie_Year,
+        lambda row: row.Season == row.Rookie_Year,
+    ),
+    "rookie_mint": (derive_rookie_mint, rookie_mint),
+    "scored_td_in_game": (derive_scored_td_in_game, scored_td_in_game),
+    "scored_td_in_moment": (derive_scored_td_in_moment, scored_td_in_moment),
+    "won_game": (derive_won_game, won_game),
+    "tie_game": (derive_tie_game, tie_game),
+    "Game Outcome": (derive_game_outcome, get_game_outcome),
+}
+
+pack_derived_columns = {
+    "Pack Type": (derive_pack_type, pack_type),
+}
+
+
+def add_derived_columns(df, columns=sales_derived_columns, report=True):
+    """Add each of `columns` to `df` with array operations, printing the time
+    spent per column."""
+    timings = {}
+    for name, (derive, _) in columns.items():
+        start = time.perf_counter()
+        df[name] = derive(df)
+        timings[name] = time.perf_counter() - start
+    if report:
+        for name, seconds in timings.items():
+            print(f"#@# derived {name}: {seconds:.3f}s")
+    return timings
+
+
+def check_derived_columns(df, columns=sales_derived_columns, n=10000, seed=1234):
+    """Compare the derived columns on a sample of `n` rows against the
+    row-wise reference functions, raising if any value differs."""
+    if n is not None and len(df) > n:
+        df = df.sample(n, random_state=seed)
+    df = df.copy()
+    mismatched = {}
+    for name, (_, reference) in columns.items():
+        expected = df.apply(reference, axis=1)
+        actual = df[name]
+        same = (expected.isna() & actual.isna()) | (
+            expected.astype(object) == actual.astype(object)
+        )
+        if not same.all():
+            mismatched[name] = int((~same).sum())
+        # later references read this column, so use the reference values
+        df[name] = expected
+    if mismatched:
+        raise AssertionError(f"Derived columns differ from reference: {mismatched}")
+    print(f"#@# {len(columns)} derived columns match on {len(df)} rows")
+
+
+def get_team_abbr(team_desc):
+    team_abbr = dict(team_desc[["team_name", "team_abbr"]].values.tolist())
+    team_abbr["Washington Football Team"] = "WAS"
+    team_abbr["Los Angeles Rams"] = "LA"  # not sure why this is just a 2 letter abbrev
+    return team_abbr
+
+
+def get_sales_years():
+    years = pd.read_csv(sales_file, usecols=["Season"]).Season.unique().tolist()
+    if 2022 not in years:
+        years.append(2022)
+    return years
+
+
+def gather_packs(args, backend=None):
+    """Fetch pack sales and reveals, and write the combined pack tables."""
+    backend = get_backend(args) if backend is None else backend
+    cache = ResultCache(manifest_file, args.settle_days, args.ttl_hours)
+    pack_dir.mkdir(exist_ok=True)
+    pack_tasks = [
+        task
+        for sql_file, output_str, sort_by, _ in pack_queries
+        for task in get_flipside_pack_tasks(
+            sql_file,
+            output_str,
+            sort_by,
+            cache,
+            max_days=args.pack_batch_days,
+            page_size=args.page_size,
+        )
+    ]
+    outcomes = run_queries(pack_tasks, backend, concurrency=args.concurrency)
+    cache.save()
+    if not all(x.ok for x in outcomes):
+        raise SystemExit("Some pack queries failed, rerun to fetch the missing days")
+
+    max_memory = args.merge_memory_mb * 2**20
+    add_pack_type = partial(
+        add_derived_columns, columns=pack_derived_columns, report=False
     )
+    for _, output_str, sort_by, combined_file in pack_queries:
+        combine_flipside_data(
+            pack_dir,
+            f"*{output_str}--*csv.gz",
+            sort_by,
+            output_file=combined_file,
+            transform=add_pack_type if output_str == "pack_sales" else None,
+            max_memory=max_memory,
+            state_file=pack_dir / f"{output_str}.merged.json",
+        )
+    pack_df = pd.read_csv("data/pack_data.csv.gz")
+    if args.check_derived:
+        check_derived_columns(pack_df, pack_derived_columns)
+    reveal_df = pd.read_csv("data/pack_reveals.csv.gz")
 
     combined_df = reveal_df.copy()
     combined_df["NFTS"] = combined_df.NFTS.str.split(",")
@@ -456,101 +1366,139 @@ if __name__ == "__main__":
             "Buyer": "Pack_Buyer",
         }
     ).drop(columns="NFT_ID")
-    combined_df.to_csv(
-        "data/pack_combined.csv.gz",
-        index=False,
-        compression="gzip",
-    )
-
-    data_dir = Path("data", get_datetime_string())
-    with Pool(16) as p:
-        p.map(get_flipside_team_data, teams)
-
-    df = combine_flipside_data(data_dir, f"*_team--*csv.gz",["Date", "Player"])
-    sales_counts = (
-        df.groupby("NFT_ID")["tx_id"]
-        .count()
-        .reset_index()
-        .sort_values(by="tx_id")
-        .rename(columns={"tx_id": "Sales_Count"})
-    )
-    df = df.merge(sales_counts, on="NFT_ID")
-    df["Resell_Number"] = df.groupby("NFT_ID")["tx_id"].cumcount()
-    df["Rarity"] = df.apply(lambda x: rarity_dict[x.Moment_Tier], axis=1)
-
-    all_day_debuts = (
-        df[df.Position != "Team"].groupby("Player").marketplace_id.min().reset_index()
-    )
-    all_day_debuts["all_day_debut"] = 1
-    df = df.merge(all_day_debuts, on=["marketplace_id", "Player"], how="left")
-    df.loc[df.all_day_debut.isna(), "all_day_debut"] = 0
-    df["rookie_year"] = df.Season == df.Rookie_Year
-    df["rookie_mint"] = df.apply(
-        lambda x: (x.Series == "Series 1" and x.Rookie_Year == 2021)
-        or (x.Series == "Series 2" and x.Rookie_Year == 2022),
-        axis=1,
-    )
-    # #@# debugging
-    # df = pd.read_csv(
-    #     "data/current_allday_data.csv.gz",
-    # )
-    # weekly_data = pd.read_csv(
-    #     "data/weekly_data.csv",
-    # )
-    # pbp_data = pd.read_csv(
-    #     "data/pbp.csv.gz",
-    # )
-    # --
-
-    years = df.Season.unique().tolist()
-    if 2022 not in years:
-        years.append(2022)
+    write_table(combined_df, pack_path, sort_by="Datetime_Pack")
+
+
+def add_sales_columns(df, sales_counts, debuts):
+    """Resale counts and debut flags, from the state update_sales_state keeps
+    for all sales."""
+    df["Sales_Count"] = df.NFT_ID.map(sales_counts)
+    df["Resell_Number"] = df.pop("Resell_Number")
+    df["all_day_debut"] = (df.marketplace_id == df.Player.map(debuts)).astype(float)
+
+
+def gather_sales(args, backend=None):
+    """Fetch new team sales, and write all sales with their resale counts."""
+    backend = get_backend(args) if backend is None else backend
+    cache = ResultCache(manifest_file, args.settle_days, args.ttl_hours)
+    if args.full_refresh:
+        for x in team_dir.glob("*_team--*csv.gz"):
+            x.unlink()
+        shutil.rmtree(sales_state_dir, ignore_errors=True)
+        watermarks = {}
+        stale_teams = teams
+    else:
+        watermarks = load_watermarks()
+        stale_teams = [x for x in teams if not cache.is_fresh(get_team_query(x))]
+    daily_rows = load_team_daily_rows()
+    empty_teams = [
+        x
+        for x in stale_teams
+        if is_known_empty(x, watermarks.get(x), daily_rows.get(x), cache)
+    ]
+    stale_teams = [x for x in stale_teams if x not in empty_teams]
+    print(
+        f"#@# teams: {len(teams) - len(stale_teams) - len(empty_teams)} fetched "
+        f"within the last {args.ttl_hours:g}h, {len(empty_teams)} without sales"
+    )
+    tasks, task_teams = plan_team_tasks(
+        stale_teams,
+        watermarks,
+        daily_rows,
+        args.shard_rows,
+        args.concurrency,
+        args.page_size,
+    )
+    outcomes = run_queries(tasks, backend, concurrency=args.concurrency)
+    merge_team_outcomes(outcomes, task_teams, watermarks, cache)
+    save_watermarks(watermarks)
+    cache.save()
+    if not all(x.ok for x in outcomes):
+        raise SystemExit("Some team queries failed, rerun to fetch the missing sales")
+
+    update_sales_state()
+    # Only appended to as sales come in; the counts that change with every new
+    # sale are added from the sales state by gather_moments
+    combine_flipside_data(
+        team_dir,
+        f"*_team--*csv.gz",
+        team_sort_by,
+        output_file=sales_file,
+        max_memory=args.merge_memory_mb * 2**20,
+        state_file=sales_state_dir / "merged.json",
+    )
+
+
+def gather_nfl(args):
+    """Download the NFL data for every season with sales."""
+    years = get_sales_years()
 
     team_desc = nfl.import_team_desc()
     team_desc.to_csv("data/team_desc.csv", index=False)
 
-    team_abbr = dict(team_desc[["team_name", "team_abbr"]].values.tolist())
-    team_abbr["Washington Football Team"] = "WAS"
-    team_abbr["Los Angeles Rams"] = "LA"  # not sure why this is just a 2 letter abbrev
-
     schedule_data = nfl.import_schedules(get_years_after_date(years, 1999))
     schedule_data.to_csv("data/schedule_data.csv", index=False)
 
     weekly_data = nfl.import_weekly_data(get_years_after_date(years, 1999))
     weekly_data.to_csv("data/weekly_data.csv", index=False)
 
-    # #TODO: turn on when updating
-    nfl.cache_pbp(
-        get_years_after_date(years, 1999),
-        downcast=False,
-    )
-    pbp_data = nfl.import_pbp_data(
-        get_years_after_date(years, 1999),
-        downcast=False,
-        cache=True
-        # columns=pbp_fields  # no longer using fields
+    update_pbp_store([int(x) for x in get_years_after_date(years, 1999)])
+
+    roster_data = nfl.import_rosters(get_years_after_date(years, 1999))
+    roster_data.to_csv("data/roster_data.csv", index=False)
+
+    season_data = nfl.import_seasonal_data(get_years_after_date(years, 1999))
+    season_data.to_csv("data/season_data.csv", index=False)
+
+    snap_data = nfl.import_snap_counts(get_years_after_date(years, 2012))
+    snap_data.to_csv("data/snap_data.csv", index=False)
+
+    for x in ["weekly", "season"]:
+        df = nfl.import_qbr(get_years_after_date(years, 2006), frequency=x)
+        df.to_csv(f"data/qbr_data_{x}.csv", index=False)
+
+    for x in ["receiving", "passing", "rushing"]:
+        df = nfl.import_ngs_data(x, get_years_after_date(years, 2019))
+        df.to_csv(f"data/ngs_data_{x}.csv", index=False)
+
+    for x in ["pass", "rec", "rush"]:
+        df = nfl.import_pfr(x, get_years_after_date(years, 2019))
+        df.to_csv(f"data/pfr_data_{x}.csv", index=False)
+
+
+def gather_moments(args):
+    """Match sales to touchdowns and packs, and write the tables the app reads."""
+    df = pd.read_csv(sales_file)
+    sales_counts, debuts, _ = load_sales_state()
+    add_sales_columns(df, sales_counts, debuts)
+    years = get_sales_years()
+    team_abbr = get_team_abbr(pd.read_csv("data/team_desc.csv"))
+    weekly_data = pd.read_csv("data/weekly_data.csv")
+    pbp_data = read_pbp(
+        columns=["Season", "home_team", "week", "qtr", "quarter_seconds_remaining"]
+        + ["touchdown"],
+        seasons=[int(x) for x in get_years_after_date(years, 1999)],
     )
-    pbp_data["Season"] = pd.to_numeric(pbp_data.game_id.str.split("_").str[0])
 
-    pbp_data.to_csv(
-        "data/pbp.csv.gz",
-        index=False,
-        compression="gzip",
+    player_index = build_player_index(
+        df,
+        pd.read_csv("data/roster_data.csv"),
+        team_abbr,
+        load_player_name_overrides(),
+    )
+    player_index.to_csv(player_index_file, index=False)
+    df["nfl_player_id"] = df.Player_ID.map(
+        player_index.set_index("Player_ID").player_id
     )
-    pbp_2022 = pbp_data[pbp_data.Season == 2022].reset_index(drop=True)
-    pbp_2022.to_csv("data/pbp_2022.csv.gz", index=False, compression="gzip")
 
     main_with_td = get_td_data(df, weekly_data, pbp_data, team_abbr)
     # #TODO: eventually add gambling lines etc info from schedule_data
-    main_with_td["won_game"] = main_with_td.apply(won_game, axis=1)
-    main_with_td["tie_game"] = main_with_td.apply(tie_game, axis=1)
-    main_with_td["Game Outcome"] = main_with_td.apply(get_game_outcome, axis=1)
-    main_with_td.to_csv(
-        "data/current_allday_data.csv.gz",
-        index=False,
-        compression="gzip",
-    )
+    add_derived_columns(main_with_td)
+    if args.check_derived:
+        check_derived_columns(main_with_td)
+    write_table(main_with_td, allday_path, partition_cols=["Season"])
 
+    combined_df = read_table(pack_path)
     merged = main_with_td.merge(
         combined_df[
             [
@@ -568,28 +1516,105 @@ if __name__ == "__main__":
         right_on="Moment_ID",
     )
 
-    merged.to_csv(
-        "data/current_allday_data_pack.csv.gz",
-        index=False,
-        compression="gzip",
+    # Pack-only rows (Moments never resold) have no Season, and are dropped by
+    # load_player_pack anyway
+    write_table(
+        merged[merged.Season.notna()], player_pack_path, partition_cols=["Season"]
     )
-    roster_data = nfl.import_rosters(get_years_after_date(years, 1999))
-    roster_data.to_csv("data/roster_data.csv", index=False)
+    write_categories([main_with_td, combined_df])
 
-    season_data = nfl.import_seasonal_data(get_years_after_date(years, 1999))
-    season_data.to_csv("data/season_data.csv", index=False)
 
-    snap_data = nfl.import_snap_counts(get_years_after_date(years, 2012))
-    snap_data.to_csv("data/snap_data.csv", index=False)
+stages = {
+    "packs": gather_packs,
+    "sales": gather_sales,
+    "nfl": gather_nfl,
+    "moments": gather_moments,
+}
 
-    for x in ["weekly", "season"]:
-        df = nfl.import_qbr(get_years_after_date(years, 2006), frequency=x)
-        df.to_csv(f"data/qbr_data_{x}.csv", index=False)
 
-    for x in ["receiving", "passing", "rushing"]:
-        df = nfl.import_ngs_data(x, get_years_after_date(years, 2019))
-        df.to_csv(f"data/ngs_data_{x}.csv", index=False)
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--stage",
+        choices=["all"] + list(stages),
+        default="all",
+        help="run only this stage (see pipeline.py)",
+    )
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="ignore the stored watermarks and re-download every team's sales",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="maximum number of Flipside queries in flight",
+    )
+    parser.add_argument(
+        "--pack-batch-days",
+        type=int,
+        default=31,
+        help="longest date range fetched by one pack/reveal query (1 = one query per day)",
+    )
+    parser.add_argument(
+        "--settle-days",
+        type=float,
+        default=2,
+        help="days after which a day's pack/reveal results are treated as final",
+    )
+    parser.add_argument(
+        "--ttl-hours",
+        type=float,
+        default=12,
+        help="how long unsettled days and team sales are reused before refetching",
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=100_000,
+        help="rows per page of the team sales and pack queries",
+    )
+    parser.add_argument(
+        "--shard-rows",
+        type=int,
+        default=None,
+        help="split team queries expected to return more rows than this by date "
+        "(default: an even share of all expected rows per --concurrency slot)",
+    )
+    parser.add_argument(
+        "--merge-memory-mb",
+        type=int,
+        default=256,
+        help="approximate memory used for merging the stored query results",
+    )
+    parser.add_argument(
+        "--record",
+        type=Path,
+        default=None,
+        help="save every query result to this directory for later replay",
+    )
+    parser.add_argument(
+        "--replay",
+        type=Path,
+        default=None,
+        help="serve query results from recordings in this directory instead of Flipside",
+    )
+    parser.add_argument(
+        "--fixtures",
+        type=Path,
+        default=None,
+        help="answer queries from the fixture tables in this directory (see benchmark.py)",
+    )
+    parser.add_argument(
+        "--check-derived",
+        action="store_true",
+        help="check the derived columns against the row-wise reference functions",
+    )
+    return parser
 
-    for x in ["pass", "rec", "rush"]:
-        df = nfl.import_pfr(x, get_years_after_date(years, 2019))
-        df.to_csv(f"data/pfr_data_{x}.csv", index=False)
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    for x in stages if args.stage == "all" else [args.stage]:
+        stages[x](args)
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""Run the offline data refresh (gather_data → challenges → cache) as a graph of
+stages.
+
+Each stage is a command with declared inputs and outputs. A stage is skipped
+if the hash of its inputs matches its last successful run and its outputs
+exist. Stages that fetch remote data can't see what changed upstream, so they
+also rerun once their last run is older than `max_age_hours`; whatever they
+rewrite unchanged doesn't make the stages after them stale.
+
+Stages start as soon as the stages producing their inputs have finished, up to
+`--jobs` at a time, and each reports its wall time and peak memory: that of
+its largest process, and that of all its processes (e.g. cache.py's workers)
+together.
+
+    python pipeline.py
+    python pipeline.py --jobs 3 --force challenges cache
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+state_file = Path("data/pipeline_state.json")
+
+
+@dataclass
+class Stage:
+    name: str
+    cmd: list
+    inputs: list = field(default_factory=list)
+    outputs: list = field(default_factory=list)
+    max_age_hours: Optional[float] = None
+
+
+gather = [sys.executable, "gather_data.py", "--stage"]
+gather_code = ["gather_data.py", "flipside.py", "store.py"]
+app_code = ["utils.py", "store.py"]
+nfl_outputs = [
+    "data/team_desc.csv",
+    "data/schedule_data.csv",
+    "data/weekly_data.csv",
+    "data/pbp",
+    "data/roster_data.csv",
+    "data/season_data.csv",
+    "data/snap_data.csv",
+    "data/qbr_data_weekly.csv",
+    "data/qbr_data_season.csv",
+    "data/ngs_data_receiving.csv",
+    "data/ngs_data_passing.csv",
+    "data/ngs_data_rushing.csv",
+    "data/pfr_data_pass.csv",
+    "data/pfr_data_rec.csv",
+    "data/pfr_data_rush.csv",
+]
+
+stages = [
+    Stage(
+        "packs",
+        gather + ["packs"],
+        inputs=gather_code + ["sql/sdk_packs.sql", "sql/sdk_reveals.sql"],
+        outputs=[
+            "data/pack_data.csv.gz",
+            "data/pack_reveals.csv.gz",
+            "data/pack_combined.parquet",
+        ],
+        max_age_hours=12,
+    ),
+    Stage(
+        "sales",
+        gather + ["sales"],
+        inputs=gather_code + ["sql/sdk_allday.sql"],
+        # Sales counts and debuts, added to the sales by the moments stage
+        outputs=["data/sales.csv.gz", "data/teams/state"],
+        max_age_hours=12,
+    ),
+    Stage(
+        "nfl",
+        gather + ["nfl"],
+        inputs=gather_code + ["data/sales.csv.gz"],
+        outputs=nfl_outputs,
+        max_age_hours=12,
+    ),
+    Stage(
+        "moments",
+        gather + ["moments"],
+        inputs=gather_code
+        + [
+            "data/sales.csv.gz",
+            "data/teams/state",
+            "data/team_desc.csv",
+            "data/weekly_data.csv",
+            "data/pbp",
+            "data/pbp_td_overrides.csv",
+            "data/roster_data.csv",
+            "data/player_name_overrides.csv",
+            "data/pack_combined.parquet",
+        ],
+        outputs=[
+            "data/current_allday_data.parquet",
+            "data/current_allday_data_pack.parquet",
+            "data/player_index.csv",
+            "data/categories.json",
+        ],
+    ),
+    Stage(
+        "challenges",
+        [sys.executable, "challenges.py"],
+        inputs=["challenges.py"]
+        + app_code
+        + [
+            "data/current_allday_data.parquet",
+            "data/pbp",
+            "data/weekly_data.csv",
+            "data/season_data.csv",
+            "data/roster_data.csv",
+            "data/NFLALLDAY_Challenges-Challenges.csv",
+        ],
+        outputs=["data/challenges"],
+    ),
+    Stage(
+        "cache",
+        [sys.executable, "cache.py"],
+        inputs=["cache.py"]
+        + app_code
+        + [
+            "data/current_allday_data.parquet",
+            "data/current_allday_data_pack.parquet",
+            "data/categories.json",
+            # nfl_player_id of the pack moments, for their headshots
+            "data/player_index.csv",
+            "data/pack_combined.parquet",
+            "data/packs.csv",
+            "data/roster_data.csv",
+        ],
+        outputs=["data/cache"],
+    ),
+]
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def hash_path(path):
+    """Content hash of a file, or of every file under a directory. File names
+    within a directory are left out, since Parquet datasets get random ones."""
+    path = Path(path)
+    if path.is_file():
+        return hash_file(path)
+    if path.is_dir():
+        files = sorted(
+            (str(x.parent.relative_to(path)), hash_file(x))
+            for x in path.rglob("*")
+            if x.is_file()
+        )
+        return hashlib.sha256(json.dumps(files).encode("utf-8")).hexdigest()
+    return None
+
+
+def get_input_hash(stage):
+    inputs = {x: hash_path(x) for x in stage.inputs}
+    return hashlib.sha256(
+        json.dumps([stage.cmd[1:], inputs], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def get_dependencies(stages):
+    producers = {x: stage.name for stage in stages for x in stage.outputs}
+    return {
+        stage.name: {
+            producers[x]
+            for x in stage.inputs
+            if x in producers and producers[x] != stage.name
+        }
+        for stage in stages
+    }
+
+
+def is_stale(stage, previous, input_hash):
+    if previous is None or previous["inputs"] != input_hash:
+        return True
+    if not all(Path(x).exists() for x in stage.outputs):
+        return True
+    if stage.max_age_hours is not None:
+        age = datetime.datetime.now() - datetime.datetime.fromisoformat(
+            previous["finished_at"]
+        )
+        return age > datetime.timedelta(hours=stage.max_age_hours)
+    return False
+
+
+def get_tree_rss(pid):
+    """Resident memory in bytes of `pid` and all its descendants, or None
+    without a /proc to read it from."""
+    children, rss = {}, {}
+    for x in Path("/proc").glob("[0-9]*"):
+        try:
+            stat = (x / "stat").read_text()
+        except OSError:
+            continue
+        # After the command name, which can hold spaces: state, ppid, ... rss
+        fields = stat.rsplit(")", 1)[1].split()
+        children.setdefault(int(fields[1]), []).append(int(x.name))
+        rss[int(x.name)] = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    if pid not in rss:
+        return None
+    total, pending = 0, [pid]
+    while pending:
+        x = pending.pop()
+        total += rss.get(x, 0)
+        pending += children.get(x, [])
+    return total
+
+
+def run_stage(stage, previous, force=False, interval=0.5):
+    """Run `stage` unless it is up to date, returning its record for the
+    state file. The memory of all its processes is sampled every `interval`
+    seconds."""
+    input_hash = get_input_hash(stage)
+    if not force and not is_stale(stage, previous, input_hash):
+        return dict(previous, status="skipped")
+
+    print(f"#@# {stage.name}: {' '.join(stage.cmd[1:])}")
+    start = time.perf_counter()
+    process = subprocess.Popen(stage.cmd)
+    tree_rss = None
+    while True:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid != 0:
+            break
+        rss = get_tree_rss(process.pid)
+        if rss is not None:
+            tree_rss = max(tree_rss or 0, rss)
+        time.sleep(interval)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.perf_counter() - start
+    # The largest of the stage and the workers it waited for, which may have
+    # run at the same time. ru_maxrss is in KiB on Linux, bytes on macOS
+    max_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "status": "ran" if process.returncode == 0 else "failed",
+        "returncode": process.returncode,
+        "inputs": input_hash,
+        "finished_at": datetime.datetime.now().isoformat(),
+        "seconds": round(seconds, 1),
+        "max_rss_mb": round(max_rss / 2**20, 1),
+        "tree_rss_mb": round(tree_rss / 2**20, 1) if tree_rss is not None else None,
+    }
+
+
+def load_state():
+    if not state_file.exists():
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def save_state(state):
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(state_file, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def run_pipeline(stages, jobs=2, force=()):
+    state = load_state()
+    dependencies = get_dependencies(stages)
+    results = {}
+    running = {}
+    with ThreadPoolExecutor(jobs) as executor:
+        while len(results) < len(stages):
+            for stage in stages:
+                if stage.name in results or stage.name in running.values():
+                    continue
+                upstream = [results.get(x) for x in dependencies[stage.name]]
+                if any(x is not None and x["status"] == "failed" for x in upstream):
+                    print(f"#@# {stage.name}: not run, an upstream stage failed")
+                    results[stage.name] = {"status": "failed"}
+                elif all(x is not None for x in upstream):
+                    future = executor.submit(
+                        run_stage,
+                        stage,
+                        state.get(stage.name),
+                        "all" in force or stage.name in force,
+                    )
+                    running[future] = stage.name
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                result = future.result()
+                results[name] = result
+                if result["status"] == "ran":
+                    state[name] = {
+                        k: v for k, v in result.items() if k not in ["status"]
+                    }
+                    save_state(state)
+                print(f"#@# {name}: {result['status']}")
+
+    for stage in stages:
+        x = results[stage.name]
+        if x["status"] == "ran":
+            tree_rss = x.get("tree_rss_mb")
+            tree_rss = f"{tree_rss:>8.1f} MB" if tree_rss is not None else "n/a"
+            print(
+                f"#@# {stage.name:<12} ran in {x['seconds']:>8.1f}s, "
+                f"peak RSS {x['max_rss_mb']:>8.1f} MB largest process, "
+                f"{tree_rss} all processes"
+            )
+        else:
+            print(f"#@# {stage.name:<12} {x['status']}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--jobs", type=int, default=2, help="maximum number of stages run at once"
+    )
+    parser.add_argument(
+        "--force",
+        nargs="*",
+        default=[],
+        choices=["all"] + [x.name for x in stages],
+        help="run these stages even if they are up to date",
+    )
+    args = parser.parse_args()
+    results = run_pipeline(stages, args.jobs, args.force)
+    if any(x["status"] == "failed" for x in results.values()):
+        raise SystemExit("Some stages failed")
@@ -96,3 +96,17 @@ FROM
     sales_with_metadata
 WHERE
     "Team" = {{ team }}
+{%- if since %}
+    AND "Datetime" >= {{ since }}
+{%- endif %}
+{%- if start_date %}
+    AND "Date" >= {{ start_date }}
+{%- endif %}
+{%- if end_date %}
+    AND "Date" <= {{ end_date }}
+{%- endif %}
+ORDER BY
+    "Date",
+    "Player",
+    "Datetime",
+    "tx_id"
@@ -8,9 +8,16 @@ SELECT
     price AS "Price",
     buyer AS "Buyer",
     nft_id
+{%- if start_date %},
+    block_timestamp :: DATE AS "Block_Date"
+{%- endif %}
 FROM
     flow.core.ez_nft_sales
 WHERE
     nft_collection = 'A.e4cf4bdc1751c65d.PackNFT'
     AND tx_succeeded = 'TRUE'
+{%- if start_date %}
+    AND block_timestamp :: DATE BETWEEN {{ start_date }} AND {{ end_date }}
+{%- else %}
     AND block_timestamp :: DATE = {{ date }}
+{%- endif %}
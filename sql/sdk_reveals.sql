@@ -7,10 +7,17 @@ SELECT
     tx_id AS "tx_id",
     event_data ['id'] AS pack_id,
     event_data ['nfts'] AS nfts
+{%- if start_date %},
+    block_timestamp :: DATE AS "Block_Date"
+{%- endif %}
 FROM
     flow.core.fact_events
 WHERE
     event_type = 'Revealed'
     AND event_contract = 'A.e4cf4bdc1751c65d.PackNFT'
     AND tx_succeeded = 'TRUE'
+{%- if start_date %}
+    AND block_timestamp :: DATE BETWEEN {{ start_date }} AND {{ end_date }}
+{%- else %}
     AND block_timestamp :: DATE = {{ date }}
+{%- endif %}
@@ -0,0 +1,483 @@
+import io
+import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+allday_path = Path("data/current_allday_data.parquet")
+player_pack_path = Path("data/current_allday_data_pack.parquet")
+pack_path = Path("data/pack_combined.parquet")
+pbp_dir = Path("data/pbp")
+# All sales with their resale counts, before TD matching
+sales_file = Path("data/sales.csv.gz")
+# Values of the categorical columns, see utils.set_categories
+category_file = Path("data/categories.json")
+# Per day partial aggregates of sale prices, see update_daily_aggregates
+daily_aggregate_path = Path("data/cache/daily_aggregates.parquet")
+daily_aggregate_keys = [
+    "marketplace_id",
+    "Player",
+    "Position",
+    "Play_Type",
+    "Moment_Tier",
+]
+
+# Outputs of cache.py for the app, see write_cache
+cache_db = Path("data/cache/cache.sqlite")
+# Formatted t-test results of caches built before the ttests table
+legacy_ttest_file = Path("data/cache/score_ttest_results.json")
+ttest_key_cols = [
+    "date_range",
+    "play_type",
+    "how_scores",
+    "agg_metric",
+    "position_type",
+    "metric",
+    "short_form",
+]
+
+# Frames shared with worker processes, on tmpfs where there is one
+shared_dir = Path("/dev/shm") if Path("/dev/shm").is_dir() else None
+
+# Play-by-play files are sorted by these within each season, for the TD matcher
+pbp_sort_by = ["week", "home_team", "qtr", "quarter_seconds_remaining"]
+
+datetime_cols = [
+    "Datetime",
+    "Date",
+    "Datetime_Reveal",
+    "Datetime_Pack",
+]
+
+categorical_cols = [
+    "Player",
+    "Team",
+    "Position",
+    "Play_Type",
+    "Moment_Tier",
+    "Set_Name",
+    "Series",
+    "Classification",
+    "Game Outcome",
+    "Pack Type",
+]
+
+# Mixed int/str values ("1", ..., "Divisional", "Super Bowl LVI")
+string_cols = ["Week"]
+
+row_group_size = 50_000
+
+
+def write_table(df, path, partition_cols=None, sort_by="Date"):
+    """Write `df` as a Parquet dataset at `path`, replacing any previous version.
+
+    Rows are sorted by `sort_by` so that the row group statistics let date
+    filters skip most of a partition.
+    """
+    df = df.copy()
+    for x in datetime_cols:
+        if x in df.columns:
+            df[x] = pd.to_datetime(df[x])
+    for x in categorical_cols:
+        if x in df.columns:
+            df[x] = df[x].astype("category")
+    for x in string_cols:
+        if x in df.columns:
+            df[x] = df[x].astype(str).where(df[x].notna())
+    if sort_by is not None:
+        df = df.sort_values(by=sort_by, kind="stable")
+
+    path = Path(path)
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+    df.to_parquet(
+        path,
+        index=False,
+        partition_cols=partition_cols,
+        row_group_size=row_group_size,
+    )
+    return path
+
+
+def write_categories(dfs):
+    """Save the values of `categorical_cols` seen in any of `dfs`, sorted."""
+    categories = {}
+    for x in categorical_cols:
+        values = set()
+        for df in dfs:
+            if x in df.columns:
+                values.update(df[x].dropna().unique().tolist())
+        if values:
+            categories[x] = sorted(values, key=str)
+    with open(category_file, "w") as f:
+        json.dump(categories, f, indent=2)
+
+
+def read_categories():
+    if not category_file.exists():
+        return {}
+    with open(category_file) as f:
+        return json.load(f)
+
+
+def read_table(path, columns=None, filters=None, seasons=None):
+    """Read `columns` of the Parquet dataset at `path`.
+
+    `filters` are pyarrow filters, e.g. `[("Date", ">=", "2022-09-08")]`;
+    `seasons` restricts a Season-partitioned dataset to those partitions.
+    """
+    filters = [
+        (col, op, pd.Timestamp(val))
+        if col in datetime_cols and isinstance(val, str)
+        else (col, op, val)
+        for col, op, val in filters or []
+    ]
+    if seasons is not None:
+        seasons = [seasons] if isinstance(seasons, int) else list(seasons)
+        filters.append(("Season", "in", seasons))
+    df = pd.read_parquet(path, columns=columns, filters=filters or None)
+    # Hive partition values come back as categoricals
+    if "Season" in df.columns and isinstance(df.Season.dtype, pd.CategoricalDtype):
+        df["Season"] = pd.to_numeric(df.Season.astype(object), errors="coerce")
+    return df
+
+
+def get_daily_aggregates(df, keys, value):
+    x = df[value].astype("float64")
+    return (
+        df[["Date", *keys]]
+        .assign(x=x, x2=x**2)
+        # Rows missing a key still count towards groups by the other keys
+        .groupby(["Date", *keys], observed=True, dropna=False)
+        .agg(
+            rows=("x", "size"),
+            count=("x", "count"),
+            sum=("x", "sum"),
+            sumsq=("x2", "sum"),
+            min=("x", "min"),
+            max=("x", "max"),
+        )
+        .reset_index()
+    )
+
+
+def get_day_hashes(df, keys, value):
+    """Content hash of each day's `keys` and `value`, whatever the row order:
+    two 31-bit sums of the row hashes."""
+    h = pd.util.hash_pandas_object(
+        df[keys].assign(x=df[value].astype("float64")), index=False
+    ).to_numpy()
+    parts = pd.DataFrame(
+        {"lo": h & 0x7FFFFFFF, "hi": (h >> 33) & 0x7FFFFFFF}, dtype="int64"
+    )
+    sums = parts.groupby(df.Date.to_numpy()).sum() % 2**31
+    return sums.hi * 2**31 + sums.lo
+
+
+def update_daily_aggregates(
+    df, path=daily_aggregate_path, keys=daily_aggregate_keys, value="Price"
+):
+    """Partial aggregates of `value` (count, sum, sum of squares, min, max) per
+    day and `keys`, kept at `path` between runs. Only the days whose rows in
+    `df` hash differently from those behind the stored partials are grouped
+    again, so a new week of sales only adds that week's partials, and a refetch
+    that corrects a day's prices or players regroups that day."""
+    path = Path(path)
+    day_hashes = get_day_hashes(df, keys, value)
+    if path.exists():
+        stored = read_table(path)
+        if "day_hash" not in stored.columns:
+            stored["day_hash"] = np.nan
+        stored_hashes = stored.groupby("Date")["day_hash"].first().astype("Int64")
+        dates = day_hashes.index.union(stored_hashes.index)
+        same = day_hashes.astype("Int64").reindex(dates).eq(
+            stored_hashes.reindex(dates)
+        )
+        changed = dates[~same.fillna(False).to_numpy(dtype=bool)]
+        stored = stored[~stored.Date.isin(changed)]
+        df = df[df.Date.isin(changed)]
+        print(f"#@# daily aggregates: {len(changed)} days regrouped")
+    else:
+        stored = None
+    regrouped = get_daily_aggregates(df, keys, value)
+    regrouped["day_hash"] = regrouped.Date.map(day_hashes)
+    daily = pd.concat([stored, regrouped], ignore_index=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_table(daily, path)
+    return daily.sort_values(by="Date", kind="stable").reset_index(drop=True)
+
+
+def combine_aggregates(daily, by):
+    """Count, mean, variance, min and max of the value behind the partials in
+    `daily` (e.g. a date range of them), by `by`."""
+    grouped = (
+        daily.groupby(by, observed=True)
+        .agg(
+            count=("count", "sum"),
+            sum=("sum", "sum"),
+            sumsq=("sumsq", "sum"),
+            min=("min", "min"),
+            max=("max", "max"),
+        )
+        .reset_index()
+    )
+    grouped["mean"] = grouped["sum"] / grouped["count"]
+    grouped["var"] = (grouped.sumsq - grouped["sum"] ** 2 / grouped["count"]) / (
+        grouped["count"] - 1
+    )
+    return grouped
+
+
+def connect_cache(path=cache_db):
+    # Builds may write from several threads and processes at once
+    con = sqlite3.connect(path, timeout=300)
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS artifacts (
+            artifact TEXT NOT NULL,
+            date_range TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (artifact, date_range, metric)
+        )
+        """
+    )
+    return con
+
+
+def write_cache(df, artifact, date_range="", metric="", path=cache_db):
+    """Replace the frame of `artifact` for `date_range` and `metric`.
+
+    Frames are stored as compressed Parquet, one row of the `artifacts` table
+    each, so they keep their dtypes and a loader reads exactly one of them
+    through the primary key index.
+    """
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False, compression="zstd")
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with closing(connect_cache(path)) as con, con:
+        con.execute(
+            "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+            (artifact, date_range, metric, len(df), buffer.getvalue()),
+        )
+
+
+def read_cache(artifact, date_range="", metric="", path=cache_db):
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as con:
+        row = con.execute(
+            "SELECT data FROM artifacts "
+            "WHERE artifact = ? AND date_range = ? AND metric = ?",
+            (artifact, date_range, metric),
+        ).fetchone()
+    if row is None:
+        raise KeyError(f"{artifact} {date_range} {metric} is not in {path}")
+    return pd.read_parquet(io.BytesIO(row[0]))
+
+
+def write_ttests(rows, path=cache_db):
+    """Replace the score t-test results with `rows`, each the values of
+    `ttest_key_cols` (`metric` as JSON), then `agg_column` and a
+    `utils.get_ttest_values` tuple for one position."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with closing(connect_cache(path)) as con, con:
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ttests (
+                date_range TEXT NOT NULL,
+                play_type TEXT NOT NULL,
+                how_scores TEXT NOT NULL,
+                agg_metric TEXT NOT NULL,
+                position_type TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                short_form TEXT NOT NULL,
+                agg_column TEXT NOT NULL,
+                position_index INTEGER NOT NULL,
+                position TEXT NOT NULL,
+                n_metric INTEGER NOT NULL,
+                n_no_metric INTEGER NOT NULL,
+                n_pos INTEGER NOT NULL,
+                metric_mean REAL,
+                no_metric_mean REAL,
+                pvalue REAL,
+                PRIMARY KEY (
+                    date_range,
+                    play_type,
+                    how_scores,
+                    agg_metric,
+                    position_type,
+                    metric,
+                    short_form,
+                    position_index
+                )
+            )
+            """
+        )
+        con.execute("DELETE FROM ttests")
+        con.executemany(
+            f"INSERT INTO ttests VALUES ({', '.join(['?'] * 16)})", rows
+        )
+
+
+def read_ttests(key, path=cache_db):
+    """The `(agg_column, position, n_metric, n_no_metric, n_pos, metric_mean,
+    no_metric_mean, pvalue)` rows of one test, in position order, or None if
+    the store has no t-test results yet."""
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as con:
+        if not con.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ttests'"
+        ).fetchone():
+            return None
+        rows = con.execute(
+            "SELECT agg_column, position, n_metric, n_no_metric, n_pos, "
+            "metric_mean, no_metric_mean, pvalue FROM ttests "
+            f"WHERE {' AND '.join(f'{x} = ?' for x in ttest_key_cols)} "
+            "ORDER BY position_index",
+            key,
+        ).fetchall()
+    if not rows:
+        raise KeyError(f"No t-test results for {key}")
+    # Missing means and p-values are stored as NULL
+    return [
+        (*x[:5], *[np.nan if y is None else y for y in x[5:]]) for x in rows
+    ]
+
+
+def downcast(df):
+    """Smallest numeric dtypes, and categoricals for repetitive strings."""
+    df = df.copy()
+    for x in df.columns:
+        if pd.api.types.is_float_dtype(df[x]):
+            df[x] = pd.to_numeric(df[x], downcast="float")
+        elif pd.api.types.is_integer_dtype(df[x]):
+            df[x] = pd.to_numeric(df[x], downcast="integer")
+        elif pd.api.types.is_string_dtype(df[x]) and df[x].nunique() < len(df) / 2:
+            df[x] = df[x].astype("category")
+    return df
+
+
+def get_pbp_file(season):
+    return pbp_dir / f"Season={season}" / "pbp.parquet"
+
+
+def write_pbp_season(df, season):
+    """Replace the play-by-play data for `season`."""
+    path = get_pbp_file(season)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Stable, so plays sharing a key keep their order within the game
+    df = downcast(df.drop(columns="Season", errors="ignore"))
+    df.sort_values(by=pbp_sort_by, kind="stable").to_parquet(
+        path, index=False, row_group_size=row_group_size
+    )
+    return path
+
+
+def read_pbp(columns=None, filters=None, seasons=None):
+    return read_table(pbp_dir, columns=columns, filters=filters, seasons=seasons)
+
+
+class BackgroundWriter:
+    """Write DataFrames to CSV or the cache store on background threads, so
+    that formatting and compression overlap with computing the next frame.
+
+    A frame must not be modified after it is handed to `to_csv` or
+    `to_cache`. At most `max_pending` frames are queued, after which these
+    block. `close` waits for every write and raises the first error, in
+    submission order.
+    """
+
+    def __init__(self, max_workers=4, max_pending=8):
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="writer")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+
+    def write(self, write, args, kwargs):
+        try:
+            write(*args, **kwargs)
+        finally:
+            self.slots.release()
+
+    def submit(self, name, write, *args, **kwargs):
+        self.slots.acquire()
+        self.futures.append(
+            (name, self.executor.submit(self.write, write, args, kwargs))
+        )
+
+    def to_csv(self, df, path, **kwargs):
+        self.submit(path, df.to_csv, path, **kwargs)
+
+    def to_cache(self, df, artifact, date_range="", metric="", **kwargs):
+        self.submit(
+            f"{artifact} {date_range} {metric}".strip(),
+            write_cache,
+            df,
+            artifact,
+            date_range,
+            metric,
+            **kwargs,
+        )
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        errors = [(name, x.exception()) for name, x in self.futures if x.exception()]
+        self.futures = []
+        if errors:
+            names = ", ".join(str(name) for name, _ in errors)
+            raise RuntimeError(
+                f"{len(errors)} background writes failed: {names}"
+            ) from errors[0][1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't hide the original error behind a failed write
+            self.executor.shutdown(wait=True)
+
+
+class SharedFrame:
+    """A DataFrame written once as an Arrow IPC file in `shared_dir`, which
+    worker processes memory-map instead of each receiving a pickled copy.
+
+    Pickling a SharedFrame only pickles its path. `read` maps the file rather
+    than reading it, and the numeric and datetime columns, the codes of the
+    categoricals and the strings it returns are read-only views of the shared
+    pages. Only the bool and object columns (and any with nulls, e.g.
+    nullable integers) are converted, a copy in each worker. `unlink` removes
+    the file once no more workers will read it; frames already read stay
+    valid.
+    """
+
+    def __init__(self, df, directory=None):
+        directory = directory or shared_dir or tempfile.gettempdir()
+        self.path = Path(directory) / f"frame-{uuid.uuid4().hex}.arrow"
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        for i, dtype in enumerate(df.dtypes):
+            # Keep NaN rather than a null, which to_pandas would have to fill
+            if dtype.kind == "f" and table.column(i).null_count > 0:
+                values = pa.array(df.iloc[:, i].to_numpy(), from_pandas=False)
+                table = table.set_column(i, table.field(i), values)
+        with pa.OSFile(str(self.path), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    def read(self):
+        table = pa.ipc.open_file(pa.memory_map(str(self.path))).read_all()
+        return table.to_pandas(split_blocks=True)
+
+    def unlink(self):
+        self.path.unlink(missing_ok=True)
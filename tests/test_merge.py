@@ -0,0 +1,131 @@
+"""combine_flipside_data on day files saved before they were kept sorted, and
+merging only what changed since the last run."""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import gather_data
+from gather_data import combine_flipside_data, is_sorted_file
+
+sort_by = ["Datetime", "tx_id"]
+
+
+def write_day(path, day, rng, n=5000):
+    df = pd.DataFrame(
+        {
+            "Datetime": (
+                pd.Timestamp(f"2022-01-{day:02d}")
+                + pd.to_timedelta(rng.integers(0, 86400, n), unit="s")
+            ).astype(str),
+            "tx_id": rng.integers(0, 10**9, n).astype(float),
+            "Price": rng.random(n),
+        }
+    )
+    df.loc[::97, "tx_id"] = np.nan
+    df.to_csv(path / f"pack_sales--2022-01-{day:02d}.csv.gz", index=False)
+    return df
+
+
+def read_days(path):
+    days = [pd.read_csv(x) for x in sorted(path.glob("pack_sales--*csv.gz"))]
+    return pd.concat(days).sort_values(by=sort_by, kind="stable").reset_index(drop=True)
+
+
+def test_unsorted_day_files_are_merged_and_sorted_once(tmp_path):
+    rng = np.random.default_rng(0)
+    days = []
+    for i in range(3):
+        days.append(write_day(tmp_path, i + 1, rng))
+        os.utime(tmp_path / f"pack_sales--2022-01-0{i + 1}.csv.gz", (1e9, 1e9))
+
+    # Far smaller chunks than the 5,000 rows of each day
+    merged = combine_flipside_data(
+        tmp_path, "pack_sales--*csv.gz", sort_by, max_memory=1
+    )
+
+    expected = pd.concat(days).sort_values(by=sort_by, kind="stable")
+    pd.testing.assert_frame_equal(merged, expected.reset_index(drop=True))
+    for path in tmp_path.glob("pack_sales--*csv.gz"):
+        assert is_sorted_file(path, sort_by, 1_000)
+        # The fetch time of results saved before the ResultCache manifest
+        assert path.stat().st_mtime == 1e9
+
+
+@pytest.fixture
+def merge(tmp_path, monkeypatch):
+    """Merge the day files in `tmp_path` into one output, returning the files
+    whose order was checked"""
+    checked = []
+    get_key_range = gather_data.get_key_range
+
+    def counted(path, *args):
+        checked.append(path.name)
+        return get_key_range(path, *args)
+
+    monkeypatch.setattr(gather_data, "get_key_range", counted)
+    output_file = tmp_path / "pack_data.csv.gz"
+
+    def run():
+        checked.clear()
+        combine_flipside_data(
+            tmp_path,
+            "pack_sales--*csv.gz",
+            sort_by,
+            output_file=output_file,
+            max_memory=1,
+            state_file=tmp_path / "pack_sales.merged.json",
+        )
+        pd.testing.assert_frame_equal(pd.read_csv(output_file), read_days(tmp_path))
+        return sorted(set(checked))
+
+    return output_file, run
+
+
+def test_only_new_and_changed_files_are_merged(tmp_path, merge):
+    output_file, run = merge
+    rng = np.random.default_rng(1)
+    for day in range(1, 6):
+        write_day(tmp_path, day, rng)
+    assert len(run()) == 5
+    size = output_file.stat().st_size
+    with open(output_file, "rb") as f:
+        merged = f.read()
+
+    # Nothing new
+    assert run() == []
+    assert output_file.read_bytes() == merged
+
+    # A new day is appended after what's there
+    write_day(tmp_path, 6, rng)
+    assert run() == ["pack_sales--2022-01-06.csv.gz"]
+    assert output_file.read_bytes()[:size] == merged
+
+    # A day fetched again is merged from where its rows start
+    state = json.loads((tmp_path / "pack_sales.merged.json").read_text())
+    day3 = next(x[0] for x in state["blocks"] if x[1][0][1] >= "2022-01-03")
+    merged = output_file.read_bytes()
+    write_day(tmp_path, 3, rng, n=300)
+    assert run() == ["pack_sales--2022-01-03.csv.gz"]
+    assert day3 > 0
+    assert output_file.read_bytes()[:day3] == merged[:day3]
+
+    # As is a day that's gone, and a legacy unsorted one
+    (tmp_path / "pack_sales--2022-01-05.csv.gz").unlink()
+    df = write_day(tmp_path, 2, rng).sample(frac=1, random_state=0)
+    df.to_csv(tmp_path / "pack_sales--2022-01-02.csv.gz", index=False)
+    assert run() == ["pack_sales--2022-01-02.csv.gz"]
+    assert is_sorted_file(tmp_path / "pack_sales--2022-01-02.csv.gz", sort_by, 1_000)
+
+
+def test_output_changed_elsewhere_is_merged_again(tmp_path, merge):
+    output_file, run = merge
+    rng = np.random.default_rng(2)
+    for day in range(1, 4):
+        write_day(tmp_path, day, rng)
+    run()
+    pd.read_csv(output_file).head(10).to_csv(output_file, index=False)
+    # The files are known sorted, but all merged again
+    assert run() == []
@@ -0,0 +1,108 @@
+"""Date range pack queries fetched in pages and split into day files."""
+import gzip
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import flipside
+import gather_data
+from flipside import (
+    FixtureBackend,
+    ResultCache,
+    fixture_queries,
+    get_fixture_table_name,
+    render_query,
+    run_queries,
+)
+from gather_data import (
+    estimate_pack_rows,
+    get_date_query,
+    get_flipside_pack_tasks,
+    get_pack_file,
+)
+
+days = [f"2022-01-{x:02d}" for x in range(1, 11)]
+sort_by = ["Datetime", "Price"]
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    n = 5_000
+    sales = pd.DataFrame(
+        {
+            "Block_Date": rng.choice(days[:-1], n),
+            "Price": rng.choice([59.0, 219.0], n),
+            "NFT_ID": np.arange(n),
+        }
+    )
+    sales["Datetime"] = sales.Block_Date + " " + pd.Series(
+        rng.integers(0, 86400, n)
+    ).map(lambda x: f"{x // 3600:02d}:{x // 60 % 60:02d}:{x % 60:02d}")
+    fixture_dir = tmp_path / "fixtures"
+    fixture_dir.mkdir()
+    for sql_file in fixture_queries:
+        df = sales if sql_file == "sdk_packs.sql" else sales.iloc[:0]
+        with gzip.open(fixture_dir / get_fixture_table_name(sql_file), "wt") as f:
+            json.dump({"columns": list(df.columns), "rows": df.values.tolist()}, f)
+    monkeypatch.setattr(gather_data, "pack_dir", tmp_path / "packs")
+    monkeypatch.setattr(gather_data, "all_dates", days)
+    (tmp_path / "packs").mkdir()
+    return sales, FixtureBackend(fixture_dir)
+
+
+def test_unpaged_query_is_cut_to_a_page(backend, monkeypatch):
+    _, backend = backend
+    monkeypatch.setattr(flipside, "default_page_size", 1_000)
+    sql = render_query(
+        "sdk_packs.sql", start_date="'2022-01-01'", end_date="'2022-01-10'"
+    )
+    assert len(backend.query(sql).rows) == 1_000
+    assert len(backend.query(sql, page_size=2_000, page_number=3).rows) == 1_000
+
+
+def test_pack_batches_are_fetched_in_pages(backend, tmp_path):
+    sales, backend = backend
+    cache = ResultCache(tmp_path / "manifest.json")
+    # A whole batch of 5,000 rows, over 1,000 row pages
+    tasks = get_flipside_pack_tasks(
+        "sdk_packs.sql", "pack_sales", sort_by, cache, page_size=1_000
+    )
+    assert len(tasks) == 1
+    outcomes = run_queries(tasks, backend)
+    assert all(x.ok for x in outcomes)
+    assert backend.queries == 6
+
+    for x in days:
+        expected = sales[sales.Block_Date == x].drop(columns="Block_Date")
+        df = pd.read_csv(get_pack_file(x, "pack_sales"))
+        assert len(df) == len(expected)
+        assert sorted(df.NFT_ID) == sorted(expected.NFT_ID)
+        assert cache.get(get_date_query(x, "sdk_packs.sql"))["rows"] == len(df)
+
+    # Later plans size batches from the recorded row counts
+    expected_rows = estimate_pack_rows(days[-3:], "sdk_packs.sql", cache)
+    assert expected_rows[days[-1]] == pytest.approx(
+        sales.Block_Date.value_counts().reindex(days[-8:], fill_value=0).mean()
+    )
+
+
+def test_failed_page_saves_nothing(backend, tmp_path):
+    _, backend = backend
+    cache = ResultCache(tmp_path / "manifest.json")
+    query = backend.query
+
+    def fail_third_page(sql, page_number=1, **kwargs):
+        if page_number == 3:
+            raise ValueError("lost connection")
+        return query(sql, page_number=page_number, **kwargs)
+
+    backend.query = fail_third_page
+    tasks = get_flipside_pack_tasks(
+        "sdk_packs.sql", "pack_sales", sort_by, cache, page_size=1_000
+    )
+    assert not run_queries(tasks, backend)[0].ok
+    assert not any(get_pack_file(x, "pack_sales").exists() for x in days)
+    assert cache.recorded == {}
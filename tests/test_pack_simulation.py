@@ -0,0 +1,113 @@
+"""Circulation-weighted pack simulation: alias tables and the packs drawn from
+them."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import (
+    alias_sample,
+    get_alias_table,
+    get_pack_pool,
+    pack_contents,
+    series2_mint1_premium_proportions,
+    series2_mint1_standard_proportions,
+    simulate_packs,
+)
+
+draws = 1_000_000
+
+
+def assert_proportional(counts, weights):
+    """Sampled `counts` within 5 standard errors of shares `weights`"""
+    expected = np.asarray(weights, dtype=float) / np.sum(weights)
+    observed = np.asarray(counts) / np.sum(counts)
+    error = np.sqrt(expected * (1 - expected) / np.sum(counts))
+    assert np.all(np.abs(observed - expected) <= 5 * error + 1e-12)
+
+
+@pytest.mark.parametrize(
+    "weights",
+    [
+        [1.0, 2.0, 3.0, 4.0],
+        [45.0, 799.0, 1199.0, 6000.0, 10000.0],
+        [7.0],
+        [1e-9, 1.0, 1e9],
+        np.random.default_rng(0).pareto(1.2, 2_000) + 1e-3,
+    ],
+)
+def test_alias_sample_frequencies(weights):
+    rng = np.random.default_rng(1)
+    positions = alias_sample(rng, get_alias_table(weights), draws)
+    assert_proportional(np.bincount(positions, minlength=len(weights)), weights)
+
+
+@pytest.fixture(scope="module")
+def sales():
+    """Sales of moments whose number of sales has nothing to do with their
+    circulation, as in the pack data."""
+    rng = np.random.default_rng(2)
+    moments = pd.DataFrame(
+        {
+            "marketplace_id": np.arange(60, dtype=float),
+            "Moment_Tier": ["COMMON"] * 30 + ["RARE"] * 20 + ["LEGENDARY"] * 10,
+            "Total_Circulation": rng.choice([45.0, 799.0, 1199.0, 6000.0], 60),
+            "sales": rng.integers(1, 200, 60),
+        }
+    )
+    # Never drawn without a known circulation
+    moments.loc[0, "Total_Circulation"] = np.nan
+    df = moments.loc[moments.index.repeat(moments.sales)].reset_index(drop=True)
+    df["Price"] = rng.lognormal(2, 1, len(df))
+    return moments, df.drop(columns="sales")
+
+
+@pytest.mark.parametrize(
+    "pack_type, proportions",
+    [
+        ("Standard", series2_mint1_standard_proportions),
+        ("Premium", series2_mint1_premium_proportions),
+    ],
+)
+def test_packs_follow_circulation(sales, pack_type, proportions):
+    moments, df = sales
+    pool = get_pack_pool(df, "Total_Circulation")
+    pack_tiers, packs = simulate_packs(
+        pool, proportions, pack_type, draws, np.random.default_rng(3)
+    )
+
+    for tier, share in proportions.items():
+        assert abs((pack_tiers == tier).mean() - share) < 5 * np.sqrt(
+            share * (1 - share) / draws
+        )
+        tier_packs = packs[pack_tiers == tier]
+        for moment_tier in ["COMMON", "RARE", "LEGENDARY"]:
+            n = (df.Moment_Tier.to_numpy()[tier_packs] == moment_tier) & (
+                tier_packs >= 0
+            )
+            expected = pack_contents[pack_type, tier].get(moment_tier, 0)
+            assert (n.sum(axis=1) == expected).all()
+
+    # Every pack starts with commons, each slot drawn from all of them
+    commons = moments[moments.Moment_Tier == "COMMON"].set_index("marketplace_id")
+    weighted = commons.Total_Circulation.dropna()
+    for slot in range(3):
+        drawn = pd.Series(df.marketplace_id.to_numpy()[packs[:, slot]])
+        counts = drawn.value_counts().reindex(commons.index, fill_value=0)
+        assert counts.loc[0.0] == 0
+        assert_proportional(counts.loc[weighted.index], weighted)
+
+
+def test_unweighted_packs_follow_sales(sales):
+    _, df = sales
+    rng = np.random.default_rng(4)
+    pool = get_pack_pool(df)
+    _, packs = simulate_packs(
+        pool, series2_mint1_premium_proportions, "Premium", 200_000, rng
+    )
+    # As DataFrame.sample did, a pack never repeats a sale...
+    ordered = np.sort(packs, axis=1)
+    assert (ordered[:, 1:] != ordered[:, :-1]).all()
+    # ...and every sale of a tier is as likely
+    commons = np.flatnonzero(df.Moment_Tier == "COMMON")
+    counts = np.bincount(packs[:, :6].ravel(), minlength=len(df))[commons]
+    assert_proportional(counts, np.ones(len(commons)))
@@ -0,0 +1,21 @@
+"""Peak memory of a stage whose workers run at the same time."""
+import sys
+
+from pipeline import Stage, run_stage
+
+workers = """
+import subprocess, sys
+hold = "x = bytearray(150 * 2**20); import time; time.sleep(2)"
+processes = [subprocess.Popen([sys.executable, "-c", hold]) for _ in range(2)]
+for x in processes:
+    x.wait()
+"""
+
+
+def test_peak_memory_counts_concurrent_workers():
+    stage = Stage("workers", [sys.executable, "-c", workers])
+    result = run_stage(stage, None, interval=0.1)
+    assert result["status"] == "ran"
+    assert result["max_rss_mb"] > 150
+    # Both workers at once, plus the stage
+    assert result["tree_rss_mb"] > 300
@@ -0,0 +1,54 @@
+"""update_sales_state a chunk at a time against whole files."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import gather_data
+from gather_data import load_sales_state, update_sales_state
+
+
+def write_team_files(team_dir, rng):
+    for stamp, team in [("2022-01-01", "A"), ("2022-01-01", "B"), ("2022-02-01", "A")]:
+        n = 2_000
+        df = pd.DataFrame(
+            {
+                "Date": "2022-01-01",
+                "Player": rng.choice(list("PQRS"), n),
+                "Position": rng.choice(["QB", "Team"], n),
+                "NFT_ID": rng.integers(0, 300, n).astype(float),
+                "marketplace_id": rng.integers(0, 40, n),
+                "Price": rng.random(n),
+            }
+        )
+        df.loc[::50, "NFT_ID"] = np.nan
+        df.to_csv(team_dir / f"{stamp}_team--{team}.csv.gz", index=False)
+    # A team without new sales
+    df.iloc[:0].to_csv(team_dir / "2022-02-01_team--C.csv.gz", index=False)
+
+
+@pytest.mark.parametrize("chunksize", [7, 333])
+def test_chunks_match_whole_files(tmp_path, monkeypatch, chunksize):
+    results = []
+    for size in [10**9, chunksize]:
+        team_dir = tmp_path / str(size)
+        team_dir.mkdir()
+        write_team_files(team_dir, np.random.default_rng(0))
+        monkeypatch.setattr(gather_data, "team_dir", team_dir)
+        monkeypatch.setattr(gather_data, "sales_state_dir", team_dir / "state")
+        update_sales_state(size)
+        files = {
+            x.name: pd.read_csv(x) for x in sorted(team_dir.glob("*_team--*csv.gz"))
+        }
+        results.append((files, load_sales_state()))
+
+    (whole, whole_state), (chunked, chunked_state) = results
+    assert list(whole) == list(chunked)
+    for name in whole:
+        pd.testing.assert_frame_equal(whole[name], chunked[name])
+    pd.testing.assert_series_equal(whole_state[0], chunked_state[0])
+    pd.testing.assert_series_equal(whole_state[1], chunked_state[1])
+    assert whole_state[2] == chunked_state[2] == set(whole)
+    # Every sale's number of earlier sales of its NFT
+    df = pd.concat(whole.values())
+    assert (df.groupby("NFT_ID").cumcount() == df.Resell_Number).all()
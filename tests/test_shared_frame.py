@@ -0,0 +1,45 @@
+"""SharedFrame round trips, with the columns that can be mapped rather than
+copied in each worker."""
+import numpy as np
+import pandas as pd
+
+from store import SharedFrame
+
+
+def test_read_maps_columns_without_copies(tmp_path):
+    n = 1_000
+    df = pd.DataFrame(
+        {
+            "marketplace_id": np.arange(n),
+            "Price": np.random.default_rng(0).random(n),
+            "Pack_Price": np.where(np.arange(n) % 7 == 0, np.nan, 59.0),
+            "Datetime": pd.date_range("2022-01-01", periods=n, freq="h", tz="UTC"),
+            "Moment_Tier": pd.Categorical(["COMMON", "RARE"] * (n // 2)),
+            "Player": [f"P{i % 13}" for i in range(n)],
+            "minted": np.arange(n) % 3 == 0,
+            "game_td": pd.Series([True, False, None, True] * (n // 4), dtype=object),
+        }
+    )
+    frame = SharedFrame(df, tmp_path)
+    shared = frame.read()
+    frame.unlink()
+
+    pd.testing.assert_frame_equal(shared, df)
+    # Views of the mapped file can't be written to, unlike converted columns
+    # (to_numpy is always read-only under copy-on-write)
+    arrays = {
+        "marketplace_id": shared.marketplace_id.array._ndarray,
+        "Price": shared.Price.array._ndarray,
+        "Pack_Price": shared.Pack_Price.array._ndarray,
+        "Datetime": shared.Datetime.array._ndarray,
+        "Moment_Tier": shared.Moment_Tier.array._codes,
+        "minted": shared.minted.array._ndarray,
+    }
+    assert {k: x.flags.writeable for k, x in arrays.items()} == {
+        "marketplace_id": False,
+        "Price": False,
+        "Pack_Price": False,
+        "Datetime": False,
+        "Moment_Tier": False,
+        "minted": True,
+    }
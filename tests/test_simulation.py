@@ -0,0 +1,62 @@
+"""The pack values the app shows, from the cache build or from the simulation
+saved before it, and the note on how their packs were drawn."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+from utils import get_pack_weight_note, load_simulation, summarize_pack_values
+
+# The note of the app before circulation weighting
+unweighted_note = (
+    "the process used here does not capture the rarity of certain moments (such as "
+    "some Rare Moments having lower total numbers than other Rare Moments), however "
+    "it does capture the frequency at which each Moment is traded. More liquid "
+    "Moments (with higher numbers of sales) will be more likely to appear."
+)
+
+
+def test_simulation_saved_before_the_cache_build(monkeypatch):
+    def read_cache(artifact, *args):
+        raise KeyError(f"{artifact} is not in the store")
+
+    monkeypatch.setattr(utils, "read_cache", read_cache)
+    simulation, summary = load_simulation()
+
+    saved = pd.read_csv("data/simulation.csv")
+    assert len(simulation) == len(saved)
+    assert isinstance(simulation["Pack Type"].dtype, pd.CategoricalDtype)
+    info = summary.set_index("Pack Type")
+    for pack_type, x in saved.groupby("Pack Type"):
+        assert info.loc[pack_type, "packs"] == len(x)
+        assert info.loc[pack_type, "mean"] == pytest.approx(x.Price.mean())
+        assert info.loc[pack_type, "median"] == pytest.approx(x.Price.median())
+        above = (x.Price > utils.pack_costs[pack_type]).mean()
+        assert info.loc[pack_type, "above_cost"] == pytest.approx(above)
+    assert (summary.weight == "").all()
+    assert get_pack_weight_note(summary.weight.iloc[0]) == unweighted_note
+
+
+@pytest.mark.parametrize("weight", ["Total_Circulation", "Listings", None])
+def test_simulation_from_the_cache_build(monkeypatch, weight):
+    rng = np.random.default_rng(0)
+    simulation = pd.DataFrame(
+        {
+            "Price": rng.gamma(2, 60, 2_000),
+            "Pack Type": np.repeat(["Standard", "Premium"], 1_000),
+        }
+    )
+    artifacts = {
+        "pack_simulation": simulation,
+        "pack_simulation_summary": summarize_pack_values(simulation, weight),
+    }
+    monkeypatch.setattr(utils, "read_cache", lambda x, *args: artifacts[x])
+    _, summary = load_simulation()
+
+    note = get_pack_weight_note(summary.weight.iloc[0])
+    if weight is None:
+        assert note == unweighted_note
+    elif weight == "Total_Circulation":
+        assert "in proportion to its total circulation" in note
+    else:
+        assert note.startswith("each Moment appears in proportion to its Listings.")
@@ -0,0 +1,208 @@
+"""The array TD columns against the original row-wise lookups, on moments typed
+the way those lookups typed them."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from gather_data import (
+    derive_scored_td_in_game,
+    derive_scored_td_in_moment,
+    get_td_data,
+    load_pbp_td_overrides,
+    scored_td_in_game,
+    scored_td_in_moment,
+    td_play_types,
+)
+
+td_columns = ["game_td", "pbp_td", "scored_td_in_game", "scored_td_in_moment"]
+team_lookup = {"Team A": "AAA", "Team B": "BBB"}
+
+
+def convert_timestr(time):
+    try:
+        m, s = time.split(":")
+    except (AttributeError, ValueError):
+        return None
+
+    min2sec = int(m) * 60 if len(m) > 0 else 0
+    return min2sec + int(s)
+
+
+def scored_td(row, df, data_type, team_lookup=None, overrides=None):
+    """The row-wise lookup get_td_data used to apply to every moment"""
+    if row.Set_Name == "Move the Chains":
+        return False
+    if row.Play_Type not in td_play_types:
+        return False
+    if int(row.Season) < 1999:
+        return None
+
+    szn = row.Season
+    wk = row.Week
+    pt = row.Play_Type
+    player = row.Player
+
+    try:
+        wk = int(wk)
+    except ValueError:
+        if wk == "Divisional":
+            wk = 20
+        elif wk == "Super Bowl LVI":
+            wk = 22
+        else:
+            wk = np.nan
+
+    if data_type == "stats":
+        player_stats = df[
+            (df.season == szn) & (df.player_display_name == player) & (df.week == wk)
+        ]
+        if pt == "Reception":
+            td_type = "receiving_tds"
+        elif pt == "Rush":
+            td_type = "rushing_tds"
+        elif pt == "Pass":
+            td_type = "passing_tds"
+        else:
+            return None
+        try:
+            return (player_stats[td_type] >= 1).values[0]
+        except IndexError:
+            return None
+
+    elif data_type == "pbp":
+        if row.unique_id in overrides:
+            return overrides[row.unique_id]
+        try:
+            home_team = team_lookup[row.Home_Team_Name]
+        except KeyError:
+            return None
+        play = df[
+            (df["home_team"] == home_team)
+            & (df["Season"] == szn)
+            & (df["week"] == wk)
+            & (df["qtr"] == row.Quarter)
+            & (df["quarter_seconds_remaining"] == convert_timestr(row.Time))
+        ]
+        if len(play) == 0:
+            return None
+        return bool(play.iloc[-1].touchdown)
+
+
+def get_td_data_row_wise(df, weekly_df, pbp_df, overrides):
+    df["description_td"] = df.Moment_Description.str.contains(
+        "td | touchdown", regex=True, case=False
+    ) & (df.Set_Name != "Move the Chains")
+    unique_plays = df.groupby("unique_id").first().reset_index()
+    unique_plays["game_td"] = unique_plays.apply(
+        scored_td, axis=1, df=weekly_df, data_type="stats"
+    )
+    unique_plays["pbp_td"] = unique_plays.apply(
+        scored_td,
+        axis=1,
+        df=pbp_df,
+        data_type="pbp",
+        team_lookup=team_lookup,
+        overrides=overrides,
+    )
+    df = df.merge(
+        unique_plays[["unique_id", "game_td", "pbp_td"]], on="unique_id"
+    ).reset_index(drop=True)
+    df["scored_td_in_game"] = df.apply(scored_td_in_game, axis=1)
+    df["scored_td_in_moment"] = df.apply(scored_td_in_moment, axis=1)
+    return df
+
+
+def to_comparable(values):
+    return [None if pd.isna(x) else bool(x) for x in values]
+
+
+@pytest.fixture(scope="module")
+def moments():
+    rng = np.random.default_rng(3)
+    n = 1500
+    overrides = load_pbp_td_overrides()
+    players = ["P1", "P2", "P3", "P4"]
+    df = pd.DataFrame(
+        {
+            "unique_id": [f"u{i}" for i in range(n - 2)] + list(overrides)[:2],
+            "Set_Name": rng.choice(["Base", "Move the Chains"], n, p=[0.9, 0.1]),
+            "Play_Type": rng.choice(
+                ["Pass", "Reception", "Rush", "Strip Sack", "Tackle", "Interception"],
+                n,
+            ),
+            "Season": rng.choice([1998, 2020, 2021, 2022], n),
+            "Week": rng.choice(
+                ["1", "2", "3", "Divisional", "Super Bowl LVI", "Wild Card"], n
+            ),
+            "Player": rng.choice(players, n),
+            "Home_Team_Name": rng.choice(["Team A", "Team B", "Team C"], n),
+            "Quarter": rng.choice([1, 2, 3, 4], n),
+            "Time": rng.choice(["1:05", "0:30", ":45", "12:00", "bad", None], n),
+            "Moment_Description": rng.choice(["a TD run", "nothing"], n),
+        }
+    )
+    df["nfl_player_id"] = df.Player
+    weekly = pd.DataFrame(
+        {
+            "season": rng.choice([2020, 2021, 2022], 200),
+            "player_display_name": rng.choice(players, 200),
+            "week": rng.choice([1, 2, 3, 20, 22], 200),
+            "receiving_tds": rng.integers(0, 2, 200).astype(float),
+            "rushing_tds": rng.integers(0, 2, 200).astype(float),
+            "passing_tds": rng.choice([0, 1, np.nan], 200),
+        }
+    )
+    weekly["player_id"] = weekly.player_display_name
+    pbp = pd.DataFrame(
+        {
+            "home_team": rng.choice(["AAA", "BBB"], 2000),
+            "Season": rng.choice([2020, 2021, 2022], 2000),
+            "week": rng.choice([1, 2, 3, 20, 22], 2000),
+            "qtr": rng.choice([1, 2, 3, 4], 2000),
+            "quarter_seconds_remaining": rng.choice([65, 30, 45, 720, 100], 2000),
+            "touchdown": rng.choice([0.0, 1.0, np.nan], 2000),
+        }
+    )
+    expected = get_td_data_row_wise(df.copy(), weekly, pbp, overrides)
+    actual = get_td_data(df.copy(), weekly, pbp, team_lookup)
+    actual["scored_td_in_game"] = derive_scored_td_in_game(actual)
+    actual["scored_td_in_moment"] = derive_scored_td_in_moment(actual)
+    return (
+        expected.set_index("unique_id").loc[df.unique_id],
+        actual.set_index("unique_id").loc[df.unique_id],
+    )
+
+
+@pytest.mark.parametrize("column", td_columns)
+def test_td_column_matches_row_wise(moments, column):
+    expected, actual = moments
+    assert to_comparable(actual[column]) == to_comparable(expected[column])
+
+
+def test_moment_without_pbp_falls_back_to_description(moments):
+    expected, actual = moments
+    fallback = expected.pbp_td.isna() & expected.game_td.eq(False)
+    fallback &= expected.description_td
+    assert fallback.any()
+    assert actual.loc[fallback, "scored_td_in_moment"].eq(True).all()
+
+
+def test_game_td_keeps_row_wise_types(moments):
+    expected, actual = moments
+    for column in ["game_td", "pbp_td"]:
+        assert [type(x) for x in actual[column].dropna()] == [
+            type(x) for x in expected[column].dropna()
+        ]
+
+
+def test_scored_td_in_moment_on_row_wise_types():
+    df = pd.DataFrame(
+        {
+            "game_td": [np.bool_(False), np.bool_(True), None, False, np.bool_(False)],
+            "pbp_td": [np.nan, np.nan, np.nan, False, True],
+            "description_td": [True, False, True, True, False],
+        }
+    ).astype({"game_td": object, "pbp_td": object})
+    expected = df.apply(scored_td_in_moment, axis=1)
+    assert to_comparable(derive_scored_td_in_moment(df)) == to_comparable(expected)
+    assert to_comparable(expected) == [True, False, True, False, True]
@@ -0,0 +1,104 @@
+"""Score t-tests through the ttests table of the cache store, as cache.py
+writes them and the app reads them, and the legacy results without it."""
+import json
+import sqlite3
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import store
+import utils
+from utils import get_ttest_values, get_ttests, load_ttest
+
+# (metric, short_form, position_type, pos_column, agg_column), as in score_job
+tests = [
+    ("Best Guess (Moment TD)", "TDs", "By Position", "Position", "Price"),
+    ("won_game", "Winners", "By Position Group", "Position Group", "tx_id"),
+    (
+        ["Best Guess (Moment TD)", "Description only (Moment TD)"],
+        "Best Guess Moment",
+        "By Position",
+        "Position",
+        "Price",
+    ),
+]
+positions = {
+    "Position": ["All", "QB", "RB", "WR", "K"],
+    "Position Group": ["All", "Offense", "Defense"],
+}
+
+
+@pytest.fixture
+def score_frame():
+    rng = np.random.default_rng(5)
+    n = 2_000
+    df = pd.DataFrame(
+        {
+            "Position": rng.choice(["QB", "RB", "WR"], n),
+            "Position Group": rng.choice(["Offense", "Defense"], n),
+            "Price": rng.gamma(2, 50, n),
+            "tx_id": rng.integers(1, 30, n),
+        }
+    )
+    for x in ["Best Guess (Moment TD)", "Description only (Moment TD)", "won_game"]:
+        df[x] = pd.Series(rng.choice([True, False, None], n), dtype=object)
+    df["Price"] += (df["Best Guess (Moment TD)"] == True) * 30
+    # Stored as NULL means
+    df.loc[df.Position == "RB", "Price"] = np.nan
+    return df
+
+
+@pytest.mark.filterwarnings("ignore")
+def test_results_read_back_from_the_store(tmp_path, monkeypatch, score_frame):
+    rows = []
+    for metric, short_form, position_type, pos_column, agg_column in tests:
+        values = get_ttest_values(
+            score_frame,
+            [(metric, positions[pos_column], short_form, pos_column, agg_column)],
+        )[0]
+        key = ["All Time", "All", "scored_td_in_moment", "Average", position_type]
+        key += [json.dumps(metric), short_form]
+        rows += [(*key, agg_column, i, *x) for i, x in enumerate(values)]
+    db = tmp_path / "cache.sqlite"
+    store.write_ttests(rows, path=db)
+    monkeypatch.setattr(utils, "read_ttests", partial(store.read_ttests, path=db))
+
+    results = []
+    for metric, short_form, position_type, pos_column, agg_column in tests:
+        expected = get_ttests(
+            score_frame,
+            metric,
+            positions[pos_column],
+            short_form,
+            pos_column,
+            agg_column,
+        )
+        key = ["All Time", "All", "scored_td_in_moment", "Average", position_type]
+        assert load_ttest(*key, metric, short_form) == expected
+        results += expected
+    assert any("HIGHER" in x[2] for x in results)
+    assert any(x[1] == "" for x in results)
+
+
+def test_legacy_results_without_the_table(tmp_path, monkeypatch):
+    # A store built before the ttests table, like the one in data/cache
+    db = tmp_path / "cache.sqlite"
+    with sqlite3.connect(db) as con:
+        con.execute("CREATE TABLE artifacts (name TEXT)")
+    monkeypatch.setattr(utils, "read_ttests", partial(store.read_ttests, path=db))
+
+    legacy = utils.load_legacy_ttests()
+    assert load_ttest(
+        "All Time",
+        "All",
+        "Best Guess (Moment TD)",
+        "Average Sales Price ($)",
+        "By Position",
+        "Best Guess (Moment TD)",
+        "TDs",
+    ) == legacy[
+        "All_Time--All--Best_Guess_Moment_TD--Average_Sales_Price_$--By_Position"
+        "--Best_Guess_Moment_TD--TDs"
+    ]
@@ -0,0 +1,154 @@
+"""The batched t-tests against the original per-position get_ttests, on score
+frames with missing prices, missing flags and empty groups."""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import ttest_ind
+
+from utils import get_ttests, get_ttests_batch
+
+
+def get_ttests_per_position(
+    df,
+    metric,
+    positions,
+    short_form,
+    pos_column="Position",
+    agg_column="Price",
+):
+    """get_ttests as it was, one ttest_ind per position"""
+    ntests = 1000  # approximate, for play types * positions * metrics * dates
+    alpha = 0.05 / ntests  # Bonferroni correction for number tests
+    vals = []
+    for x in positions:
+        if x == "All":
+            pos_data = df
+        else:
+            pos_data = df[df[pos_column] == x]
+
+        if type(metric) == str:
+            pos_metric = pos_data[pos_data[metric] == True]
+            pos_no_metric = pos_data[pos_data[metric] == False]
+        else:
+            pos_metric = pos_data[pos_data[metric[0]] == True]
+            pos_no_metric = pos_data[pos_data[metric[1]] == False]
+
+        pos_metric_agg = pos_metric[agg_column].values
+        pos_no_metric_agg = pos_no_metric[agg_column].values
+
+        pval = ttest_ind(pos_metric_agg, pos_no_metric_agg, equal_var=False).pvalue
+        metric_mean = pos_metric_agg.mean()
+        no_metric_mean = pos_no_metric_agg.mean()
+
+        comp = (
+            f"${metric_mean:,.2f} vs ${no_metric_mean:,.2f}"
+            if agg_column == "Price"
+            else f"{metric_mean:,.2f} vs {no_metric_mean:,.2f}"
+        )
+
+        if pd.isna(pval):
+            sig = ""
+            if pd.isna(metric_mean) and pd.isna(no_metric_mean):
+                comp = ""
+            elif pd.isna(metric_mean):
+                comp = (
+                    f"No {short_form}: ${no_metric_mean:,.2f}"
+                    if agg_column == "Price"
+                    else f"No {short_form}: {no_metric_mean:,.2f}"
+                )
+            elif pd.isna(no_metric_mean):
+                comp = (
+                    f"{short_form}: ${metric_mean:,.2f}"
+                    if agg_column == "Price"
+                    else f"{short_form}: {metric_mean:,.2f}"
+                )
+        elif pval < alpha:
+            if metric_mean > no_metric_mean:
+                sig = f"+ {short_form} HIGHER 📈"
+            else:
+                sig = f"- {short_form} LOWER 📉"
+        else:
+            # sig = "- No Significant Difference"
+            sig = ""
+
+        if type(metric) != str:
+            if len(pos_no_metric) == 0:
+                percentage = f"(No {short_form})"
+            else:
+                percentage = f"({len(pos_metric)/len(pos_no_metric):,.2f} BG: Desc)"
+        else:
+            if len(pos_data) == 0:
+                percentage = f"(No {short_form})"
+            else:
+                percentage = f"({len(pos_metric)/len(pos_data):.2%} {short_form})"
+
+        label = f"Position: {x} {percentage}"
+        vals.append((label, comp, sig))
+
+    return vals
+
+
+positions = ["All", "QB", "RB", "WR", "TE", "K"]
+flags = ["Scored TD", "Won", "Game TD", "Desc TD"]
+
+
+def get_score_frame(seed, n):
+    """Grouped score rows as cache.py builds them, "All" rows included, with
+    flags that can be None, prices that can be NaN and positions that can be
+    missing or hold a single row."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "Position": rng.choice(["QB", "RB", "WR", "TE", "All"], n),
+            "Position Group": rng.choice(["Offense", "Defense"], n),
+            "Price": rng.gamma(2, 50, n),
+            "tx_id": rng.integers(1, 40, n).astype(float),
+        }
+    )
+    for i, x in enumerate(flags):
+        values = rng.choice([True, False, None], n, p=[0.4, 0.5, 0.1])
+        df[x] = pd.Series(values, dtype=object)
+        df["Price"] += (df[x] == True) * rng.choice([0, 5, 60]) * (i + 1)
+    # Constant values, where Welch's variance is zero
+    df.loc[df.Position == "TE", "tx_id"] = 3.0
+    if seed % 2:
+        # Missing prices (NaN means, as NumPy gives them), a position with a
+        # single row, and one without any True flag
+        df.loc[(df.Position == "QB") & (rng.random(n) < 0.05), "Price"] = np.nan
+        df.loc[df.index[df.Position == "TE"][1:], "Position"] = "WR"
+        df.loc[df.Position == "RB", "Won"] = False
+    return df
+
+
+tests = [
+    ("Scored TD", positions, "TD", "Position", "Price"),
+    ("Won", positions, "W", "Position", "Price"),
+    (["Game TD", "Desc TD"], positions, "BG", "Position", "Price"),
+    ("Desc TD", ["All", "Offense", "Defense", "ST"], "D", "Position Group", "Price"),
+    ("Scored TD", positions, "TD", "Position", "tx_id"),
+    (["Desc TD", "Won"], ["All", "Offense"], "X", "Position Group", "tx_id"),
+]
+
+
+@pytest.mark.filterwarnings("ignore")
+@pytest.mark.parametrize("seed, n", [(0, 60), (1, 300), (2, 4_000), (3, 4_000)])
+def test_batch_matches_per_position(seed, n):
+    df = get_score_frame(seed, n)
+    expected = [get_ttests_per_position(df, *x) for x in tests]
+    assert get_ttests_batch(df, tests) == expected
+    assert [get_ttests(df, *x) for x in tests] == expected
+    if n > 1_000:
+        results = [y for x in expected for y in x]
+        assert any("HIGHER" in x[2] for x in results)
+        nan_qb = any(x[0].startswith("Position: QB") and x[1] == "" for x in results)
+        assert nan_qb == bool(seed % 2)
+
+
+@pytest.mark.filterwarnings("ignore")
+def test_prices_without_clean_rows():
+    df = get_score_frame(4, 200)
+    df.loc[df.Position == "QB", "Price"] = np.nan
+    df.loc[df.Position == "RB", "Scored TD"] = None
+    df = df[df.Position != "TE"]
+    expected = [get_ttests_per_position(df, *x) for x in tests]
+    assert get_ttests_batch(df, tests) == expected
@@ -1,4 +1,6 @@
 import json
+import re
+import time
 from urllib.request import urlopen
 
 import altair as alt
@@ -6,8 +8,21 @@ import numpy as np
 import pandas as pd
 import streamlit as st
 from PIL import Image, ImageDraw
+from scipy.special import stdtr
 from scipy.stats import ttest_ind, ttest_rel
 
+from store import (
+    allday_path,
+    categorical_cols,
+    pack_path,
+    player_pack_path,
+    legacy_ttest_file,
+    read_cache,
+    read_categories,
+    read_table,
+    read_ttests,
+)
+
 __all__ = [
     "n_players",
     "load_allday_data",
@@ -17,6 +32,10 @@ __all__ = [
     "alt_mean_price",
     "get_metrics",
     "get_position_group",
+    "get_date_bounds",
+    "DateIndex",
+    "set_categories",
+    "compare_categories",
     "cols_to_keep",
     "score_columns",
     "td_mapping",
@@ -32,6 +51,8 @@ __all__ = [
     "main_date_ranges",
     "play_v_player_date_ranges",
     "get_ttests",
+    "get_ttests_batch",
+    "get_ttest_values",
     "stats_date_ranges",
     "load_score_data",
     "load_ttest",
@@ -40,7 +61,6 @@ __all__ = [
     "load_play_v_player_data",
     "load_headshot",
     "load_challenge_data",
-    "player_mapping",
     "week_timings",
     "game_timings",
     "load_challenge_player_data",
@@ -57,7 +77,17 @@ __all__ = [
     "load_pack_cache",
     "series2_mint1_standard_proportions",
     "series2_mint1_premium_proportions",
-    "get_pack_value",
+    "pack_contents",
+    "pack_costs",
+    "n_sample_packs",
+    "get_alias_table",
+    "alias_sample",
+    "get_pack_pool",
+    "simulate_packs",
+    "get_pack_values",
+    "get_pack_rows",
+    "summarize_pack_values",
+    "get_pack_weight_note",
     "mint_pack",
     "load_series2_mint1_grouped",
     "load_pack_samples",
@@ -135,34 +165,35 @@ team_pos = ["Team"]
 pos_groups = ["All", "Offense", "Defense", "Team"]
 positions = all_pos + offense + defense + team_pos
 rarities = ["COMMON", "RARE", "LEGENDARY", "ULTIMATE"]
+pack_types = ["Standard", "Premium"]
+
+# Leading categories of the categorical columns, in display order; see
+# set_categories
+fixed_categories = {
+    "Position": positions,
+    "Moment_Tier": rarities,
+    "Play_Type": score_columns,
+    "Pack Type": pack_types,
+}
 
-# #TODO: clean up date ranges
-main_date_ranges = [
-    "All Time",
-    "2022 Full Season",
-    "2022 Week 1",
-    "2022 Week 2",
-    "2022 Week 3",
-    "2022 Week 4",
-    "2022 Week 5",
-]
-play_v_player_date_ranges = [
-    "All dates",
-    "Since 2022 preseason",
-    "Since 2022 Week 1",
-    "Since 2022 Week 2",
-    "Since 2022 Week 3",
-    "Since 2022 Week 4",
-    "Since 2022 Week 5",
+week_timings = {
+    1: ("2022-09-08", "2022-09-15"),
+    2: ("2022-09-15", "2022-09-22"),
+    3: ("2022-09-22", "2022-09-29"),
+    4: ("2022-09-29", "2022-10-06"),
+    5: ("2022-10-06", "2022-10-13"),
+}
+
+preseason_start = "2022-08-04"
+
+# Named date ranges, see get_date_bounds
+main_date_ranges = ["All Time", "2022 Full Season"] + [
+    f"2022 Week {x}" for x in week_timings
 ]
-stats_date_ranges = [
-    "2022 Full Season",
-    "2022 Week 1",
-    "2022 Week 2",
-    "2022 Week 3",
-    "2022 Week 4",
-    "2022 Week 5",
+play_v_player_date_ranges = ["All dates", "Since 2022 preseason"] + [
+    f"Since 2022 Week {x}" for x in week_timings
 ]
+stats_date_ranges = ["2022 Full Season"] + [f"2022 Week {x}" for x in week_timings]
 
 position_type_dict = {
     "By Position": ("Position", positions),
@@ -215,19 +246,6 @@ stats_subset = [
     "rushing_yards",
 ]
 
-player_mapping = {
-    "Patrick Mahomes": "Patrick Mahomes II",
-    "Gabe Davis	": "Gabriel Davis",
-}
-
-week_timings = {
-    1: ("2022-09-08", "2022-09-15"),
-    2: ("2022-09-15", "2022-09-22"),
-    3: ("2022-09-22", "2022-09-29"),
-    4: ("2022-09-29", "2022-10-06"),
-    5: ("2022-10-06", "2022-10-13"),
-}
-
 game_timings = {
     1: {
         "thursday": (
@@ -385,6 +403,7 @@ player_pack_cols = [
     "Home_Team_Name",
     "Home_Team_Score",
     "Player_ID",
+    "nfl_player_id",
     "Player_Number",
     "Classification",
     "Total_Circulation",
@@ -413,20 +432,121 @@ series2_mint1_premium_proportions = {
     "RARE": 3480 / 3800,
     "LEGENDARY": 320 / 3800,
 }
+# Moments of each tier in a pack, by pack type and pack tier
+pack_contents = {
+    ("Standard", "COMMON"): {"COMMON": 4},
+    ("Standard", "RARE"): {"COMMON": 3, "RARE": 1},
+    ("Standard", "LEGENDARY"): {"COMMON": 3, "LEGENDARY": 1},
+    ("Premium", "RARE"): {"COMMON": 6, "RARE": 2},
+    ("Premium", "LEGENDARY"): {"COMMON": 6, "RARE": 1, "LEGENDARY": 1},
+}
+pack_costs = {"Standard": 59, "Premium": 219}
+# Packs of each type kept moment by moment for mint_pack
+n_sample_packs = {"Standard": 10000, "Premium": 5000}
 n_players = 40
 
 
-@st.cache(ttl=3600 * 24, allow_output_mutation=True)
-def load_allday_data(cols=None):
-    if cols is not None:
-        df = pd.read_csv("data/current_allday_data.csv.gz", usecols=cols)
-    else:
-        df = pd.read_csv("data/current_allday_data.csv.gz")
-    datecols = ["Datetime", "Date"]
-    df[datecols] = df[datecols].apply(pd.to_datetime)
+def get_date_bounds(date_range):
+    """`(start, end, closed)` of a date range from `main_date_ranges`,
+    `play_v_player_date_ranges` or `stats_date_ranges`, or of a `(start, end)`
+    drop window from `pack_date_ranges`. `end` is None for open ranges, and
+    only included if `closed`. Any other name means all dates."""
+    if isinstance(date_range, tuple):
+        return date_range[0], date_range[1], True
+    match = re.fullmatch(
+        r"(Since )?2022 (Week (\d+)|Full Season|preseason)", date_range
+    )
+    if match is None:
+        return None, None, False
+    since, period, week = match.groups()
+    if period == "preseason":
+        return preseason_start, None, False
+    if period == "Full Season":
+        return week_timings[1][0], None, False
+    start, end = week_timings[int(week)]
+    return start, None if since else end, False
+
+
+class DateIndex:
+    """A frame sorted once by a date column, sliced by date range (see
+    `get_date_bounds`) with binary search rather than a mask over the column.
+    Slices are views of the sorted frame."""
+
+    def __init__(self, df, col="Date"):
+        if not df[col].is_monotonic_increasing:
+            df = df.sort_values(by=col, kind="stable")
+        self.df = df
+        self.col = col
+        # Missing dates sort last and only belong to "all dates"
+        self.n_dated = df[col].notna().sum()
+
+    def searchsorted(self, date, side):
+        date = pd.Timestamp(date)
+        tz = self.df[self.col].dt.tz
+        if tz is not None:
+            date = date.tz_localize(tz) if date.tz is None else date.tz_convert(tz)
+        return self.df[self.col].iloc[: self.n_dated].searchsorted(date, side=side)
+
+    def __getitem__(self, date_range):
+        start, end, closed = get_date_bounds(date_range)
+        if start is None and end is None:
+            return self.df
+        i = 0 if start is None else self.searchsorted(start, "left")
+        j = (
+            self.n_dated
+            if end is None
+            else self.searchsorted(end, "right" if closed else "left")
+        )
+        return self.df.iloc[i:j]
+
+
+def set_categories(df):
+    """Make the `categorical_cols` of `df` categoricals with project-wide
+    categories, so frames from different loaders share dtypes: the
+    `fixed_categories` first, then the values saved by gather_data.py, then
+    any others, sorted."""
+    saved = read_categories()
+    for x in categorical_cols:
+        if x not in df.columns:
+            continue
+        categories = fixed_categories.get(x, []) + saved.get(x, [])
+        categories = list(dict.fromkeys(categories))
+        if isinstance(df[x].dtype, pd.CategoricalDtype):
+            values = df[x].cat.categories
+        else:
+            values = df[x].dropna().unique()
+        categories += sorted(set(values) - set(categories), key=str)
+        if isinstance(df[x].dtype, pd.CategoricalDtype):
+            df[x] = df[x].cat.set_categories(categories)
+        else:
+            df[x] = pd.Categorical(df[x], categories=categories)
     return df
 
 
+def compare_categories(df, by, value="Price"):
+    """Print the memory used by the categorical columns of `df`, and the time
+    to group `value` by `by`, as categoricals vs. plain strings."""
+    cols = [x for x in categorical_cols if x in df.columns]
+    as_object = df[cols + [value]].astype({x: object for x in cols})
+    memory = [as_object[cols].memory_usage(deep=True).sum()]
+    memory.append(df[cols].memory_usage(deep=True).sum())
+    seconds = []
+    for x in [as_object, df]:
+        start = time.perf_counter()
+        x.groupby(by, observed=True)[value].agg(["mean", "count"])
+        seconds.append(time.perf_counter() - start)
+    print(
+        f"#@# categoricals: {memory[0] / 2**20:,.1f} MB -> "
+        f"{memory[1] / 2**20:,.1f} MB, groupby {by}: {seconds[0]:.3f}s -> "
+        f"{seconds[1]:.3f}s ({seconds[0] / seconds[1]:.1f}x)"
+    )
+
+
+@st.cache(ttl=3600 * 24, allow_output_mutation=True)
+def load_allday_data(cols=None, filters=None):
+    return set_categories(read_table(allday_path, columns=cols, filters=filters))
+
+
 @st.cache(ttl=3600 * 24, allow_output_mutation=True)
 def load_stats_data(years=None, subset=False):
     # NOTE: now returning less data
@@ -639,95 +759,235 @@ def get_metrics(
             )
 
 
-def get_ttests(
-    df,
+# Bonferroni correction for approximately play types * positions * metrics * dates
+ttest_alpha = 0.05 / 1000
+
+
+def welch_ttest(n1, mean1, var1, n2, mean2, var2):
+    """Two-sided p-values of Welch's t-test from group sizes, means and
+    variances, as `ttest_ind(a, b, equal_var=False)` returns them."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vn1 = var1 / n1
+        vn2 = var2 / n2
+        dof = (vn1 + vn2) ** 2 / (vn1**2 / (n1 - 1) + vn2**2 / (n2 - 1))
+        # Undefined when both variances are zero, where any dof gives the same p
+        dof = np.where(np.isnan(dof), 1, dof)
+        t = (mean1 - mean2) / np.sqrt(vn1 + vn2)
+    return 2 * stdtr(dof, -np.abs(t))
+
+
+def get_ttest_groups(df, pos_column):
+    """Codes of the `pos_column` values for `get_ttest_stats`, the code of each
+    value and the number of rows with it. "All" is the whole frame rather than
+    the rows labelled "All", under the last code."""
+    codes, uniques = pd.factorize(df[pos_column].astype(object))
+    groups = {x: i for i, x in enumerate(uniques)}
+    if "All" in groups:
+        codes[codes == groups["All"]] = -1
+    groups["All"] = len(uniques)
+    rows = np.bincount(codes[codes >= 0], minlength=len(uniques) + 1)
+    rows[-1] = len(df)
+    return codes, groups, rows
+
+
+def get_ttest_stats(df, codes, ngroups, column, agg_column):
+    """Rows, mean and variance of `agg_column` by the `ngroups` group `codes` of
+    `get_ttest_groups` and by whether `column` is False (first row) or True
+    (second row). Like NumPy, the mean and variance are NaN if any value is."""
+    side = np.select([df[column] == True, df[column] == False], [1, 0], -1)
+    values = df[agg_column].to_numpy(dtype="float64")
+
+    # Each row counts towards its own group and towards "All", the last one
+    by_group = (side >= 0) & (codes >= 0)
+    keys = np.concatenate(
+        [
+            side[by_group] * ngroups + codes[by_group],
+            side[side >= 0] * ngroups + ngroups - 1,
+        ]
+    )
+    values = np.concatenate([values[by_group], values[side >= 0]])
+    size = np.bincount(keys, minlength=2 * ngroups)
+    has_nan = np.bincount(keys, np.isnan(values), minlength=2 * ngroups) > 0
+    values = np.nan_to_num(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.bincount(keys, values, minlength=2 * ngroups) / size
+        squares = np.bincount(keys, (values - mean[keys]) ** 2, minlength=2 * ngroups)
+        var = np.where(size > 1, squares / (size - 1), np.nan)
+    mean[has_nan] = np.nan
+    var[has_nan] = np.nan
+    return (
+        size.reshape(2, ngroups),
+        mean.reshape(2, ngroups),
+        var.reshape(2, ngroups),
+    )
+
+
+def format_ttest(
+    x,
     metric,
-    positions,
     short_form,
-    pos_column="Position",
-    agg_column="Price",
+    agg_column,
+    n_metric,
+    n_no_metric,
+    n_pos,
+    metric_mean,
+    no_metric_mean,
+    pval,
 ):
-    ntests = 1000  # approximate, for play types * positions * metrics * dates
-    alpha = 0.05 / ntests  # Bonferroni correction for number tests
-    vals = []
-    for x in positions:
-        if x == "All":
-            pos_data = df
-        else:
-            pos_data = df[df[pos_column] == x]
+    """`(label, comparison, significance)` strings for one position of a
+    t-test, as the app shows them."""
+    comp = (
+        f"${metric_mean:,.2f} vs ${no_metric_mean:,.2f}"
+        if agg_column == "Price"
+        else f"{metric_mean:,.2f} vs {no_metric_mean:,.2f}"
+    )
 
-        if type(metric) == str:
-            pos_metric = pos_data[pos_data[metric] == True]
-            pos_no_metric = pos_data[pos_data[metric] == False]
+    if pd.isna(pval):
+        sig = ""
+        if pd.isna(metric_mean) and pd.isna(no_metric_mean):
+            comp = ""
+        elif pd.isna(metric_mean):
+            comp = (
+                f"No {short_form}: ${no_metric_mean:,.2f}"
+                if agg_column == "Price"
+                else f"No {short_form}: {no_metric_mean:,.2f}"
+            )
+        elif pd.isna(no_metric_mean):
+            comp = (
+                f"{short_form}: ${metric_mean:,.2f}"
+                if agg_column == "Price"
+                else f"{short_form}: {metric_mean:,.2f}"
+            )
+    elif pval < ttest_alpha:
+        if metric_mean > no_metric_mean:
+            sig = f"+ {short_form} HIGHER 📈"
         else:
-            pos_metric = pos_data[pos_data[metric[0]] == True]
-            pos_no_metric = pos_data[pos_data[metric[1]] == False]
+            sig = f"- {short_form} LOWER 📉"
+    else:
+        # sig = "- No Significant Difference"
+        sig = ""
 
-        pos_metric_agg = pos_metric[agg_column].values
-        pos_no_metric_agg = pos_no_metric[agg_column].values
+    if type(metric) != str:
+        if n_no_metric == 0:
+            percentage = f"(No {short_form})"
+        else:
+            percentage = f"({n_metric/n_no_metric:,.2f} BG: Desc)"
+    else:
+        if n_pos == 0:
+            percentage = f"(No {short_form})"
+        else:
+            percentage = f"({n_metric/n_pos:.2%} {short_form})"
+
+    label = f"Position: {x} {percentage}"
+    return (label, comp, sig)
+
+
+def get_ttest_values(df, tests):
+    """The numbers behind `get_ttests_batch`: for each test, a
+    `(position, n_metric, n_no_metric, n_pos, metric_mean, no_metric_mean,
+    pvalue)` tuple per position, to format with `format_ttest`.
+
+    The group statistics take one pass over the rows per position column and
+    metric column, and the p-values of all tests one vectorized Welch's t-test.
+    """
+    groups = {}
+    stats = {}
+    cells = []
+    for metric, positions, short_form, pos_column, agg_column in tests:
+        if pos_column not in groups:
+            groups[pos_column] = get_ttest_groups(df, pos_column)
+        codes, group_index, rows = groups[pos_column]
+        # A list metric compares its first column True to its second False
+        columns = [metric, metric] if type(metric) == str else metric
+        for x in columns:
+            if (pos_column, x, agg_column) not in stats:
+                stats[pos_column, x, agg_column] = get_ttest_stats(
+                    df, codes, len(rows), x, agg_column
+                )
+        # Positions missing from df index an empty group past the last one
+        index = np.array([group_index.get(x, len(rows)) for x in positions])
+        metric_stats = [
+            np.append(x[1], 0 if i == 0 else np.nan)[index]
+            for i, x in enumerate(stats[pos_column, columns[0], agg_column])
+        ]
+        no_metric_stats = [
+            np.append(x[0], 0 if i == 0 else np.nan)[index]
+            for i, x in enumerate(stats[pos_column, columns[1], agg_column])
+        ]
+        cells.append((metric_stats, no_metric_stats, np.append(rows, 0)[index]))
 
-        pval = ttest_ind(pos_metric_agg, pos_no_metric_agg, equal_var=False).pvalue
-        metric_mean = pos_metric_agg.mean()
-        no_metric_mean = pos_no_metric_agg.mean()
+    pvals = welch_ttest(
+        *np.concatenate([x[0] for x in cells], axis=1),
+        *np.concatenate([x[1] for x in cells], axis=1),
+    )
 
-        comp = (
-            f"${metric_mean:,.2f} vs ${no_metric_mean:,.2f}"
-            if agg_column == "Price"
-            else f"{metric_mean:,.2f} vs {no_metric_mean:,.2f}"
+    results = []
+    i = 0
+    for (_, positions, *_), cell in zip(tests, cells):
+        (n_metric, metric_mean, _), (n_no_metric, no_metric_mean, _), n_pos = cell
+        results.append(
+            [
+                (
+                    x,
+                    int(n_metric[j]),
+                    int(n_no_metric[j]),
+                    int(n_pos[j]),
+                    float(metric_mean[j]),
+                    float(no_metric_mean[j]),
+                    float(pvals[i + j]),
+                )
+                for j, x in enumerate(positions)
+            ]
         )
+        i += len(positions)
+    return results
 
-        if pd.isna(pval):
-            sig = ""
-            if pd.isna(metric_mean) and pd.isna(no_metric_mean):
-                comp = ""
-            elif pd.isna(metric_mean):
-                comp = (
-                    f"No {short_form}: ${no_metric_mean:,.2f}"
-                    if agg_column == "Price"
-                    else f"No {short_form}: {no_metric_mean:,.2f}"
-                )
-            elif pd.isna(no_metric_mean):
-                comp = (
-                    f"{short_form}: ${metric_mean:,.2f}"
-                    if agg_column == "Price"
-                    else f"{short_form}: {metric_mean:,.2f}"
-                )
-        elif pval < alpha:
-            if metric_mean > no_metric_mean:
-                sig = f"+ {short_form} HIGHER 📈"
-            else:
-                sig = f"- {short_form} LOWER 📉"
-        else:
-            # sig = "- No Significant Difference"
-            sig = ""
 
-        if type(metric) != str:
-            if len(pos_no_metric) == 0:
-                percentage = f"(No {short_form})"
-            else:
-                percentage = f"({len(pos_metric)/len(pos_no_metric):,.2f} BG: Desc)"
-        else:
-            if len(pos_data) == 0:
-                percentage = f"(No {short_form})"
-            else:
-                percentage = f"({len(pos_metric)/len(pos_data):.2%} {short_form})"
+def get_ttests_batch(df, tests):
+    """`get_ttests` for a list of `(metric, positions, short_form, pos_column,
+    agg_column)` tests on the same `df`."""
+    results = []
+    for (metric, _, short_form, _, agg_column), values in zip(
+        tests, get_ttest_values(df, tests)
+    ):
+        results.append(
+            [
+                format_ttest(x, metric, short_form, agg_column, *rest)
+                for x, *rest in values
+            ]
+        )
+    return results
 
-        label = f"Position: {x} {percentage}"
-        vals.append((label, comp, sig))
 
-    return vals
+def get_ttests(
+    df,
+    metric,
+    positions,
+    short_form,
+    pos_column="Position",
+    agg_column="Price",
+):
+    return get_ttests_batch(
+        df, [(metric, positions, short_form, pos_column, agg_column)]
+    )[0]
 
 
 @st.cache(ttl=3600 * 24)
 def load_score_data(date_range, how_scores, play_type):
     date_str = date_range.replace(" ", "_")
-    df = pd.read_csv(f"data/cache/{date_str}--grouped.csv")
+    df = set_categories(read_cache("score", date_str))
     df["Scored Touchdown?"] = df[how_scores]
     if play_type != "All":
         df = df[df.Play_Type == play_type]
     return df
 
 
+@st.cache(ttl=3600 * 24, allow_output_mutation=True)
+def load_legacy_ttests():
+    with open(legacy_ttest_file) as f:
+        return json.load(f)
+
+
 @st.cache(ttl=3600 * 24)
 def load_ttest(
     date_range,
@@ -738,45 +998,52 @@ def load_ttest(
     metric,
     short_form,
 ):
-    with open("data/cache/score_ttest_results.json") as f:
-        data = json.load(f)
-    key = (
-        f"{date_range}--{play_type}--{how_scores}--{agg_metric}--{position_type}--{metric}--{short_form}".replace(
-            " ", "_"
-        )
-        .replace(")", "")
-        .replace("(", "")
+    rows = read_ttests(
+        [
+            date_range,
+            play_type,
+            how_scores,
+            agg_metric,
+            position_type,
+            json.dumps(metric),
+            short_form,
+        ]
     )
-    return data[key]
+    if rows is None:
+        key = (
+            f"{date_range}--{play_type}--{how_scores}--{agg_metric}--{position_type}--{metric}--{short_form}".replace(
+                " ", "_"
+            )
+            .replace(")", "")
+            .replace("(", "")
+        )
+        return load_legacy_ttests()[key]
+    # Formatted here, so the store keeps the numbers
+    return [
+        format_ttest(x, metric, short_form, agg_column, *rest)
+        for agg_column, x, *rest in rows
+    ]
 
 
 @st.cache(ttl=3600 * 24)
 def load_player_data(date_range, agg_metric):
     date_str = date_range.replace(" ", "_")
-    df = pd.read_csv(f"data/cache/player-{date_str}-{agg_metric}--grouped.csv")
-    return df
+    df = read_cache("player", date_str, agg_metric)
+    return set_categories(df)
 
 
 @st.cache(ttl=3600 * 24)
 def load_play_v_player_data(date_range):
     date_str = date_range.replace(" ", "_")
-    play_type_price_data = pd.read_csv(
-        f"data/cache/play_v_player-play_type-{date_str}--grouped.csv"
-    )
-    play_type_tier_price_data = pd.read_csv(
-        f"data/cache/play_v_player-play_type_tier-{date_str}--grouped.csv"
-    )
-    player_tier_price_data = pd.read_csv(
-        f"data/cache/play_v_player-player_tier-{date_str}--grouped.csv"
-    )
-    topN_player_data = pd.read_csv(
-        f"data/cache/play_v_player-topN_player-{date_str}--grouped.csv"
-    )
+    play_type_price_data = read_cache("play_v_player_play_type", date_str)
+    play_type_tier_price_data = read_cache("play_v_player_play_type_tier", date_str)
+    player_tier_price_data = read_cache("play_v_player_player_tier", date_str)
+    topN_player_data = read_cache("play_v_player_topN_player", date_str)
     return (
-        play_type_price_data,
-        play_type_tier_price_data,
-        player_tier_price_data,
-        topN_player_data,
+        set_categories(play_type_price_data),
+        set_categories(play_type_tier_price_data),
+        set_categories(player_tier_price_data),
+        set_categories(topN_player_data),
     )
 
 
@@ -1123,13 +1390,9 @@ def load_pack_info(summary=True):
 
 @st.experimental_memo(ttl=3600 * 24, suppress_st_warning=True)
 def load_pack():
-    pack_df = pd.read_csv("data/pack_combined.csv.gz")
-    pack_df["Datetime_Reveal"] = pd.to_datetime(
-        pack_df["Datetime_Reveal"]
-    ).dt.tz_localize("US/Eastern")
-    pack_df["Datetime_Pack"] = pd.to_datetime(pack_df["Datetime_Pack"]).dt.tz_localize(
-        "US/Eastern"
-    )
+    pack_df = set_categories(read_table(pack_path))
+    for x in ["Datetime_Reveal", "Datetime_Pack"]:
+        pack_df[x] = pack_df[x].dt.tz_localize("US/Eastern")
 
     pack_df["Reveal_Lag"] = pack_df["Datetime_Reveal"] - pack_df["Datetime_Pack"]
     # pack_df["Reveal_Lag_Seconds"] = (
@@ -1140,7 +1403,8 @@ def load_pack():
             [
                 pd.Grouper(key="Datetime_Pack", axis=0, freq="min"),
                 "Pack Type",
-            ]
+            ],
+            observed=True,
         )
         .agg(
             Sales_Count=("tx_id_Pack", "nunique"),
@@ -1245,9 +1509,7 @@ def alt_pack_sales(df):
 
 @st.experimental_memo(ttl=3600 * 24, suppress_st_warning=True)
 def load_player_pack():
-    df = pd.read_csv(
-        "data/current_allday_data_pack.csv.gz", usecols=player_pack_cols
-    ).dropna(
+    df = read_table(player_pack_path, columns=player_pack_cols).dropna(
         subset=[
             "Player",
             "Datetime_Reveal",
@@ -1260,11 +1522,11 @@ def load_player_pack():
         "Datetime_Reveal",
         "Datetime_Pack",
     ]:
-        df[x] = pd.to_datetime(df[x]).dt.tz_localize("US/Eastern")
+        df[x] = df[x].dt.tz_localize("US/Eastern")
     df["Mint_Date"] = pd.to_datetime(df.Datetime_Pack.dt.date).dt.tz_localize(
         "US/Eastern"
     )
-    return df
+    return set_categories(df)
 
 
 @st.experimental_memo(ttl=3600 * 24, suppress_st_warning=True)
@@ -1273,60 +1535,182 @@ def load_pack_cache(date_range):
         date_str = date_range.replace(" ", "_")
     else:
         date_str = date_range[0].split(" ")[0]
-    df = pd.read_csv(f"data/cache/pack_data-{date_str}--grouped.csv.gz")
-    return df
+    df = read_cache("pack_data", date_str)
+    return set_categories(df)
+
+
+def get_alias_table(weights):
+    """Walker alias table of `weights`, for `alias_sample`.
+
+    Built once, it lets every draw take one uniform slot and one coin flip,
+    whatever the number or spread of the weights.
+    """
+    weights = np.asarray(weights, dtype=float)
+    n = len(weights)
+    prob = weights * n / weights.sum()
+    alias = np.arange(n)
+    small = np.flatnonzero(prob < 1).tolist()
+    large = np.flatnonzero(prob >= 1).tolist()
+    while small and large:
+        i = small.pop()
+        j = large.pop()
+        alias[i] = j
+        prob[j] -= 1 - prob[i]
+        (small if prob[j] < 1 else large).append(j)
+    # Whatever is left is 1 up to rounding
+    prob[small + large] = 1
+    return prob, alias
+
+
+def alias_sample(rng, table, size):
+    """Positions drawn from an alias table of `get_alias_table`"""
+    prob, alias = table
+    positions = rng.integers(0, len(prob), size)
+    return np.where(rng.random(size) < prob[positions], positions, alias[positions])
+
+
+def get_pack_pool(player_pack_data, weight=None):
+    """Row positions in `player_pack_data` of each Moment_Tier's sales, with
+    the alias table `simulate_packs` draws them from, and whether a pack's
+    draws must be distinct sales.
+
+    Without a `weight` column every sale is as likely, so moments show up as
+    often as they are traded, and a pack never repeats a sale. With one, each
+    moment (marketplace_id) shows up in proportion to its weight, at the price
+    of one of its sales. Each slot of a pack is then its own draw: a pack can
+    hold two serials of a moment, and keeping sales distinct would make the
+    most circulated moments rarer than their weight.
+    """
+    if weight is None:
+        weights = np.ones(len(player_pack_data))
+    else:
+        sales = player_pack_data.groupby("marketplace_id").marketplace_id.transform(
+            "size"
+        )
+        weights = (player_pack_data[weight].fillna(0) / sales).to_numpy(dtype=float)
+    tiers = player_pack_data.Moment_Tier.astype(str).to_numpy()
+    pool = {}
+    for tier in ["COMMON", "RARE", "LEGENDARY"]:
+        rows = np.flatnonzero((tiers == tier) & (weights > 0))
+        if len(rows):
+            pool[tier] = (rows, get_alias_table(weights[rows]), weight is None)
+    return pool
+
+
+def sample_pack_moments(rng, pool_tier, size):
+    """`(packs, k)` rows from a tier of `get_pack_pool`"""
+    rows, table, distinct = pool_tier
+    positions = alias_sample(rng, table, size)
+    if not distinct:
+        return rows[positions]
+    if len(rows) < size[1]:
+        raise ValueError(f"Cannot take {size[1]} distinct moments from {len(rows)}")
+    while True:
+        ordered = np.sort(positions, axis=1)
+        repeated = (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+        if not repeated.any():
+            return rows[positions]
+        # Only the packs that repeat a sale are redrawn
+        positions[repeated] = alias_sample(rng, table, (repeated.sum(), size[1]))
+
+
+def simulate_packs(pool, proportions, pack_type, n, rng):
+    """Tiers and moments of `n` packs, as `pack_contents` draws them.
+
+    Moments are row positions in the frame `pool` came from, one row per pack,
+    padded with -1 past the last moment of smaller packs.
+    """
+    names = list(proportions)
+    pack_tiers = rng.choice(len(names), size=n, p=list(proportions.values()))
+    contents = [pack_contents[pack_type, x] for x in names]
+    moments = np.full((n, max(sum(x.values()) for x in contents)), -1)
+    for i, tier_contents in enumerate(contents):
+        packs = np.flatnonzero(pack_tiers == i)
+        start = 0
+        for tier, k in tier_contents.items():
+            moments[packs, start : start + k] = sample_pack_moments(
+                rng, pool[tier], (len(packs), k)
+            )
+            start += k
+    return np.array(names)[pack_tiers], moments
 
 
-def get_pack_value(player_pack_data, proporiton_dict, pack_type, i):
-    common = player_pack_data[player_pack_data.Moment_Tier == "COMMON"]
-    rare = player_pack_data[player_pack_data.Moment_Tier == "RARE"]
-    legendary = player_pack_data[player_pack_data.Moment_Tier == "LEGENDARY"]
+def get_pack_values(moments, prices):
+    """Total price of each pack's moments from `simulate_packs`"""
+    return np.where(moments >= 0, prices[moments], 0).sum(axis=1)
 
-    tier = np.random.choice(
-        list(proporiton_dict.keys()), p=list(proporiton_dict.values())
-    )
-    if tier == "COMMON":
-        players = common.sample(4)
-    elif tier == "RARE":
-        if pack_type == "Standard":
-            players = pd.concat([common.sample(3), rare.sample(1)])
-        elif pack_type == "Premium":
-            players = pd.concat([common.sample(6), rare.sample(2)])
-    elif tier == "LEGENDARY":
-        if pack_type == "Standard":
-            players = pd.concat([common.sample(3), legendary.sample(1)])
-        elif pack_type == "Premium":
-            players = pd.concat([common.sample(6), rare.sample(1), legendary.sample(1)])
-    else:
-        raise ValueError
 
-    players = players[["Player", "site", "Moment_Tier", "Price"]]
+def get_pack_rows(player_pack_data, pack_tiers, moments, pack_type):
+    """The moments of packs from `simulate_packs`, one row each, as `mint_pack`
+    shows them"""
+    packs, slots = np.nonzero(moments >= 0)
+    players = player_pack_data[
+        ["Player", "nfl_player_id", "site", "Moment_Tier", "Price"]
+    ].iloc[moments[packs, slots]]
+    players = players.reset_index(drop=True)
     players["pack_type"] = pack_type
-    players["pack_tier"] = tier
-    players["idx"] = i
+    players["pack_tier"] = pack_tiers[packs]
+    players["idx"] = packs
     return players
 
 
+def summarize_pack_values(simulation, weight=None):
+    """Mean and median value of each Pack Type, and how often it beats the
+    cost, noting the `weight` of get_pack_pool the packs were drawn with"""
+    simulation = simulation.assign(
+        above_cost=simulation.Price
+        > simulation["Pack Type"].astype(str).map(pack_costs)
+    )
+    return (
+        simulation.groupby("Pack Type", observed=True)
+        .agg(
+            packs=("Price", "count"),
+            mean=("Price", "mean"),
+            median=("Price", "median"),
+            above_cost=("above_cost", "mean"),
+        )
+        .reset_index()
+        .assign(weight=weight or "")
+    )
+
+
+def get_pack_weight_note(weight):
+    """How the Moments of the simulated packs were drawn, for the app, from the
+    `weight` of summarize_pack_values"""
+    if weight == "Total_Circulation":
+        return (
+            "each Moment appears in proportion to its total circulation, so rarer "
+            "Moments (such as Rare Moments with lower total numbers than other Rare "
+            "Moments) are less likely to appear. A Moment's value is the price of "
+            "one of its actual sales."
+        )
+    if weight:
+        return (
+            f"each Moment appears in proportion to its {weight.replace('_', ' ')}. "
+            "A Moment's value is the price of one of its actual sales."
+        )
+    return (
+        "the process used here does not capture the rarity of certain moments (such "
+        "as some Rare Moments having lower total numbers than other Rare Moments), "
+        "however it does capture the frequency at which each Moment is traded. More "
+        "liquid Moments (with higher numbers of sales) will be more likely to appear."
+    )
+
+
 def mint_pack(sample_df, pack_type):
-    if pack_type == "Standard":
-        n = 10000
-    elif pack_type == "Premium":
-        n = 5000
-    else:
-        raise ValueError
-    randn = np.random.randint(0, n)
+    randn = np.random.randint(0, n_sample_packs[pack_type])
     players = sample_df[(sample_df.idx == randn) & (sample_df.pack_type == pack_type)]
     return players
 
 
 @st.experimental_memo(ttl=3600 * 24, suppress_st_warning=True)
 def load_series2_mint1_grouped():
-    return pd.read_csv("data/cache/series2_mint1_grouped.csv")
+    return set_categories(read_cache("series2_mint1_grouped"))
 
 
 @st.experimental_memo(ttl=3600 * 24, suppress_st_warning=True)
 def load_pack_samples():
-    return pd.read_csv("data/cache/sample_packs.csv.gz")
+    return set_categories(read_cache("sample_packs"))
 
 
 def get_avg_pack_metrics(data):
@@ -1341,16 +1725,22 @@ def get_avg_pack_metrics(data):
 
 @st.experimental_memo(ttl=3600 * 24, suppress_st_warning=True)
 def load_player_mint(date):
-    df = pd.read_csv(
-        f"data/cache/player_mint-{date}--grouped.csv.gz",
-    )
+    df = read_cache("player_mint", date)
     for x in [
         "Datetime",
         "Date",
     ]:
         df[x] = pd.to_datetime(df[x]).dt.tz_convert("US/Eastern")
 
-    return df
+    return set_categories(df)
 @st.experimental_memo(ttl=3600 * 24, suppress_st_warning=True)
 def load_simulation():
-    return pd.read_csv("data/simulation.csv")
+    try:
+        simulation = read_cache("pack_simulation")
+        summary = read_cache("pack_simulation_summary")
+    except KeyError:
+        # Simulated before pack values were part of the cache build, drawing
+        # every sale alike
+        simulation = pd.read_csv("data/simulation.csv")
+        summary = summarize_pack_values(simulation)
+    return set_categories(simulation), summary